@@ -0,0 +1,543 @@
+"""
+Serving benchmark for the Qwen-VL and Qwen-Image endpoints.
+
+Replays a local dataset (synthetic or on-disk) against either
+`/v1/chat/completions` (vLLM, Qwen2.5-VL) or `/generate` (Qwen-Image backend)
+under open-loop (Poisson arrivals) or closed-loop (fixed concurrency) load and
+reports latency, TTFT, throughput and error rate as JSON/CSV.
+
+A stub server is included so the harness can be exercised without a GPU:
+
+    python serve_bench.py stub --port 8000
+    python serve_bench.py run --service vl --base-url http://localhost:8000 \
+        --mode closed --concurrency 8 --num-requests 64
+"""
+
+import argparse
+import base64
+import csv
+import json
+import logging
+import os
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from typing import Any, Dict, Iterator, List, Optional
+
+import requests
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+VL_MODEL = "Qwen/Qwen2.5-VL-7B-Instruct"
+
+SYNTHETIC_VL_PROMPTS = [
+    "Describe this image in detail.",
+    "What objects can you see in this image? List them with their locations.",
+    "What text is visible in this image? Transcribe it exactly.",
+    "Describe the setting, mood, and atmosphere of this scene.",
+    "Explain the concept of computer vision in simple terms.",
+    "Write a short poem about the ocean.",
+]
+
+SYNTHETIC_IMAGE_PROMPTS = [
+    "A beautiful sunset over mountains",
+    "A coffee shop with Chinese and English signage",
+    "A vintage poster showing '1984' in bold letters",
+    "A modern office building with a large LED display showing 'INNOVATION 创新'",
+]
+
+# 1x1 white PNG, used when Pillow is unavailable for synthetic images
+_TINY_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAIAAACQd1PeAAAADElEQVR4nGP4//8/AAX+Av4N70a4AAAAAElFTkSuQmCC"
+)
+
+
+# ---------------------------------------------------------------------------
+# Datasets
+# ---------------------------------------------------------------------------
+
+@dataclass
+class BenchRequest:
+    """One dataset entry, independent of the target service"""
+    prompt: str
+    image_data_url: Optional[str] = None
+    max_tokens: int = 128
+    params: Dict[str, Any] = field(default_factory=dict)
+
+
+def _synthetic_image_data_url(rng: random.Random, size: int) -> str:
+    """Build a random solid-colour JPEG as a data URL"""
+    try:
+        from PIL import Image
+    except ImportError:
+        return "data:image/png;base64," + base64.b64encode(_TINY_PNG).decode()
+
+    color = (rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255))
+    image = Image.new("RGB", (size, size), color)
+    buffered = BytesIO()
+    image.save(buffered, format="JPEG")
+    return "data:image/jpeg;base64," + base64.b64encode(buffered.getvalue()).decode()
+
+
+def _file_data_url(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower().lstrip(".")
+    mime = "jpeg" if ext in ("jpg", "jpeg") else ext
+    with open(path, "rb") as f:
+        return f"data:image/{mime};base64,{base64.b64encode(f.read()).decode()}"
+
+
+def load_synthetic(service: str, num_requests: int, seed: int,
+                   image_ratio: float = 0.5, image_size: int = 448,
+                   max_tokens: int = 128) -> List[BenchRequest]:
+    """Generate a reproducible synthetic dataset for the given service"""
+    rng = random.Random(seed)
+    dataset = []
+    for _ in range(num_requests):
+        if service == "vl":
+            image = None
+            if rng.random() < image_ratio:
+                image = _synthetic_image_data_url(rng, image_size)
+            dataset.append(BenchRequest(
+                prompt=rng.choice(SYNTHETIC_VL_PROMPTS),
+                image_data_url=image,
+                max_tokens=max_tokens,
+            ))
+        else:
+            dataset.append(BenchRequest(
+                prompt=rng.choice(SYNTHETIC_IMAGE_PROMPTS),
+                params={"seed": rng.randint(0, 2147483647)},
+            ))
+    return dataset
+
+
+def load_jsonl(path: str, num_requests: int, seed: int,
+               max_tokens: int = 128) -> List[BenchRequest]:
+    """
+    Load a JSONL dataset. Each line holds a `prompt` and optionally an `image`
+    path (relative to the file), `max_tokens` and extra request `params`.
+    Entries are cycled until `num_requests` is reached.
+    """
+    base_dir = os.path.dirname(os.path.abspath(path))
+    entries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            row = json.loads(line)
+            image = row.get("image")
+            if image and not image.startswith("data:"):
+                image = _file_data_url(os.path.join(base_dir, image))
+            entries.append(BenchRequest(
+                prompt=row["prompt"],
+                image_data_url=image,
+                max_tokens=row.get("max_tokens", max_tokens),
+                params=row.get("params", {}),
+            ))
+    if not entries:
+        raise ValueError(f"Dataset {path} is empty")
+
+    rng = random.Random(seed)
+    rng.shuffle(entries)
+    return [entries[i % len(entries)] for i in range(num_requests)]
+
+
+# ---------------------------------------------------------------------------
+# Request execution
+# ---------------------------------------------------------------------------
+
+@dataclass
+class RequestResult:
+    index: int
+    start: float  # scheduled arrival in open mode, send time in closed mode
+    latency: float = 0.0
+    dispatch_delay: float = 0.0  # time queued in the harness before it could be sent
+    ttft: Optional[float] = None
+    output_tokens: int = 0
+    success: bool = False
+    status_code: Optional[int] = None
+    error: str = ""
+
+
+def _send_chat(session: requests.Session, base_url: str, item: BenchRequest,
+               result: RequestResult, timeout: float) -> None:
+    if item.image_data_url:
+        content = [
+            {"type": "image_url", "image_url": {"url": item.image_data_url}},
+            {"type": "text", "text": item.prompt},
+        ]
+    else:
+        content = item.prompt
+
+    payload = {
+        "model": VL_MODEL,
+        "messages": [{"role": "user", "content": content}],
+        "max_tokens": item.max_tokens,
+        "temperature": 0.0,
+        "stream": True,
+        "stream_options": {"include_usage": True},
+    }
+    payload.update(item.params)
+
+    with session.post(f"{base_url}/v1/chat/completions", json=payload,
+                      stream=True, timeout=timeout) as response:
+        result.status_code = response.status_code
+        response.raise_for_status()
+        chunks = 0
+        for line in response.iter_lines():
+            if not line or not line.startswith(b"data:"):
+                continue
+            data = line[len(b"data:"):].strip()
+            if data == b"[DONE]":
+                break
+            event = json.loads(data)
+            if event.get("usage"):
+                result.output_tokens = event["usage"].get("completion_tokens", 0)
+            for choice in event.get("choices", []):
+                if choice.get("delta", {}).get("content"):
+                    if result.ttft is None:
+                        result.ttft = time.perf_counter() - result.start
+                    chunks += 1
+        if not result.output_tokens:
+            result.output_tokens = chunks
+
+
+def _send_generate(session: requests.Session, base_url: str, item: BenchRequest,
+                   result: RequestResult, timeout: float) -> None:
+    payload = {"prompt": item.prompt}
+    payload.update(item.params)
+
+    response = session.post(f"{base_url}/generate", json=payload, timeout=timeout)
+    result.status_code = response.status_code
+    response.raise_for_status()
+    # /generate is not streamed, so the first byte arrives with the image
+    result.ttft = time.perf_counter() - result.start
+    if not response.json().get("image_base64"):
+        raise ValueError("Response did not contain an image")
+
+
+def run_one(session: requests.Session, service: str, base_url: str,
+            item: BenchRequest, index: int, timeout: float,
+            scheduled: Optional[float] = None) -> RequestResult:
+    """
+    Send a single request and record its timings. Latency and TTFT count from
+    `scheduled` when given, so time spent waiting for a free worker is not
+    silently left out (coordinated omission).
+    """
+    now = time.perf_counter()
+    result = RequestResult(index=index, start=now if scheduled is None else min(scheduled, now))
+    result.dispatch_delay = now - result.start
+    try:
+        if service == "vl":
+            _send_chat(session, base_url, item, result, timeout)
+        else:
+            _send_generate(session, base_url, item, result, timeout)
+        result.success = True
+    except Exception as e:
+        result.error = str(e)[:200]
+    result.latency = time.perf_counter() - result.start
+    return result
+
+
+def _poisson_arrivals(rate: float, seed: int) -> Iterator[float]:
+    rng = random.Random(seed)
+    while True:
+        yield rng.expovariate(rate)
+
+
+def run_benchmark(service: str, base_url: str, dataset: List[BenchRequest],
+                  mode: str = "closed", concurrency: int = 1,
+                  request_rate: float = 1.0, max_inflight: int = 256,
+                  timeout: float = 300.0, seed: int = 0) -> List[RequestResult]:
+    """
+    Run the dataset against `base_url`.
+
+    closed: `concurrency` workers each send the next request as soon as their
+            previous one finishes.
+    open:   requests are dispatched with exponential inter-arrival times at
+            `request_rate` req/s regardless of completions. At most
+            `max_inflight` requests are outstanding; requests beyond that
+            wait in the harness, and that wait counts towards their latency
+            (reported separately as `dispatch_delay`).
+    """
+    base_url = base_url.rstrip("/")
+    workers = concurrency if mode == "closed" else max_inflight
+    local = threading.local()
+
+    def session() -> requests.Session:
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        return local.session
+
+    def task(index: int, scheduled: Optional[float] = None) -> RequestResult:
+        return run_one(session(), service, base_url, dataset[index], index, timeout, scheduled)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        if mode == "closed":
+            futures = [pool.submit(task, i) for i in range(len(dataset))]
+        elif mode == "open":
+            futures = []
+            arrivals = _poisson_arrivals(request_rate, seed)
+            next_send = time.perf_counter()
+            for i in range(len(dataset)):
+                delay = next_send - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                futures.append(pool.submit(task, i, next_send))
+                next_send += next(arrivals)
+        else:
+            raise ValueError(f"Unknown mode: {mode}")
+        return [f.result() for f in futures]
+
+
+# ---------------------------------------------------------------------------
+# Reporting
+# ---------------------------------------------------------------------------
+
+# Dispatch delays below this are thread start-up jitter, not saturation
+LATE_THRESHOLD_S = 0.01
+
+
+def _percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def _distribution(values: List[float]) -> Dict[str, Optional[float]]:
+    return {
+        "mean": statistics.fmean(values) if values else None,
+        "p50": _percentile(values, 50),
+        "p90": _percentile(values, 90),
+        "p99": _percentile(values, 99),
+    }
+
+
+def summarize(results: List[RequestResult], duration: float) -> Dict[str, Any]:
+    """Aggregate per-request results into the benchmark summary"""
+    ok = [r for r in results if r.success]
+    ttfts = [r.ttft for r in ok if r.ttft is not None]
+    output_tokens = sum(r.output_tokens for r in ok)
+    return {
+        "num_requests": len(results),
+        "num_success": len(ok),
+        "num_errors": len(results) - len(ok),
+        "error_rate": (len(results) - len(ok)) / len(results) if results else 0.0,
+        "duration_s": duration,
+        "throughput_rps": len(ok) / duration if duration > 0 else 0.0,
+        "output_tokens_per_s": output_tokens / duration if duration > 0 else 0.0,
+        "latency_s": _distribution([r.latency for r in ok]),
+        "ttft_s": _distribution(ttfts),
+        # Open loop: requests that could not be sent on schedule because
+        # max_inflight requests were already outstanding
+        "num_late": sum(1 for r in results if r.dispatch_delay > LATE_THRESHOLD_S),
+        "dispatch_delay_s": _distribution([r.dispatch_delay for r in results]),
+    }
+
+
+def write_csv(results: List[RequestResult], path: str) -> None:
+    fields = list(asdict(results[0]).keys()) if results else ["index"]
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        for r in results:
+            writer.writerow(asdict(r))
+
+
+# ---------------------------------------------------------------------------
+# Stub server
+# ---------------------------------------------------------------------------
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Minimal stand-in for vLLM and the Qwen-Image backend. Latencies are
+    controlled by the class attributes so tests can tune them.
+    """
+    ttft: float = 0.01
+    token_latency: float = 0.001
+    output_tokens: int = 16
+    generate_latency: float = 0.02
+    error_rate: float = 0.0
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: Dict[str, Any]) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self) -> Dict[str, Any]:
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, {"status": "healthy", "model_loaded": True})
+        else:
+            self._send_json(404, {"detail": "Not Found"})
+
+    def do_POST(self):
+        body = self._read_json()
+        if random.random() < self.error_rate:
+            self._send_json(500, {"detail": "stub error"})
+        elif self.path == "/v1/chat/completions":
+            self._chat(body)
+        elif self.path == "/generate":
+            time.sleep(self.generate_latency)
+            self._send_json(200, {
+                "image_base64": base64.b64encode(_TINY_PNG).decode(),
+                "seed_used": body.get("seed", 0),
+            })
+        else:
+            self._send_json(404, {"detail": "Not Found"})
+
+    def _chat(self, body: Dict[str, Any]) -> None:
+        num_tokens = min(body.get("max_tokens", self.output_tokens), self.output_tokens)
+        time.sleep(self.ttft)
+        if not body.get("stream"):
+            time.sleep(self.token_latency * num_tokens)
+            self._send_json(200, {
+                "choices": [{"index": 0, "message": {"role": "assistant",
+                                                     "content": "tok " * num_tokens}}],
+                "usage": {"completion_tokens": num_tokens},
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def emit(event: str) -> None:
+            data = f"data: {event}\n\n".encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        for i in range(num_tokens):
+            if i:
+                time.sleep(self.token_latency)
+            emit(json.dumps({"choices": [{"index": 0, "delta": {"content": "tok "}}]}))
+        emit(json.dumps({"choices": [], "usage": {"completion_tokens": num_tokens}}))
+        emit("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def start_stub_server(host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Start the stub server on a background thread; port 0 picks a free port"""
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    stub = sub.add_parser("stub", help="Run the stub server")
+    stub.add_argument("--host", default="0.0.0.0")
+    stub.add_argument("--port", type=int, default=8000)
+    stub.add_argument("--ttft", type=float, default=StubHandler.ttft)
+    stub.add_argument("--token-latency", type=float, default=StubHandler.token_latency)
+    stub.add_argument("--generate-latency", type=float, default=StubHandler.generate_latency)
+
+    run = sub.add_parser("run", help="Run a benchmark")
+    run.add_argument("--service", choices=["vl", "image"], required=True)
+    run.add_argument("--base-url", default="http://localhost:8000")
+    run.add_argument("--stub", action="store_true",
+                     help="Start a local stub server and benchmark it")
+    run.add_argument("--dataset", choices=["synthetic", "jsonl"], default="synthetic")
+    run.add_argument("--dataset-path", help="JSONL file for --dataset jsonl")
+    run.add_argument("--num-requests", type=int, default=128)
+    run.add_argument("--image-ratio", type=float, default=0.5,
+                     help="Fraction of synthetic vl requests carrying an image")
+    run.add_argument("--image-size", type=int, default=448)
+    run.add_argument("--max-tokens", type=int, default=128)
+    run.add_argument("--mode", choices=["closed", "open"], default="closed")
+    run.add_argument("--concurrency", type=int, default=8)
+    run.add_argument("--request-rate", type=float, default=4.0,
+                     help="Mean arrival rate (req/s) for --mode open")
+    run.add_argument("--max-inflight", type=int, default=256)
+    run.add_argument("--timeout", type=float, default=300.0)
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--output-json", help="Write the summary as JSON")
+    run.add_argument("--output-csv", help="Write per-request results as CSV")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "stub":
+        StubHandler.ttft = args.ttft
+        StubHandler.token_latency = args.token_latency
+        StubHandler.generate_latency = args.generate_latency
+        server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+        logger.info(f"Stub server listening on {args.host}:{args.port}")
+        server.serve_forever()
+        return {}
+
+    if args.dataset == "jsonl":
+        if not args.dataset_path:
+            parser.error("--dataset jsonl requires --dataset-path")
+        dataset = load_jsonl(args.dataset_path, args.num_requests, args.seed, args.max_tokens)
+    else:
+        dataset = load_synthetic(args.service, args.num_requests, args.seed,
+                                 args.image_ratio, args.image_size, args.max_tokens)
+
+    server = None
+    base_url = args.base_url
+    if args.stub:
+        server = start_stub_server()
+        base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    logger.info(f"Benchmarking {args.service} at {base_url}: {len(dataset)} requests, "
+                f"mode={args.mode}")
+    try:
+        start = time.perf_counter()
+        results = run_benchmark(
+            args.service, base_url, dataset,
+            mode=args.mode,
+            concurrency=args.concurrency,
+            request_rate=args.request_rate,
+            max_inflight=args.max_inflight,
+            timeout=args.timeout,
+            seed=args.seed,
+        )
+        duration = time.perf_counter() - start
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    summary = summarize(results, duration)
+    summary["config"] = {k: v for k, v in vars(args).items() if k != "command"}
+    summary["config"]["base_url"] = base_url
+
+    print(json.dumps(summary, indent=2))
+    if args.output_json:
+        with open(args.output_json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    if args.output_csv:
+        write_csv(results, args.output_csv)
+    return summary
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import serve_bench  # noqa: E402
+
+
+@pytest.fixture
+def stub_url():
+    server = serve_bench.start_stub_server()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def test_closed_loop_chat(stub_url):
+    dataset = serve_bench.load_synthetic("vl", 12, seed=1, image_ratio=0.5, image_size=32)
+    results = serve_bench.run_benchmark("vl", stub_url, dataset, mode="closed", concurrency=4)
+    summary = serve_bench.summarize(results, duration=1.0)
+
+    assert summary["num_success"] == 12
+    assert summary["error_rate"] == 0.0
+    assert summary["ttft_s"]["p50"] is not None
+    assert summary["ttft_s"]["p99"] <= summary["latency_s"]["p99"]
+    assert all(r.output_tokens == serve_bench.StubHandler.output_tokens for r in results)
+
+
+def test_open_loop_generate(stub_url):
+    dataset = serve_bench.load_synthetic("image", 8, seed=2)
+    results = serve_bench.run_benchmark("image", stub_url, dataset, mode="open",
+                                        request_rate=200.0)
+    assert [r.index for r in results] == list(range(8))
+    assert all(r.success for r in results)
+
+
+def test_open_loop_counts_time_queued_in_the_harness(stub_url, monkeypatch):
+    monkeypatch.setattr(serve_bench.StubHandler, "generate_latency", 0.05)
+    dataset = serve_bench.load_synthetic("image", 6, seed=2)
+    # Everything arrives at once but only one request can be outstanding
+    results = serve_bench.run_benchmark("image", stub_url, dataset, mode="open",
+                                        request_rate=1000.0, max_inflight=1)
+    summary = serve_bench.summarize(results, duration=1.0)
+
+    assert results[-1].dispatch_delay >= 0.2
+    assert results[-1].latency >= 0.25
+    assert summary["num_late"] >= 4
+    assert all(r.ttft <= r.latency for r in results)
+
+
+def test_errors_are_counted(stub_url, monkeypatch):
+    monkeypatch.setattr(serve_bench.StubHandler, "error_rate", 1.0)
+    dataset = serve_bench.load_synthetic("image", 4, seed=3)
+    results = serve_bench.run_benchmark("image", stub_url, dataset, concurrency=2)
+    summary = serve_bench.summarize(results, duration=1.0)
+
+    assert summary["error_rate"] == 1.0
+    assert all(r.status_code == 500 for r in results)
+
+
+def test_jsonl_dataset_and_outputs(tmp_path):
+    (tmp_path / "data.jsonl").write_text(
+        json.dumps({"prompt": "hello"}) + "\n" + json.dumps({"prompt": "world"}) + "\n"
+    )
+    out_json = tmp_path / "summary.json"
+    out_csv = tmp_path / "results.csv"
+    summary = serve_bench.main([
+        "run", "--service", "vl", "--stub",
+        "--dataset", "jsonl", "--dataset-path", str(tmp_path / "data.jsonl"),
+        "--num-requests", "5", "--concurrency", "2",
+        "--output-json", str(out_json), "--output-csv", str(out_csv),
+    ])
+
+    assert summary["num_success"] == 5
+    assert json.loads(out_json.read_text())["num_requests"] == 5
+    assert len(out_csv.read_text().strip().splitlines()) == 6
+
+
+def test_percentile():
+    assert serve_bench._percentile([1.0, 2.0, 3.0, 4.0, 5.0], 50) == 3.0
+    assert serve_bench._percentile([], 90) is None
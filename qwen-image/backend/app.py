@@ -1,13 +1,34 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel
-from diffusers import DiffusionPipeline
-import torch
+import asyncio
 import base64
+import hashlib
+import hmac
 from io import BytesIO
 import logging
+import math
 import os
 import random
+import time
 from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Union
+
+from engines import EncodedImage, EngineUnavailable, create_engine
+from model_registry import AdapterSpec, ModelRegistry, UnknownModel, adapters_from_env
+from pipeline_setup import MODEL_ID, MemoryConfig, PrecisionConfig
+from scheduler import FairScheduler, QueueFull, SchedulerRejected
+from sweep import SWEEP_MAX_CELLS, contact_sheet, sweep_grid
+
+from tracing import (
+    CLIENT_REQUEST_ID_HEADER,
+    REQUEST_ID_HEADER,
+    current_trace,
+    finish_trace,
+    span,
+    start_trace,
+    trace_store,
+)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -20,43 +41,90 @@ class GenerationRequest(BaseModel):
     height: int = 1328
     true_cfg_scale: float = 4.0
     seed: int = -1  # -1 means random seed
+    priority: Optional[str] = None  # "interactive" or "batch"; also read from X-Priority
+    model: Optional[str] = None  # registered model or LoRA adapter; default model if empty
+    lora_scale: float = 1.0
 
 class GenerationResponse(BaseModel):
     image_base64: str
     seed_used: int
+    model: str = ""
+    request_id: str = ""
+    timings: Dict[str, float] = {}  # per-stage durations in milliseconds
+
+class SweepRequest(BaseModel):
+    prompt: str
+    negative_prompt: str = " "
+    width: int = 1328
+    height: int = 1328
+    cfg_scales: List[float] = [4.0]
+    steps: List[int] = [50]
+    seeds: List[int] = [-1]  # -1 entries are replaced by random seeds
+    priority: Optional[str] = None
+    model: Optional[str] = None
+    lora_scale: float = 1.0
+    include_images: bool = True  # individual images besides the contact sheet
+    sheet_cell_size: int = 384  # longest thumbnail edge on the contact sheet
+
+class SweepCellResult(BaseModel):
+    cfg_scale: float
+    steps: int
+    seed: int
+    image_base64: Optional[str] = None
+
+class SweepResponse(BaseModel):
+    contact_sheet_base64: str
+    columns: int
+    cells: List[SweepCellResult]
+    model: str = ""
+    request_id: str = ""
+    timings: Dict[str, float] = {}
+
+class LoadModelRequest(BaseModel):
+    model_id: str
+    name: Optional[str] = None  # defaults to DEFAULT_MODEL_NAME
+    make_default: bool = False
+    wait: bool = False  # block until the swap is done instead of loading in the background
+
+class AdapterRequest(BaseModel):
+    name: str
+    source: str  # hub repo id or local path
+    weight_name: Optional[str] = None
+    base_model: Optional[str] = None
 
-# Global model variable
-pipeline = None
+# GPU admission: interactive before batch, fair between clients of a class
+scheduler = FairScheduler(concurrency=int(os.getenv("GPU_CONCURRENCY", "1")))
+DEFAULT_PRIORITY = os.getenv("DEFAULT_PRIORITY", "batch")
+
+# Memory options chosen at startup (see pipeline_setup.py)
+memory_config = MemoryConfig.from_env()
+precision_config = PrecisionConfig.from_env()
+
+# Named models and LoRA adapters; each model runs on the diffusers pipeline,
+# or the CPU stub with ENGINE=stub
+DEFAULT_MODEL_NAME = os.getenv("MODEL_NAME", "qwen-image")
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+# Checkpoints /models/load may fetch besides MODEL_ID
+ALLOWED_MODEL_IDS = {MODEL_ID} | {
+    m.strip() for m in os.getenv("ALLOWED_MODEL_IDS", "").split(",") if m.strip()
+}
+registry = ModelRegistry(
+    lambda model_id: create_engine(memory_config=memory_config, precision_config=precision_config,
+                                   model_id=model_id),
+    adapters_from_env(),
+)
+background_loads = set()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    global pipeline
     try:
-        logger.info("Loading Qwen-Image model...")
-        
-        # Check available GPUs
-        gpu_count = torch.cuda.device_count()
-        logger.info(f"Found {gpu_count} GPUs")
+        logger.info(f"Loading {MODEL_ID} as {DEFAULT_MODEL_NAME}...")
         
         # Set memory management
         os.environ["PYTORCH_CUDA_ALLOC_CONF"] = "expandable_segments:True"
         
-        if gpu_count > 1:
-            device_map = "balanced"
-            torch_dtype = torch.bfloat16
-        else:
-            device_map = "cuda:0"
-            torch_dtype = torch.bfloat16
-        
-        pipeline = DiffusionPipeline.from_pretrained(
-            "Qwen/Qwen-Image",
-            torch_dtype=torch_dtype,
-            trust_remote_code=True,
-            device_map=device_map
-        )
-        
-        logger.info(f"Model loaded across {gpu_count} GPU(s)")
+        await registry.load(DEFAULT_MODEL_NAME, MODEL_ID, make_default=True)
             
     except Exception as e:
         logger.error(f"Failed to load model: {e}")
@@ -69,75 +137,251 @@ async def lifespan(app: FastAPI):
 
 app = FastAPI(title="Qwen-Image Generation Service", lifespan=lifespan)
 
-@app.post("/generate", response_model=GenerationResponse)
-async def generate_image(request: GenerationRequest):
-    if pipeline is None:
-        raise HTTPException(status_code=503, detail="Model not loaded")
+# Probes and trace lookups are not worth keeping in the trace buffer
+UNTRACED_PATHS = ("/health", "/metrics", "/traces")
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    trace = start_trace(
+        f"{request.method} {request.url.path}",
+        request.headers.get(REQUEST_ID_HEADER)
+    )
+    response = await call_next(request)
     
-    try:
-        # Handle seed generation
-        if request.seed == -1:
-            # Generate random seed
-            import random
-            seed_used = random.randint(0, 2147483647)
-        else:
-            seed_used = request.seed
-        
-        logger.info(f"Generating image with seed: {seed_used}")
-        logger.info(f"Prompt: {request.prompt[:100]}...")
-        logger.info(f"Negative prompt: {request.negative_prompt[:50]}...")
-        
-        # Create generator with seed
-        generator = torch.Generator(device="cuda").manual_seed(seed_used)
-        
-        # Generate image using proper Qwen-Image parameters
-        with torch.no_grad():
-            result = pipeline(
-                prompt=request.prompt,
-                negative_prompt=request.negative_prompt,
-                width=request.width,
-                height=request.height,
-                num_inference_steps=request.num_inference_steps,
-                true_cfg_scale=request.true_cfg_scale,
-                generator=generator
-            )
-        
-        image = result.images[0]
-        
-        # Convert to base64
+    if request.url.path.startswith(UNTRACED_PATHS):
+        trace.end = time.perf_counter()
+    else:
+        finish_trace(trace, response.status_code)
+    response.headers[REQUEST_ID_HEADER] = trace.request_id
+    if trace.client_request_id:
+        response.headers[CLIENT_REQUEST_ID_HEADER] = trace.client_request_id
+    response.headers["Server-Timing"] = trace.server_timing_header()
+    return response
+
+def client_identity(http_request: Request) -> str:
+    """Fair-queuing key: API key if given, else client id header, else peer address.
+
+    Only the API key is a credential; X-Client-ID (like X-Priority) is trusted
+    as declared, so callers must not be able to reach the service directly.
+    """
+    api_key = http_request.headers.get("X-API-Key")
+    if api_key:
+        return "key:" + hashlib.sha256(api_key.encode()).hexdigest()[:12]
+    client_id = http_request.headers.get("X-Client-ID")
+    if client_id:
+        return f"client:{client_id}"
+    return f"ip:{http_request.client.host if http_request.client else 'unknown'}"
+
+def encode_image(image, trace, binary: bool = False) -> Union[str, bytes]:
+    """PNG-encode an image and return it as base64, or as PNG bytes if `binary`"""
+    if isinstance(image, EncodedImage):
+        # Already PNG (e.g. written by a worker process into shared memory)
+        try:
+            if binary:
+                return bytes(image.data)
+            with span("base64_encode", trace):
+                return base64.b64encode(image.data).decode()
+        finally:
+            image.release()
+    with span("png_encode", trace):
         buffer = BytesIO()
         image.save(buffer, format='PNG')
-        img_base64 = base64.b64encode(buffer.getvalue()).decode()
-        
-        logger.info(f"Image generated successfully with seed: {seed_used}")
-        
-        return GenerationResponse(image_base64=img_base64, seed_used=seed_used)
+    if binary:
+        return buffer.getvalue()
+    with span("base64_encode", trace):
+        return base64.b64encode(buffer.getvalue()).decode()
+
+def wants_png(http_request: Request) -> bool:
+    """`Accept: image/png` asks /generate for the PNG body instead of base64 JSON"""
+    return "image/png" in http_request.headers.get("Accept", "")
+
+def served_model(engine, adapter) -> str:
+    return f"{engine.model_name}+{adapter.name}" if adapter else engine.model_name
+
+def memory_modes() -> Dict:
+    return getattr(registry.default_engine, "memory_modes", {})
+
+def require_admin(http_request: Request) -> None:
+    """Model management and the trace list are disabled unless ADMIN_TOKEN is set"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled; set ADMIN_TOKEN")
+    token = http_request.headers.get("X-Admin-Token", "")
+    if not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+def run_generation(engine, adapter, request: GenerationRequest, seed_used: int, trace,
+                   binary: bool = False) -> Union[str, bytes]:
+    """Run the engine and encode the image; called on a worker thread"""
+    with engine.use_adapter(adapter, request.lora_scale, trace), span("pipeline", trace):
+        image = engine.generate(request, seed_used, trace)
+    return encode_image(image, trace, binary)
+
+async def run_on_gpu(priority_hint: Optional[str], http_request: Request, fn, *args):
+    """Wait for a scheduler slot, then run `fn(*args)` on a worker thread.
+
+    Scheduler rejections become 429/503 with Retry-After, failures become 500.
+    """
+    priority = scheduler.resolve_class(
+        priority_hint or http_request.headers.get("X-Priority"), DEFAULT_PRIORITY
+    )
+    client_id = client_identity(http_request)
+    trace = current_trace()
+    logger.info(f"Queueing {fn.__name__} ({priority}, {client_id})")
     
+    queue_start = time.perf_counter()
+    try:
+        async with scheduler.slot(priority, client_id):
+            if trace is not None:
+                trace.add_span("queue", queue_start, time.perf_counter(), priority=priority)
+            return await asyncio.to_thread(fn, *args)
+    except SchedulerRejected as e:
+        logger.warning(f"Rejected {priority} request from {client_id}: {e}")
+        status_code = 429 if isinstance(e, QueueFull) else 503
+        raise HTTPException(
+            status_code=status_code,
+            detail=str(e),
+            headers={"Retry-After": str(math.ceil(e.retry_after))}
+        )
+    except EngineUnavailable as e:
+        logger.error(f"Engine unavailable: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(math.ceil(e.retry_after))}
+        )
     except Exception as e:
         logger.error(f"Generation failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/generate", response_model=GenerationResponse)
+async def generate_image(request: GenerationRequest, http_request: Request):
+    if registry.default_engine is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    
+    # Handle seed generation
+    if request.seed == -1:
+        # Generate random seed
+        seed_used = random.randint(0, 2147483647)
+    else:
+        seed_used = request.seed
+    
+    trace = current_trace()
+    binary = wants_png(http_request)
+    
+    logger.info(f"Generating image with seed: {seed_used}")
+    logger.info(f"Prompt: {request.prompt[:100]}...")
+    logger.info(f"Negative prompt: {request.negative_prompt[:50]}...")
+    
+    try:
+        async with registry.acquire(request.model) as (engine, adapter):
+            encoded = await run_on_gpu(request.priority, http_request, run_generation,
+                                       engine, adapter, request, seed_used, trace, binary)
+    except UnknownModel as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+    
+    logger.info(f"Image generated successfully with seed: {seed_used}")
+    
+    if binary:
+        # Request ID and stage timings travel in X-Request-ID / Server-Timing
+        return Response(content=encoded, media_type="image/png", headers={
+            "X-Seed-Used": str(seed_used),
+            "X-Model": served_model(engine, adapter),
+        })
+    return GenerationResponse(
+        image_base64=encoded,
+        seed_used=seed_used,
+        model=served_model(engine, adapter),
+        request_id=trace.request_id if trace else "",
+        timings=trace.timings() if trace else {}
+    )
+
+def run_sweep(engine, adapter, request: SweepRequest, cells, columns: int, trace):
+    """Generate every grid cell, build the contact sheet and encode; called on a worker thread"""
+    with engine.use_adapter(adapter, request.lora_scale, trace), \
+            span("pipeline", trace, cells=len(cells)):
+        images = engine.generate_batch(request, cells, trace)
+    with span("contact_sheet", trace):
+        sheet = contact_sheet(images, cells, columns, request.sheet_cell_size)
+    sheet_base64 = encode_image(sheet, trace)
+    images_base64 = [encode_image(image, trace) for image in images] if request.include_images else []
+    return sheet_base64, images_base64
+
+@app.post("/sweep", response_model=SweepResponse)
+async def sweep_images(request: SweepRequest, http_request: Request):
+    """One prompt over a grid of cfg scales, step counts and seeds.
+
+    Cells share prompt embeddings and per-seed initial noise, and cells with
+    the same cfg and steps run as one batch. The grid costs one queue slot and
+    one prompt encoding; denoising still costs about one image per cell.
+    """
+    if registry.default_engine is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    if not (request.cfg_scales and request.steps and request.seeds):
+        raise HTTPException(status_code=400, detail="cfg_scales, steps and seeds must not be empty")
+    
+    seeds = [random.randint(0, 2147483647) if s == -1 else s for s in request.seeds]
+    cells = sweep_grid(request.cfg_scales, request.steps, seeds)
+    if len(cells) > SWEEP_MAX_CELLS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Sweep has {len(cells)} cells, the limit is {SWEEP_MAX_CELLS}"
+        )
+    # Rows are cfg scales, columns every (steps, seed) pair
+    columns = len(request.steps) * len(seeds)
+    trace = current_trace()
+    
+    logger.info(f"Sweeping {len(request.cfg_scales)} cfg x {len(request.steps)} steps x "
+                f"{len(seeds)} seeds: {request.prompt[:100]}...")
+    try:
+        async with registry.acquire(request.model) as (engine, adapter):
+            sheet_base64, images_base64 = await run_on_gpu(
+                request.priority, http_request, run_sweep,
+                engine, adapter, request, cells, columns, trace
+            )
+    except UnknownModel as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+    
+    return SweepResponse(
+        contact_sheet_base64=sheet_base64,
+        columns=columns,
+        model=served_model(engine, adapter),
+        cells=[
+            SweepCellResult(
+                cfg_scale=cell.cfg, steps=cell.steps, seed=cell.seed,
+                image_base64=images_base64[i] if images_base64 else None
+            )
+            for i, cell in enumerate(cells)
+        ],
+        request_id=trace.request_id if trace else "",
+        timings=trace.timings() if trace else {}
+    )
+
 @app.get("/health")
 async def health_check():
-    gpu_info = {
-        "gpu_count": torch.cuda.device_count(),
-        "gpu_available": torch.cuda.is_available(),
-        "gpu_memory": [f"{torch.cuda.get_device_properties(i).total_memory / 1e9:.1f}GB" 
-                      for i in range(torch.cuda.device_count())]
-    }
+    engine = registry.default_engine
     return {
         "status": "healthy", 
-        "model_loaded": pipeline is not None,
-        "model_name": "Qwen/Qwen-Image",
-        "gpu_info": gpu_info
+        "model_loaded": engine is not None and engine.loaded,
+        "model_name": engine.model_name if engine else None,
+        "engine": engine.name if engine else None,
+        "models": sorted(registry.models),
+        "adapters": sorted(registry.adapters),
+        "memory_config": memory_config.to_dict(),
+        "memory_modes": memory_modes(),
+        "gpu_info": engine.device_info() if engine else {}
     }
 
 @app.get("/model-info")
 async def get_model_info():
     """Get information about the loaded model and supported parameters"""
+    engine = registry.default_engine
     return {
-        "model_name": "Qwen/Qwen-Image",
+        "model_name": engine.model_name if engine else None,
+        "engine": engine.name if engine else None,
+        "models": registry.describe()["models"],
+        "adapters": sorted(registry.adapters),
         "model_type": "Text-to-Image Diffusion Model",
+        "precision": engine.precision_info() if engine else None,
         "capabilities": [
             "High-quality image generation",
             "Complex text rendering (English & Chinese)",
@@ -152,7 +396,10 @@ async def get_model_info():
             "width": "Image width in pixels",
             "height": "Image height in pixels", 
             "true_cfg_scale": "Classifier-free guidance scale (1.0-10.0, default: 4.0)",
-            "seed": "Random seed for reproducible results (-1 for random)"
+            "seed": "Random seed for reproducible results (-1 for random)",
+            "priority": "Scheduling class: interactive or batch (default from DEFAULT_PRIORITY)",
+            "model": "Registered model name or LoRA adapter (default model if empty)",
+            "lora_scale": "LoRA adapter strength (default: 1.0)"
         },
         "recommended_aspect_ratios": {
             "1:1": [1328, 1328],
@@ -165,6 +412,104 @@ async def get_model_info():
         }
     }
 
+@app.get("/metrics")
+async def get_metrics():
+    """Scheduler queue depth, wait times and rejections per priority class,
+    plus the memory modes in effect and GPU memory usage"""
+    return {
+        "scheduler": scheduler.metrics(),
+        "memory_config": memory_config.to_dict(),
+        "memory_modes": memory_modes(),
+        "gpu_memory": registry.default_engine.memory_stats() if registry.default_engine else [],
+        "models": registry.describe()
+    }
+
+@app.get("/models")
+async def list_models():
+    """Registered models, adapters loaded per model, and loads in progress"""
+    return registry.describe()
+
+def _log_background_load(task: asyncio.Task) -> None:
+    """Log a failed background load with its traceback; the registry keeps
+    the error under "loading" in /models"""
+    if task.cancelled():
+        logger.warning("Background model load was cancelled")
+    elif task.exception() is not None:
+        logger.error("Background model load failed", exc_info=task.exception())
+
+@app.post("/models/load")
+async def load_model(request: LoadModelRequest, http_request: Request):
+    """Load a checkpoint alongside the current one, then switch traffic to it
+    once loaded; requests already running finish on the old pipeline"""
+    require_admin(http_request)
+    if request.model_id not in ALLOWED_MODEL_IDS:
+        raise HTTPException(status_code=403, detail=f"{request.model_id!r} is not in ALLOWED_MODEL_IDS")
+    name = request.name or DEFAULT_MODEL_NAME
+    if name in registry.adapters:
+        raise HTTPException(status_code=400, detail=f"{name!r} is an adapter name")
+    if registry.is_loading(name):
+        raise HTTPException(status_code=409, detail=f"{name!r} is already loading")
+    
+    if request.wait:
+        try:
+            await registry.load(name, request.model_id, request.make_default)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Loading {request.model_id} failed: {e}")
+        return registry.describe()
+    
+    task = asyncio.create_task(registry.load(name, request.model_id, request.make_default))
+    background_loads.add(task)
+    task.add_done_callback(background_loads.discard)
+    task.add_done_callback(_log_background_load)
+    return JSONResponse(status_code=202, content={"status": "loading", "name": name,
+                                                  "model_id": request.model_id})
+
+@app.delete("/models/{name}")
+async def remove_model(name: str, http_request: Request):
+    """Drain and unload a model that is not the default"""
+    require_admin(http_request)
+    try:
+        await registry.remove(name)
+    except UnknownModel as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return registry.describe()
+
+@app.post("/models/adapters")
+async def register_adapter(request: AdapterRequest, http_request: Request):
+    """Register a LoRA adapter; it is loaded the first time a request names it"""
+    require_admin(http_request)
+    try:
+        registry.register_adapter(AdapterSpec(**request.model_dump()))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return registry.describe()["adapters"]
+
+@app.delete("/models/adapters/{name}")
+async def remove_adapter(name: str, http_request: Request):
+    """Unregister a LoRA adapter and unload it from every model"""
+    require_admin(http_request)
+    try:
+        await registry.remove_adapter(name)
+    except UnknownModel as e:
+        raise HTTPException(status_code=404, detail=e.args[0])
+    return registry.describe()["adapters"]
+
+@app.get("/traces")
+async def list_traces(http_request: Request, limit: int = 50):
+    """Recent request traces, newest first; lists every client's IDs, so admin-only"""
+    require_admin(http_request)
+    return [t.to_log_record() for t in trace_store.recent(limit)]
+
+@app.get("/traces/{request_id}")
+async def get_trace(request_id: str):
+    """Chrome trace JSON for one request (open in chrome://tracing or Perfetto)"""
+    trace = trace_store.get(request_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return trace.to_chrome_trace()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
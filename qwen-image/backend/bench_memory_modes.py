@@ -0,0 +1,141 @@
+"""
+Compare peak GPU memory and latency of the pipeline memory modes.
+
+Each mode runs in a fresh subprocess so CUDA allocator state and offload hooks
+do not leak between modes. Modes are `+`-joined options:
+
+    python bench_memory_modes.py --width 1664 --height 928 --steps 20 \
+        --modes baseline vae_tiling vae_tiling+vae_slicing model_offload sequential_offload
+
+Options: baseline, vae_tiling, vae_slicing, attention_slicing, model_offload,
+sequential_offload.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+from pipeline_setup import MemoryConfig
+
+DEFAULT_MODES = [
+    "baseline",
+    "vae_tiling",
+    "vae_tiling+vae_slicing",
+    "attention_slicing",
+    "model_offload",
+    "sequential_offload",
+]
+
+
+def parse_mode(mode: str) -> MemoryConfig:
+    config = MemoryConfig()
+    for option in mode.split("+"):
+        if option == "baseline":
+            continue
+        elif option in ("vae_tiling", "vae_slicing", "attention_slicing"):
+            setattr(config, option, True)
+        elif option in ("model_offload", "sequential_offload"):
+            config.cpu_offload = option.split("_")[0]
+        else:
+            raise ValueError(f"Unknown option {option!r} in mode {mode!r}")
+    return config
+
+
+def run_mode(mode: str, args) -> Dict:
+    """Load the pipeline in this process and measure one mode"""
+    import torch
+    from pipeline_setup import PrecisionConfig, load_pipeline
+
+    os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True")
+    load_start = time.perf_counter()
+    pipeline, applied = load_pipeline(parse_mode(mode), PrecisionConfig(quantization=args.quantization))
+    load_time = time.perf_counter() - load_start
+
+    def generate(seed: int) -> float:
+        start = time.perf_counter()
+        with torch.no_grad():
+            pipeline(
+                prompt=args.prompt,
+                negative_prompt=" ",
+                width=args.width,
+                height=args.height,
+                num_inference_steps=args.steps,
+                true_cfg_scale=4.0,
+                generator=torch.Generator(device="cuda").manual_seed(seed),
+            )
+        torch.cuda.synchronize()
+        return time.perf_counter() - start
+
+    # Warm-up run, then measure peaks over the timed runs only
+    generate(0)
+    for i in range(torch.cuda.device_count()):
+        torch.cuda.reset_peak_memory_stats(i)
+    latencies = [generate(seed) for seed in range(1, args.runs + 1)]
+
+    return {
+        "mode": mode,
+        "quantization": args.quantization,
+        "applied": applied,
+        "load_time_s": load_time,
+        "latency_s": latencies,
+        "mean_latency_s": sum(latencies) / len(latencies),
+        "peak_memory_gb": [
+            torch.cuda.max_memory_allocated(i) / 1e9 for i in range(torch.cuda.device_count())
+        ],
+    }
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark pipeline memory modes")
+    parser.add_argument("--modes", nargs="+", default=DEFAULT_MODES)
+    parser.add_argument("--width", type=int, default=1664)
+    parser.add_argument("--height", type=int, default=928)
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--prompt", default="A coffee shop with Chinese and English signage")
+    parser.add_argument("--quantization", choices=["none", "int8", "fp8"], default="none",
+                        help="Weight quantization applied in every mode")
+    parser.add_argument("--output", help="Write results as JSON")
+    parser.add_argument("--run-mode", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_mode:
+        print(json.dumps(run_mode(args.run_mode, args)))
+        return
+
+    for mode in args.modes:
+        parse_mode(mode)  # fail fast on typos
+
+    results = []
+    passthrough = ["--width", str(args.width), "--height", str(args.height),
+                   "--steps", str(args.steps), "--runs", str(args.runs), "--prompt", args.prompt,
+                   "--quantization", args.quantization]
+    for mode in args.modes:
+        print(f"Running mode {mode}...", file=sys.stderr)
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--run-mode", mode] + passthrough,
+            stdout=subprocess.PIPE, text=True,
+        )
+        if proc.returncode != 0:
+            results.append({"mode": mode, "error": f"exit code {proc.returncode}"})
+            continue
+        results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    print(f"\n{'mode':<28} {'mean latency (s)':>16} {'peak memory (GB)':>18}")
+    for r in results:
+        if "error" in r:
+            print(f"{r['mode']:<28} {r['error']:>35}")
+        else:
+            print(f"{r['mode']:<28} {r['mean_latency_s']:>16.2f} {max(r['peak_memory_gb'], default=0):>18.2f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
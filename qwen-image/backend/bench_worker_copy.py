@@ -0,0 +1,148 @@
+"""
+Per-image cost of getting a generated image from the worker process to a
+base64 string in the API process, for each transfer method:
+
+- `pickle`:   PIL image pickled through a pipe, PNG + base64 in the API process
+- `raw_ring`: raw RGB written to the shared-memory ring, PNG + base64 in the API process
+- `png_ring`: PNG written to the ring by the worker, base64 from shared memory
+
+`copy` is the transfer itself (for `png_ring` without the worker's PNG
+encode), `API CPU` is what the API process spends per image, which competes
+with request handling for the GIL. No GPU needed; the worker sends the same
+synthetic image every time.
+
+    python bench_worker_copy.py --width 1328 --height 1328 --images 20
+"""
+
+import argparse
+import base64
+import json
+import multiprocessing as mp
+import pickle
+import statistics
+import time
+from io import BytesIO
+from typing import Dict, List
+
+from PIL import Image
+
+from worker_engine import SharedRing, _write_image
+
+METHODS = ("pickle", "raw_ring", "png_ring")
+
+
+def synthetic_image(width: int, height: int) -> Image.Image:
+    """Smooth gradients plus grain, so PNG sizes resemble real outputs"""
+    import numpy as np
+
+    y, x = np.mgrid[0:height, 0:width]
+    rng = np.random.default_rng(0)
+    pixels = np.stack([x * 255 // width, y * 255 // height, (x + y) * 255 // (width + height)], axis=-1)
+    pixels = pixels + rng.integers(-8, 8, size=pixels.shape)
+    return Image.fromarray(pixels.clip(0, 255).astype("uint8"), "RGB")
+
+
+def _child(conn, ring_name: str, slots: int, slot_size: int, width: int, height: int, method: str):
+    ring = SharedRing(slots, slot_size, name=ring_name)
+    image = synthetic_image(width, height)
+    while True:
+        try:
+            slot = conn.recv()
+        except EOFError:
+            break
+        start = time.perf_counter()
+        if method == "pickle":
+            conn.send_bytes(pickle.dumps(image, protocol=pickle.HIGHEST_PROTOCOL))
+        else:
+            meta = _write_image(ring, slot, image, "png" if method == "png_ring" else "raw")
+            conn.send((meta, time.perf_counter() - start))
+    ring.close()
+
+
+def run_method(method: str, args) -> Dict:
+    ctx = mp.get_context("spawn")
+    ring = SharedRing(2, args.slot_mb * 1024 * 1024)
+    parent_conn, child_conn = ctx.Pipe()
+    proc = ctx.Process(target=_child, args=(child_conn, ring.name, ring.slots, ring.slot_size,
+                                            args.width, args.height, method))
+    proc.start()
+
+    wall, copy, cpu, worker, payload = [], [], [], [], []
+    try:
+        for i in range(args.images + 1):  # first round is warm-up
+            slot = ring.acquire()
+            wall_start, cpu_start = time.perf_counter(), time.process_time()
+            parent_conn.send(slot)
+            if method == "pickle":
+                data = parent_conn.recv_bytes()
+                image = pickle.loads(data)
+                received = time.perf_counter()
+                buffer = BytesIO()
+                image.save(buffer, format="PNG")
+                encoded = base64.b64encode(buffer.getvalue())
+                size, worker_s = len(data), 0.0
+            else:
+                meta, worker_s = parent_conn.recv()
+                view = ring.view(slot, meta["length"])
+                if method == "raw_ring":
+                    image = Image.frombuffer("RGB", tuple(meta["size"]), view, "raw", "RGB", 0, 1)
+                    view.release()
+                    received = time.perf_counter()
+                    buffer = BytesIO()
+                    image.save(buffer, format="PNG")
+                    encoded = base64.b64encode(buffer.getvalue())
+                else:
+                    received = time.perf_counter()
+                    encoded = base64.b64encode(view)
+                    view.release()
+                size = meta["length"]
+            ring.release(slot)
+            if i:
+                wall.append((time.perf_counter() - wall_start) * 1000)
+                # Worker side included: from the request to pixels/PNG usable here
+                copy.append((received - wall_start) * 1000 - (worker_s * 1000 if method == "png_ring" else 0))
+                cpu.append((time.process_time() - cpu_start) * 1000)
+                worker.append(worker_s * 1000)
+                payload.append(size)
+    finally:
+        parent_conn.close()
+        proc.join()
+        ring.close()
+
+    return {
+        "method": method,
+        "wall_ms": statistics.median(wall),
+        "copy_ms": statistics.median(copy),
+        "api_cpu_ms": statistics.median(cpu),
+        "worker_write_ms": statistics.median(worker),
+        "transfer_mb": statistics.median(payload) / 1e6,
+        "base64_mb": len(encoded) / 1e6,
+    }
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark worker -> API image transfer")
+    parser.add_argument("--width", type=int, default=1328)
+    parser.add_argument("--height", type=int, default=1328)
+    parser.add_argument("--images", type=int, default=20)
+    parser.add_argument("--slot-mb", type=int, default=32)
+    parser.add_argument("--methods", nargs="+", choices=METHODS, default=list(METHODS))
+    parser.add_argument("--output", help="Write results as JSON")
+    args = parser.parse_args(argv)
+
+    results = [run_method(method, args) for method in args.methods]
+
+    print(f"\n{args.width}x{args.height}, median of {args.images} images")
+    print(f"{'method':<10} {'wall (ms)':>10} {'copy (ms)':>10} {'API CPU (ms)':>13} "
+          f"{'worker write (ms)':>18} {'transfer (MB)':>14}")
+    for r in results:
+        print(f"{r['method']:<10} {r['wall_ms']:>10.1f} {r['copy_ms']:>10.1f} {r['api_cpu_ms']:>13.1f} "
+              f"{r['worker_write_ms']:>18.1f} {r['transfer_mb']:>14.2f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
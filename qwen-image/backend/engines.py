@@ -0,0 +1,398 @@
+"""
+Image generation engines behind `/generate`.
+
+`app.py` only talks to the `Engine` interface, so the serving logic
+(scheduling, tracing, encoding, errors) runs the same on either engine:
+
+| `ENGINE`    | Engine             | Notes                                        |
+|-------------|--------------------|----------------------------------------------|
+| `diffusers` | `DiffusersEngine`  | Qwen-Image on GPU (default)                  |
+| `stub`      | `StubEngine`       | Seeded noise on CPU, no torch or model needed |
+| `worker`    | `WorkerEngine`     | `WORKER_ENGINE` in a supervised child process (worker_engine.py) |
+
+The stub sleeps `STUB_LATENCY + STUB_STEP_LATENCY * num_inference_steps`
+seconds per image so queueing behaves like a real GPU while tests and
+benchmarks run in CI. A batch of n images costs n images by default, as on a
+GPU that is already saturated by one image; `STUB_BATCH_DISCOUNT` below 1
+charges each extra image in a batch only that fraction.
+
+LoRA adapters are pipeline-wide state, so each engine runs one generation at
+a time with the requested adapter (or none) set; `MAX_ACTIVE_LORAS` adapters
+stay loaded per engine, least recently used evicted first.
+"""
+
+import logging
+import os
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from dataclasses import dataclass
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional, Sequence, Union
+
+from PIL import Image
+
+from model_registry import AdapterCache, AdapterSpec
+from pipeline_setup import MODEL_ID, MemoryConfig, PrecisionConfig
+from sweep import SweepCell, batches
+
+logger = logging.getLogger(__name__)
+
+ENGINES = ("diffusers", "stub", "worker")
+MAX_ACTIVE_LORAS = int(os.getenv("MAX_ACTIVE_LORAS", "4"))
+
+
+class EngineUnavailable(RuntimeError):
+    """The engine cannot take requests right now; `retry_after` is a hint in seconds"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@dataclass
+class EncodedImage:
+    """PNG bytes produced by the engine; call `release` once they are sent"""
+    data: Union[bytes, memoryview]
+    release: Callable[[], None] = lambda: None
+
+
+class Engine:
+    """Interface every engine implements"""
+
+    name = "base"
+    model_name = MODEL_ID
+
+    def __init__(self, max_active_adapters: int = MAX_ACTIVE_LORAS):
+        self._lock = threading.Lock()
+        self.adapters = AdapterCache(self._load_adapter, self._unload_adapter, max_active_adapters)
+
+    @property
+    def loaded(self) -> bool:
+        raise NotImplementedError
+
+    def load(self) -> None:
+        """Load weights; called by the model registry"""
+        raise NotImplementedError
+
+    def unload(self) -> None:
+        """Free the weights once the registry has drained this engine"""
+
+    def generate(self, request, seed: int, trace=None) -> Union[Image.Image, EncodedImage]:
+        """Generate one image for a GenerationRequest; runs on a worker thread
+        inside `use_adapter`. Engines that encode themselves return EncodedImage."""
+        raise NotImplementedError
+
+    def generate_batch(self, request, cells: Sequence[SweepCell], trace=None) -> List[Image.Image]:
+        """One image per sweep cell for a SweepRequest, in cell order.
+
+        The default generates cells one by one; engines override it to share
+        work between cells.
+        """
+        return [
+            self.generate(SimpleNamespace(
+                prompt=request.prompt, negative_prompt=request.negative_prompt,
+                width=request.width, height=request.height,
+                num_inference_steps=cell.steps, true_cfg_scale=cell.cfg,
+            ), cell.seed, trace)
+            for cell in cells
+        ]
+
+    # -- LoRA adapters -----------------------------------------------------
+
+    def _load_adapter(self, spec: AdapterSpec) -> None:
+        raise ValueError(f"The {self.name} engine does not support LoRA adapters")
+
+    def _unload_adapter(self, name: str) -> None:
+        pass
+
+    def _set_adapter(self, spec: Optional[AdapterSpec], scale: float) -> None:
+        """Activate `spec` at `scale`, or disable adapters when None"""
+
+    @contextmanager
+    def use_adapter(self, spec: Optional[AdapterSpec], scale: float = 1.0, trace=None):
+        """Hold the engine for one generation with `spec` (or no adapter) active"""
+        with self._lock:
+            if spec is not None:
+                start = time.perf_counter()
+                if self.adapters.activate(spec) and trace is not None:
+                    trace.add_span("lora_load", start, time.perf_counter(), adapter=spec.name)
+            self._set_adapter(spec, scale)
+            yield
+
+    def unload_adapter(self, name: str) -> None:
+        with self._lock:
+            self.adapters.remove(name)
+
+    def adapter_summary(self) -> Dict[str, Any]:
+        return self.adapters.summary()
+
+    def device_info(self) -> Dict[str, Any]:
+        """Device summary for /health"""
+        return {}
+
+    def precision_info(self) -> Dict[str, Any]:
+        """Weight precision actually in use, for /model-info"""
+        return PrecisionConfig().to_dict()
+
+    def memory_stats(self) -> List[Dict[str, Any]]:
+        """Per-device memory usage for /metrics"""
+        return []
+
+
+class DiffusersEngine(Engine):
+    """The diffusers Qwen-Image pipeline"""
+
+    name = "diffusers"
+
+    def __init__(self, memory_config: MemoryConfig, precision_config: PrecisionConfig,
+                 model_id: str = MODEL_ID):
+        super().__init__()
+        self.memory_config = memory_config
+        self.precision_config = precision_config
+        self.model_name = model_id
+        self.pipeline = None
+        self.memory_modes: Dict[str, Any] = {}
+
+    @property
+    def loaded(self) -> bool:
+        return self.pipeline is not None
+
+    def load(self) -> None:
+        from pipeline_setup import load_pipeline
+
+        self.pipeline, self.memory_modes = load_pipeline(
+            self.memory_config, self.precision_config, self.model_name
+        )
+
+    def precision_info(self) -> Dict[str, Any]:
+        return self.precision_config.to_dict()
+
+    def unload(self) -> None:
+        import gc
+        import torch
+
+        self.pipeline = None
+        gc.collect()
+        torch.cuda.empty_cache()
+
+    def _load_adapter(self, spec: AdapterSpec) -> None:
+        kwargs = {"weight_name": spec.weight_name} if spec.weight_name else {}
+        self.pipeline.load_lora_weights(spec.source, adapter_name=spec.name, **kwargs)
+
+    def _unload_adapter(self, name: str) -> None:
+        self.pipeline.delete_adapters(name)
+
+    def _set_adapter(self, spec: Optional[AdapterSpec], scale: float) -> None:
+        if spec is not None:
+            self.pipeline.enable_lora()
+            self.pipeline.set_adapters([spec.name], adapter_weights=[scale])
+        elif self.adapters.active:
+            self.pipeline.disable_lora()
+
+    def generate(self, request, seed: int, trace=None) -> Image.Image:
+        import torch
+
+        generator = torch.Generator(device="cuda").manual_seed(seed)
+
+        # Record when each denoising step finishes to split the pipeline span
+        # into denoising and VAE decode
+        step_ends = []
+        def on_step_end(pipe, step, timestep, callback_kwargs):
+            step_ends.append(time.perf_counter())
+            return callback_kwargs
+
+        pipeline_start = time.perf_counter()
+        with torch.no_grad():
+            result = self.pipeline(
+                prompt=request.prompt,
+                negative_prompt=request.negative_prompt,
+                width=request.width,
+                height=request.height,
+                num_inference_steps=request.num_inference_steps,
+                true_cfg_scale=request.true_cfg_scale,
+                generator=generator,
+                callback_on_step_end=on_step_end,
+            )
+        pipeline_end = time.perf_counter()
+        if trace is not None and step_ends:
+            trace.add_span("denoise", pipeline_start, step_ends[-1], steps=len(step_ends))
+            trace.add_span("decode", step_ends[-1], pipeline_end)
+        return result.images[0]
+
+    def generate_batch(self, request, cells: Sequence[SweepCell], trace=None) -> List[Image.Image]:
+        """Encode the prompts once, draw one initial noise per seed, and run
+        cells sharing cfg and steps as one batch"""
+        import torch
+
+        pipe = self.pipeline
+        device = pipe._execution_device
+        images: List[Optional[Image.Image]] = [None] * len(cells)
+        with torch.no_grad():
+            start = time.perf_counter()
+            prompt_embeds, prompt_mask = pipe.encode_prompt(prompt=request.prompt, device=device)
+            negative_embeds = negative_mask = None
+            if any(cell.cfg > 1 for cell in cells):
+                negative_embeds, negative_mask = pipe.encode_prompt(
+                    prompt=request.negative_prompt, device=device
+                )
+            if trace is not None:
+                trace.add_span("encode_prompt", start, time.perf_counter())
+
+            # Same generator and shape as a single /generate call, so a cell
+            # starts from exactly the noise /generate would use for its seed
+            noise = {}
+            num_channels = pipe.transformer.config.in_channels // 4
+            for seed in {cell.seed for cell in cells}:
+                generator = torch.Generator(device="cuda").manual_seed(seed)
+                noise[seed] = pipe.prepare_latents(
+                    1, num_channels, request.height, request.width,
+                    prompt_embeds.dtype, device, generator,
+                )
+
+            for cfg, steps, indexes in batches(cells):
+                n = len(indexes)
+                batch_start = time.perf_counter()
+                kwargs = {}
+                if cfg > 1:
+                    kwargs = {
+                        "negative_prompt_embeds": negative_embeds.repeat(n, 1, 1),
+                        "negative_prompt_embeds_mask": negative_mask.repeat(n, 1),
+                    }
+                result = pipe(
+                    prompt_embeds=prompt_embeds.repeat(n, 1, 1),
+                    prompt_embeds_mask=prompt_mask.repeat(n, 1),
+                    latents=torch.cat([noise[cells[i].seed] for i in indexes]),
+                    width=request.width,
+                    height=request.height,
+                    num_inference_steps=steps,
+                    true_cfg_scale=cfg,
+                    **kwargs,
+                )
+                if trace is not None:
+                    trace.add_span("batch", batch_start, time.perf_counter(),
+                                   cfg=cfg, steps=steps, size=n)
+                for i, image in zip(indexes, result.images):
+                    images[i] = image
+        return images
+
+    def device_info(self) -> Dict[str, Any]:
+        import torch
+
+        return {
+            "gpu_count": torch.cuda.device_count(),
+            "gpu_available": torch.cuda.is_available(),
+            "gpu_memory": [f"{torch.cuda.get_device_properties(i).total_memory / 1e9:.1f}GB"
+                           for i in range(torch.cuda.device_count())],
+        }
+
+    def memory_stats(self) -> List[Dict[str, Any]]:
+        from pipeline_setup import gpu_memory_stats
+
+        return gpu_memory_stats()
+
+
+class StubEngine(Engine):
+    """Deterministic CPU engine: seeded RGB noise with simulated latency"""
+
+    name = "stub"
+
+    def __init__(self, latency: float = 0.0, step_latency: float = 0.0,
+                 model_id: str = "stub/seeded-noise", batch_discount: float = 1.0):
+        super().__init__()
+        self.latency = latency
+        self.step_latency = step_latency
+        self.batch_discount = batch_discount
+        self.model_name = model_id
+        self._loaded = False
+        self._adapter: Optional[str] = None
+        self.generated = 0
+        self.prompt_encodes = 0
+
+    @classmethod
+    def from_env(cls, model_id: str = "stub/seeded-noise") -> "StubEngine":
+        return cls(
+            latency=float(os.getenv("STUB_LATENCY", "0")),
+            step_latency=float(os.getenv("STUB_STEP_LATENCY", "0")),
+            model_id=model_id,
+            batch_discount=float(os.getenv("STUB_BATCH_DISCOUNT", "1")),
+        )
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def load(self) -> None:
+        self._loaded = True
+
+    def unload(self) -> None:
+        self._loaded = False
+
+    def _load_adapter(self, spec: AdapterSpec) -> None:
+        pass
+
+    def _set_adapter(self, spec: Optional[AdapterSpec], scale: float) -> None:
+        self._adapter = f"{spec.name}@{scale:g}" if spec is not None else None
+
+    def _simulate(self, steps: int, size: int = 1) -> None:
+        delay = (self.latency + self.step_latency * steps) * (1 + (size - 1) * self.batch_discount)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _noise(self, seed: int, width: int, height: int) -> Image.Image:
+        import numpy as np
+
+        # Same seed, size, model and adapter always give the same pixels, like
+        # a seeded pipeline
+        salt = zlib.crc32(f"{self.model_name}|{self._adapter or ''}".encode())
+        rng = np.random.default_rng([seed, salt])
+        pixels = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+        self.generated += 1
+        return Image.fromarray(pixels, "RGB")
+
+    def generate(self, request, seed: int, trace=None) -> Image.Image:
+        start = time.perf_counter()
+        self.prompt_encodes += 1
+        self._simulate(request.num_inference_steps)
+        image = self._noise(seed, request.width, request.height)
+        if trace is not None:
+            trace.add_span("denoise", start, time.perf_counter(),
+                           steps=request.num_inference_steps, simulated=True)
+        return image
+
+    def generate_batch(self, request, cells: Sequence[SweepCell], trace=None) -> List[Image.Image]:
+        # The prompt is encoded once for the whole grid, like DiffusersEngine
+        self.prompt_encodes += 1
+        images: List[Optional[Image.Image]] = [None] * len(cells)
+        for cfg, steps, indexes in batches(cells):
+            start = time.perf_counter()
+            self._simulate(steps, len(indexes))
+            for i in indexes:
+                images[i] = self._noise(cells[i].seed, request.width, request.height)
+            if trace is not None:
+                trace.add_span("batch", start, time.perf_counter(),
+                               cfg=cfg, steps=steps, size=len(indexes), simulated=True)
+        return images
+
+    def device_info(self) -> Dict[str, Any]:
+        return {"gpu_count": 0, "gpu_available": False, "gpu_memory": [],
+                "simulated_latency_s": self.latency, "simulated_step_latency_s": self.step_latency,
+                "simulated_batch_discount": self.batch_discount}
+
+
+def create_engine(name: Optional[str] = None, memory_config: Optional[MemoryConfig] = None,
+                  precision_config: Optional[PrecisionConfig] = None,
+                  model_id: str = MODEL_ID) -> Engine:
+    """Engine selected by `name` or the ENGINE environment variable"""
+    name = (name or os.getenv("ENGINE", "diffusers")).strip().lower()
+    if name == "diffusers":
+        return DiffusersEngine(memory_config or MemoryConfig.from_env(),
+                               precision_config or PrecisionConfig.from_env(), model_id)
+    if name == "stub":
+        return StubEngine.from_env(model_id)
+    if name == "worker":
+        from worker_engine import WorkerEngine
+
+        return WorkerEngine(model_id)
+    raise ValueError(f"ENGINE must be one of {', '.join(ENGINES)}, got {name!r}")
@@ -0,0 +1,211 @@
+"""
+Model registry: named engines that can be swapped without a restart, plus
+LoRA adapters loaded on demand.
+
+A request's `model` field names either a registered model or a LoRA adapter
+(which runs on its base model); empty means the default model.
+
+Hot swap: `load(name, model_id)` builds and loads the new engine alongside the
+current one, then points `name` at it in a single assignment on the event
+loop. Requests that already resolved the old engine (including those still
+queued) finish on it; once they have drained the old engine is unloaded.
+Loading alongside needs memory for both pipelines while the swap is running.
+
+Adapters: every engine keeps at most `max_active` adapters loaded and evicts
+the least recently used one when another is needed.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class UnknownModel(KeyError):
+    pass
+
+
+@dataclass
+class AdapterSpec:
+    name: str
+    source: str  # hub repo id or local path
+    weight_name: Optional[str] = None
+    base_model: Optional[str] = None  # registered model name; default model if empty
+
+
+def adapters_from_env() -> Dict[str, AdapterSpec]:
+    """LORA_ADAPTERS: JSON object of name -> source, or name -> {source, weight_name, base_model}"""
+    raw = os.getenv("LORA_ADAPTERS", "").strip()
+    if not raw:
+        return {}
+    adapters = {}
+    for name, spec in json.loads(raw).items():
+        if isinstance(spec, str):
+            spec = {"source": spec}
+        adapters[name] = AdapterSpec(name=name, **spec)
+    return adapters
+
+
+class AdapterCache:
+    """LRU of adapters loaded into one pipeline; not thread-safe, callers hold the engine lock"""
+
+    def __init__(self, load_fn: Callable[[AdapterSpec], None], unload_fn: Callable[[str], None],
+                 max_active: int = 4):
+        self.load_fn = load_fn
+        self.unload_fn = unload_fn
+        self.max_active = max_active
+        self.active: "OrderedDict[str, AdapterSpec]" = OrderedDict()
+        self.stats = {"hits": 0, "loads": 0, "evictions": 0}
+
+    def activate(self, spec: AdapterSpec) -> bool:
+        """Make sure `spec` is loaded; returns True if it had to be loaded"""
+        if spec.name in self.active:
+            self.active.move_to_end(spec.name)
+            self.stats["hits"] += 1
+            return False
+        while len(self.active) >= self.max_active:
+            evicted, _ = self.active.popitem(last=False)
+            logger.info(f"Evicting LoRA adapter {evicted}")
+            self.unload_fn(evicted)
+            self.stats["evictions"] += 1
+        start = time.perf_counter()
+        self.load_fn(spec)
+        self.active[spec.name] = spec
+        self.stats["loads"] += 1
+        logger.info(f"Loaded LoRA adapter {spec.name} in {time.perf_counter() - start:.1f}s")
+        return True
+
+    def remove(self, name: str) -> None:
+        if self.active.pop(name, None) is not None:
+            self.unload_fn(name)
+
+    def summary(self) -> Dict[str, Any]:
+        return {"active": list(self.active), "max_active": self.max_active, **self.stats}
+
+
+class ModelRegistry:
+    """Named engines with drain-then-swap reloads; all methods run on the event loop"""
+
+    def __init__(self, factory: Callable[[str], Any], adapters: Optional[Dict[str, AdapterSpec]] = None):
+        self.factory = factory
+        self.models: Dict[str, Any] = {}
+        self.default: Optional[str] = None
+        self.adapters: Dict[str, AdapterSpec] = dict(adapters or {})
+        self.loading: Dict[str, str] = {}  # name -> model id being loaded, or the failure
+        self._inflight: Dict[Any, int] = {}
+        self._drained = asyncio.Condition()
+
+    # -- lookup ------------------------------------------------------------
+
+    @property
+    def default_engine(self):
+        return self.models.get(self.default) if self.default else None
+
+    def resolve(self, model: Optional[str]) -> Tuple[str, Any, Optional[AdapterSpec]]:
+        """(model name, engine, adapter) for a request's `model` field"""
+        if not model:
+            if self.default_engine is None:
+                raise UnknownModel("No model loaded")
+            return self.default, self.default_engine, None
+        if model in self.models:
+            return model, self.models[model], None
+        for name, engine in self.models.items():
+            if engine.model_name == model:
+                return name, engine, None
+        adapter = self.adapters.get(model)
+        if adapter is not None:
+            base = adapter.base_model or self.default
+            if base not in self.models:
+                raise UnknownModel(f"Base model {base!r} of adapter {model!r} is not loaded")
+            return base, self.models[base], adapter
+        raise UnknownModel(f"Unknown model {model!r}")
+
+    @asynccontextmanager
+    async def acquire(self, model: Optional[str]):
+        """Resolve `model` and keep its engine from being unloaded until the block exits"""
+        name, engine, adapter = self.resolve(model)
+        self._inflight[engine] = self._inflight.get(engine, 0) + 1
+        try:
+            yield engine, adapter
+        finally:
+            self._inflight[engine] -= 1
+            if not self._inflight[engine]:
+                del self._inflight[engine]
+                async with self._drained:
+                    self._drained.notify_all()
+
+    # -- lifecycle ---------------------------------------------------------
+
+    def is_loading(self, name: str) -> bool:
+        return name in self.loading and not self.loading[name].startswith("failed: ")
+
+    async def _retire(self, engine) -> None:
+        """Wait for in-flight requests on `engine`, then free it"""
+        async with self._drained:
+            await self._drained.wait_for(lambda: engine not in self._inflight)
+        await asyncio.to_thread(engine.unload)
+        logger.info(f"Unloaded {engine.model_name}")
+
+    async def load(self, name: str, model_id: str, make_default: bool = False) -> None:
+        """Load `model_id` as `name` alongside whatever serves `name` now, then swap"""
+        if self.is_loading(name):
+            raise ValueError(f"{name!r} is already loading")
+        self.loading[name] = model_id
+        start = time.perf_counter()
+        try:
+            engine = self.factory(model_id)
+            await asyncio.to_thread(engine.load)
+        except Exception as e:
+            logger.error(f"Loading {model_id} as {name} failed: {e}")
+            self.loading[name] = f"failed: {e}"
+            raise
+        del self.loading[name]
+
+        old = self.models.get(name)
+        self.models[name] = engine
+        if make_default or self.default is None:
+            self.default = name
+        logger.info(f"{name} now serves {model_id} (loaded in {time.perf_counter() - start:.1f}s)")
+        if old is not None:
+            await self._retire(old)
+
+    async def remove(self, name: str) -> None:
+        if name not in self.models:
+            raise UnknownModel(f"Unknown model {name!r}")
+        if name == self.default:
+            raise ValueError("Cannot remove the default model")
+        await self._retire(self.models.pop(name))
+
+    def register_adapter(self, spec: AdapterSpec) -> None:
+        if spec.name in self.models:
+            raise ValueError(f"{spec.name!r} is already a model name")
+        self.adapters[spec.name] = spec
+
+    async def remove_adapter(self, name: str) -> None:
+        if self.adapters.pop(name, None) is None:
+            raise UnknownModel(f"Unknown adapter {name!r}")
+        for engine in list(self.models.values()):
+            await asyncio.to_thread(engine.unload_adapter, name)
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "default": self.default,
+            "models": {
+                name: {
+                    "model_id": engine.model_name,
+                    "engine": engine.name,
+                    "in_flight": self._inflight.get(engine, 0),
+                    "adapters": engine.adapter_summary(),
+                }
+                for name, engine in self.models.items()
+            },
+            "loading": dict(self.loading),
+            "adapters": {name: asdict(spec) for name, spec in self.adapters.items()},
+        }
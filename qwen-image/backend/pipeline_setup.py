@@ -0,0 +1,187 @@
+"""
+Loading the Qwen-Image pipeline with the memory options chosen at startup.
+
+All options come from environment variables so the same image can be tuned
+per instance type:
+
+| Variable            | Values                        | Effect                                   |
+|---------------------|-------------------------------|------------------------------------------|
+| `VAE_TILING`        | `0` / `1`                     | Decode latents tile by tile              |
+| `VAE_SLICING`       | `0` / `1`                     | Decode batched latents one at a time     |
+| `ATTENTION_SLICING` | `0` / `1`                     | Compute attention in slices              |
+| `CPU_OFFLOAD`       | `none` / `model` / `sequential` | Keep weights on CPU between uses       |
+| `QUANTIZATION`      | `none` / `int8` / `fp8`       | Weight-only quantization (torchao)       |
+| `QUANTIZE_COMPONENTS` | comma-separated             | Components to quantize                   |
+"""
+
+import logging
+import os
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Checkpoint served as the default model (see model_registry.py)
+MODEL_ID = os.getenv("MODEL_ID", "Qwen/Qwen-Image")
+CPU_OFFLOAD_MODES = ("none", "model", "sequential")
+
+
+def _env_flag(name: str, default: bool = False) -> bool:
+    return os.getenv(name, "1" if default else "0").strip().lower() in ("1", "true", "yes", "on")
+
+
+@dataclass
+class MemoryConfig:
+    vae_tiling: bool = False
+    vae_slicing: bool = False
+    attention_slicing: bool = False
+    cpu_offload: str = "none"
+
+    @classmethod
+    def from_env(cls) -> "MemoryConfig":
+        config = cls(
+            vae_tiling=_env_flag("VAE_TILING"),
+            vae_slicing=_env_flag("VAE_SLICING"),
+            attention_slicing=_env_flag("ATTENTION_SLICING"),
+            cpu_offload=os.getenv("CPU_OFFLOAD", "none").strip().lower(),
+        )
+        if config.cpu_offload not in CPU_OFFLOAD_MODES:
+            raise ValueError(
+                f"CPU_OFFLOAD must be one of {', '.join(CPU_OFFLOAD_MODES)}, got {config.cpu_offload!r}"
+            )
+        return config
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+# QUANTIZATION value -> torchao weight-only quantization config class
+QUANTIZATION_TYPES = {
+    "int8": "Int8WeightOnlyConfig",
+    "fp8": "Float8WeightOnlyConfig",
+}
+DEFAULT_QUANTIZE_COMPONENTS = ("transformer", "text_encoder")
+# Pipeline components that are transformers models; everything else is a
+# diffusers model and takes the diffusers TorchAoConfig
+TRANSFORMERS_COMPONENTS = ("text_encoder",)
+
+
+@dataclass
+class PrecisionConfig:
+    quantization: str = "none"
+    components: Tuple[str, ...] = DEFAULT_QUANTIZE_COMPONENTS
+
+    @classmethod
+    def from_env(cls) -> "PrecisionConfig":
+        quantization = os.getenv("QUANTIZATION", "none").strip().lower()
+        if quantization != "none" and quantization not in QUANTIZATION_TYPES:
+            raise ValueError(
+                f"QUANTIZATION must be none, {' or '.join(QUANTIZATION_TYPES)}, got {quantization!r}"
+            )
+        components = os.getenv("QUANTIZE_COMPONENTS")
+        components = tuple(c.strip() for c in components.split(",") if c.strip()) if components else ()
+        return cls(quantization=quantization, components=components or DEFAULT_QUANTIZE_COMPONENTS)
+
+    def quant_mapping_spec(self) -> Dict[str, Tuple[str, str]]:
+        """component -> (library, torchao config class) for the quantized components"""
+        if self.quantization == "none":
+            return {}
+        quant_type = QUANTIZATION_TYPES[self.quantization]
+        return {
+            component: ("transformers" if component in TRANSFORMERS_COMPONENTS else "diffusers", quant_type)
+            for component in self.components
+        }
+
+    def quantization_config(self):
+        """diffusers PipelineQuantizationConfig, or None for plain bf16"""
+        spec = self.quant_mapping_spec()
+        if not spec:
+            return None
+        import torchao.quantization
+        from diffusers import TorchAoConfig as DiffusersTorchAoConfig
+        from diffusers.quantizers import PipelineQuantizationConfig
+        from transformers import TorchAoConfig as TransformersTorchAoConfig
+
+        libraries = {"diffusers": DiffusersTorchAoConfig, "transformers": TransformersTorchAoConfig}
+        return PipelineQuantizationConfig(quant_mapping={
+            component: libraries[library](getattr(torchao.quantization, quant_type)())
+            for component, (library, quant_type) in spec.items()
+        })
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "compute_dtype": "bfloat16",
+            "weights": "bfloat16" if self.quantization == "none" else self.quantization,
+            "quantized_components": list(self.components) if self.quantization != "none" else [],
+            "quantization_backend": None if self.quantization == "none" else "torchao",
+            "quant_type": QUANTIZATION_TYPES.get(self.quantization),
+        }
+
+
+def apply_memory_modes(pipeline, config: MemoryConfig) -> Dict[str, Any]:
+    """Enable the configured options; returns what was actually applied"""
+    applied: Dict[str, Any] = {}
+
+    def enable(name: str, fn) -> None:
+        try:
+            fn()
+            applied[name] = True
+        except Exception as e:
+            logger.warning(f"{name} not supported by this pipeline: {e}")
+            applied[name] = f"unsupported: {e}"
+
+    if config.vae_tiling:
+        enable("vae_tiling", pipeline.vae.enable_tiling)
+    if config.vae_slicing:
+        enable("vae_slicing", pipeline.vae.enable_slicing)
+    if config.attention_slicing:
+        enable("attention_slicing", pipeline.enable_attention_slicing)
+    if config.cpu_offload == "model":
+        enable("cpu_offload", pipeline.enable_model_cpu_offload)
+    elif config.cpu_offload == "sequential":
+        enable("cpu_offload", pipeline.enable_sequential_cpu_offload)
+    return applied
+
+
+def load_pipeline(config: MemoryConfig, precision: Optional[PrecisionConfig] = None,
+                  model_id: str = MODEL_ID):
+    """Load the diffusers pipeline, quantized if requested, and apply the memory options.
+
+    Returns (pipeline, applied modes).
+    """
+    import torch
+    from diffusers import DiffusionPipeline
+
+    gpu_count = torch.cuda.device_count()
+    logger.info(f"Found {gpu_count} GPUs")
+
+    load_kwargs: Dict[str, Any] = {
+        "torch_dtype": torch.bfloat16,
+    }
+    if config.cpu_offload == "none":
+        # Offloading manages device placement itself and cannot be combined
+        # with a device map
+        load_kwargs["device_map"] = "balanced" if gpu_count > 1 else "cuda:0"
+    if precision is not None and precision.quantization != "none":
+        load_kwargs["quantization_config"] = precision.quantization_config()
+        logger.info(f"Quantizing {', '.join(precision.components)} to {precision.quantization}")
+
+    pipeline = DiffusionPipeline.from_pretrained(model_id, **load_kwargs)
+    applied = apply_memory_modes(pipeline, config)
+    logger.info(f"Model loaded across {gpu_count} GPU(s), memory modes: {applied or 'none'}")
+    return pipeline, applied
+
+
+def gpu_memory_stats() -> list:
+    """Current and peak allocated memory per GPU in GB"""
+    import torch
+
+    return [
+        {
+            "device": i,
+            "allocated_gb": round(torch.cuda.memory_allocated(i) / 1e9, 2),
+            "peak_allocated_gb": round(torch.cuda.max_memory_allocated(i) / 1e9, 2),
+            "reserved_gb": round(torch.cuda.memory_reserved(i) / 1e9, 2),
+        }
+        for i in range(torch.cuda.device_count())
+    ]
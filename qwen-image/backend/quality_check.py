@@ -0,0 +1,129 @@
+"""
+Quality regression check for quantized weights.
+
+Generates the same prompts at fixed seeds on a bf16 baseline server and on a
+candidate (e.g. QUANTIZATION=int8) server, then compares the images pixel by
+pixel. Fails (exit code 1) if any pair drops below the PSNR threshold.
+
+    python quality_check.py --baseline-url http://bf16:8000 --candidate-url http://int8:8000 \
+        --save-dir quality_out
+"""
+
+import argparse
+import base64
+import json
+import math
+import os
+import sys
+from io import BytesIO
+from typing import Dict, List
+
+import numpy as np
+import requests
+from PIL import Image
+
+DEFAULT_PROMPTS = [
+    "A coffee shop with Chinese and English signage",
+    "A vintage poster showing '1984' in bold letters with Chinese characters '一九八四' underneath",
+    "A dynamic sports action shot of a skier launching off a massive jump, photorealistic",
+    "A bowl of ramen on a wooden table, soft window light",
+]
+
+
+def generate(base_url: str, prompt: str, seed: int, args) -> Image.Image:
+    response = requests.post(f"{base_url.rstrip('/')}/generate", json={
+        "prompt": prompt,
+        "num_inference_steps": args.steps,
+        "width": args.width,
+        "height": args.height,
+        "true_cfg_scale": 4.0,
+        "seed": seed,
+        "priority": "batch",
+    }, timeout=args.timeout)
+    response.raise_for_status()
+    return Image.open(BytesIO(base64.b64decode(response.json()["image_base64"]))).convert("RGB")
+
+
+def compare(baseline: Image.Image, candidate: Image.Image) -> Dict[str, float]:
+    a = np.asarray(baseline, dtype=np.float64)
+    b = np.asarray(candidate, dtype=np.float64)
+    mse = float(np.mean((a - b) ** 2))
+    return {
+        "psnr_db": float("inf") if mse == 0 else 10 * math.log10(255.0 ** 2 / mse),
+        "mean_abs_diff": float(np.mean(np.abs(a - b))),
+        "max_abs_diff": float(np.max(np.abs(a - b))),
+    }
+
+
+def json_safe(value):
+    """Replace infinite PSNR (identical images) with None so the report is valid JSON"""
+    if isinstance(value, float) and math.isinf(value):
+        return None
+    if isinstance(value, dict):
+        return {k: json_safe(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [json_safe(v) for v in value]
+    return value
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare quantized vs bf16 outputs at fixed seeds")
+    parser.add_argument("--baseline-url", required=True, help="Server running bf16 weights")
+    parser.add_argument("--candidate-url", required=True, help="Server running quantized weights")
+    parser.add_argument("--prompts-file", help="One prompt per line (default: built-in set)")
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0, 42])
+    parser.add_argument("--steps", type=int, default=30)
+    parser.add_argument("--width", type=int, default=1328)
+    parser.add_argument("--height", type=int, default=1328)
+    parser.add_argument("--min-psnr", type=float, default=20.0,
+                        help="Minimum PSNR (dB) for every image pair")
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--save-dir", help="Save baseline/candidate images side by side")
+    parser.add_argument("--output", help="Write the report as JSON")
+    args = parser.parse_args(argv)
+
+    prompts = DEFAULT_PROMPTS
+    if args.prompts_file:
+        with open(args.prompts_file, encoding="utf-8") as f:
+            prompts = [line.strip() for line in f if line.strip()]
+    if not prompts:
+        parser.error("no prompts to compare")
+
+    candidate_info = requests.get(f"{args.candidate_url.rstrip('/')}/model-info", timeout=10).json()
+    print(f"Candidate precision: {candidate_info.get('precision')}")
+
+    results = []
+    for p_idx, prompt in enumerate(prompts):
+        for seed in args.seeds:
+            baseline = generate(args.baseline_url, prompt, seed, args)
+            candidate = generate(args.candidate_url, prompt, seed, args)
+            metrics = compare(baseline, candidate)
+            metrics.update({"prompt": prompt, "seed": seed, "passed": metrics["psnr_db"] >= args.min_psnr})
+            results.append(metrics)
+            print(f"[{'PASS' if metrics['passed'] else 'FAIL'}] seed={seed} "
+                  f"psnr={metrics['psnr_db']:.2f}dB mad={metrics['mean_abs_diff']:.2f} {prompt[:50]}")
+
+            if args.save_dir:
+                os.makedirs(args.save_dir, exist_ok=True)
+                pair = Image.new("RGB", (baseline.width * 2, baseline.height))
+                pair.paste(baseline, (0, 0))
+                pair.paste(candidate, (baseline.width, 0))
+                pair.save(os.path.join(args.save_dir, f"prompt{p_idx}_seed{seed}.png"))
+
+    passed = all(r["passed"] for r in results)
+    report = {
+        "candidate_precision": candidate_info.get("precision"),
+        "min_psnr_db": args.min_psnr,
+        "mean_psnr_db": sum(r["psnr_db"] for r in results) / len(results),
+        "passed": passed,
+        "results": results,
+    }
+    print(f"Mean PSNR {report['mean_psnr_db']:.2f}dB -> {'PASSED' if passed else 'FAILED'}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(json_safe(report), f, indent=2, allow_nan=False)
+    return 0 if passed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
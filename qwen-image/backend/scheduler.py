@@ -0,0 +1,224 @@
+"""
+GPU request scheduler for the Qwen-Image backend.
+
+Requests wait for one of `concurrency` GPU slots. Waiting requests are ordered
+by priority class first (interactive before batch), then fairly between
+clients of the same class: the client that has used the least GPU time gets
+the next slot, so a bulk job posting hundreds of requests cannot crowd out
+other clients. A client that becomes active starts at the least-served active
+client's usage instead of zero, so idle periods do not bank a burst.
+
+Each class has a maximum queue depth (rejected immediately when full) and a
+maximum queue wait (rejected when exceeded).
+
+    async with scheduler.slot("interactive", client_id="alice"):
+        image = await asyncio.to_thread(run_pipeline)
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SchedulerRejected(Exception):
+    """Request was not admitted; `retry_after` is a hint in seconds"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class QueueFull(SchedulerRejected):
+    pass
+
+
+class QueueTimeout(SchedulerRejected):
+    pass
+
+
+@dataclass
+class PriorityClass:
+    name: str
+    rank: int  # lower is served first
+    max_queue_wait: float
+    max_queue_depth: int
+
+
+@dataclass
+class _Waiter:
+    future: asyncio.Future
+    client_id: str
+    enqueued: float
+
+
+@dataclass
+class _ClassState:
+    config: PriorityClass
+    queues: "OrderedDict[str, Deque[_Waiter]]" = field(default_factory=OrderedDict)
+    served: Dict[str, float] = field(default_factory=dict)  # GPU seconds per client
+    depth: int = 0
+    running: int = 0
+    completed: int = 0
+    rejected_full: int = 0
+    rejected_timeout: int = 0
+    waits: Deque[float] = field(default_factory=lambda: deque(maxlen=1000))
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round((len(ordered) - 1) * pct / 100)))]
+
+
+def default_classes() -> List[PriorityClass]:
+    """Priority classes configured from the environment"""
+    return [
+        PriorityClass(
+            name="interactive",
+            rank=0,
+            max_queue_wait=float(os.getenv("INTERACTIVE_MAX_QUEUE_WAIT", "120")),
+            max_queue_depth=int(os.getenv("INTERACTIVE_MAX_QUEUE_DEPTH", "32")),
+        ),
+        PriorityClass(
+            name="batch",
+            rank=1,
+            max_queue_wait=float(os.getenv("BATCH_MAX_QUEUE_WAIT", "900")),
+            max_queue_depth=int(os.getenv("BATCH_MAX_QUEUE_DEPTH", "1000")),
+        ),
+    ]
+
+
+class FairScheduler:
+    """Priority + per-client fair queuing in front of the GPU"""
+
+    def __init__(self, classes: Optional[List[PriorityClass]] = None, concurrency: int = 1):
+        classes = classes or default_classes()
+        self.concurrency = concurrency
+        self.classes = {c.name: _ClassState(c) for c in sorted(classes, key=lambda c: c.rank)}
+        self.running = 0
+
+    # -- queueing ----------------------------------------------------------
+
+    def _enqueue(self, state: _ClassState, client_id: str) -> _Waiter:
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), client_id, time.perf_counter())
+        queue = state.queues.get(client_id)
+        if queue is None:
+            # Newly active client starts level with the least-served active client
+            active = [state.served.get(c, 0.0) for c in state.queues]
+            floor = min(active) if active else max(state.served.values(), default=0.0)
+            state.served[client_id] = max(state.served.get(client_id, 0.0), floor)
+            queue = state.queues[client_id] = deque()
+        queue.append(waiter)
+        state.depth += 1
+        return waiter
+
+    def _remove(self, state: _ClassState, waiter: _Waiter) -> None:
+        queue = state.queues.get(waiter.client_id)
+        if queue and waiter in queue:
+            queue.remove(waiter)
+            state.depth -= 1
+            if not queue:
+                del state.queues[waiter.client_id]
+
+    def _dispatch(self) -> None:
+        """Grant free slots to the next waiters"""
+        while self.running < self.concurrency:
+            state = next((s for s in self.classes.values() if s.queues), None)
+            if state is None:
+                return
+            client_id = min(state.queues, key=lambda c: state.served.get(c, 0.0))
+            waiter = state.queues[client_id].popleft()
+            state.depth -= 1
+            if not state.queues[client_id]:
+                del state.queues[client_id]
+            if waiter.future.done():
+                continue
+            self.running += 1
+            state.running += 1
+            waiter.future.set_result(None)
+
+    def _release(self, state: _ClassState, client_id: str, service_time: float) -> None:
+        self.running -= 1
+        state.running -= 1
+        state.completed += 1
+        state.served[client_id] = state.served.get(client_id, 0.0) + service_time
+        if client_id not in state.queues and len(state.served) > 10000:
+            # Forget idle clients so the table does not grow without bound
+            state.served = {c: state.served[c] for c in state.queues}
+        self._dispatch()
+
+    # -- public API --------------------------------------------------------
+
+    def resolve_class(self, priority: Optional[str], default: str = "batch") -> str:
+        if priority in self.classes:
+            return priority
+        return default if default in self.classes else next(iter(self.classes))
+
+    @asynccontextmanager
+    async def slot(self, priority: str, client_id: str):
+        """Wait for a GPU slot; yields the time spent queued in seconds"""
+        state = self.classes[priority]
+        config = state.config
+        if state.depth >= config.max_queue_depth:
+            state.rejected_full += 1
+            raise QueueFull(f"{priority} queue is full ({state.depth} waiting)",
+                            retry_after=config.max_queue_wait / 4)
+
+        waiter = self._enqueue(state, client_id)
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=config.max_queue_wait)
+        except asyncio.TimeoutError:
+            self._remove(state, waiter)
+            if waiter.future.done():
+                # Granted at the last moment; give the slot back
+                self._release(state, client_id, 0.0)
+            waiter.future.cancel()
+            state.rejected_timeout += 1
+            raise QueueTimeout(f"Waited more than {config.max_queue_wait:.0f}s in the {priority} queue",
+                               retry_after=config.max_queue_wait / 4)
+        except asyncio.CancelledError:
+            self._remove(state, waiter)
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._release(state, client_id, 0.0)
+            waiter.future.cancel()
+            raise
+
+        wait = time.perf_counter() - waiter.enqueued
+        state.waits.append(wait)
+        start = time.perf_counter()
+        try:
+            yield wait
+        finally:
+            self._release(state, client_id, time.perf_counter() - start)
+
+    def metrics(self) -> Dict[str, Dict]:
+        """Per-class queue depth, throughput and wait statistics"""
+        result = {}
+        for name, state in self.classes.items():
+            waits = list(state.waits)
+            result[name] = {
+                "queue_depth": state.depth,
+                "waiting_clients": len(state.queues),
+                "running": state.running,
+                "completed": state.completed,
+                "rejected_queue_full": state.rejected_full,
+                "rejected_queue_timeout": state.rejected_timeout,
+                "max_queue_wait_s": state.config.max_queue_wait,
+                "max_queue_depth": state.config.max_queue_depth,
+                "wait_s": {
+                    "mean": sum(waits) / len(waits) if waits else 0.0,
+                    "p50": _percentile(waits, 50),
+                    "p95": _percentile(waits, 95),
+                    "max": max(waits, default=0.0),
+                },
+            }
+        return result
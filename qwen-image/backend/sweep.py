@@ -0,0 +1,78 @@
+"""
+Parameter sweeps: one prompt over a grid of cfg scales, step counts and seeds.
+
+Every cell shares the prompt embeddings, and cells with the same seed start
+from the same initial noise, so differences across the grid come only from
+cfg and steps. Cells that share cfg and steps run as one pipeline batch (the
+guidance scale and timestep schedule are per call), so seeds are the cheap
+axis to sweep.
+
+The contact sheet lays cfg scales out as rows and (steps, seed) as columns,
+with each cell labelled.
+"""
+
+import itertools
+import os
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+from PIL import Image, ImageDraw
+
+# Upper bound on grid cells per request, and on images per pipeline batch
+SWEEP_MAX_CELLS = int(os.getenv("SWEEP_MAX_CELLS", "27"))
+SWEEP_MAX_BATCH = int(os.getenv("SWEEP_MAX_BATCH", "4"))
+
+
+@dataclass(frozen=True)
+class SweepCell:
+    cfg: float
+    steps: int
+    seed: int
+
+    @property
+    def label(self) -> str:
+        return f"cfg {self.cfg:g} | {self.steps} steps | seed {self.seed}"
+
+
+def sweep_grid(cfg_scales: Sequence[float], steps: Sequence[int], seeds: Sequence[int]) -> List[SweepCell]:
+    """Cells in contact-sheet order: row by cfg, then steps, then seed"""
+    return [SweepCell(float(c), int(s), int(seed))
+            for c, s, seed in itertools.product(cfg_scales, steps, seeds)]
+
+
+def batches(cells: Sequence[SweepCell], max_batch: int = SWEEP_MAX_BATCH
+            ) -> Iterator[Tuple[float, int, List[int]]]:
+    """Group cell indexes that can share a pipeline call, `max_batch` at a time.
+
+    Yields (cfg, steps, indexes into `cells`).
+    """
+    groups: Dict[Tuple[float, int], List[int]] = {}
+    for i, cell in enumerate(cells):
+        groups.setdefault((cell.cfg, cell.steps), []).append(i)
+    for (cfg, steps), indexes in groups.items():
+        for start in range(0, len(indexes), max_batch):
+            yield cfg, steps, indexes[start:start + max_batch]
+
+
+def contact_sheet(images: Sequence[Image.Image], cells: Sequence[SweepCell],
+                  columns: int, cell_size: int = 384, padding: int = 8) -> Image.Image:
+    """Thumbnails in a grid, `columns` per row, each with its parameters below"""
+    label_height = 18
+    thumbs = []
+    for image in images:
+        thumb = image.convert("RGB")
+        thumb.thumbnail((cell_size, cell_size))
+        thumbs.append(thumb)
+    cell_w = max(t.width for t in thumbs)
+    cell_h = max(t.height for t in thumbs) + label_height
+    rows = -(-len(thumbs) // columns)
+
+    sheet = Image.new("RGB", (columns * (cell_w + padding) + padding,
+                              rows * (cell_h + padding) + padding), "white")
+    draw = ImageDraw.Draw(sheet)
+    for i, (thumb, cell) in enumerate(zip(thumbs, cells)):
+        x = padding + (i % columns) * (cell_w + padding)
+        y = padding + (i // columns) * (cell_h + padding)
+        sheet.paste(thumb, (x, y))
+        draw.text((x + 2, y + thumb.height + 3), cell.label, fill="black")
+    return sheet
@@ -0,0 +1,375 @@
+"""HTTP surface of app.py served by the CPU stub engine"""
+
+import base64
+import os
+import statistics
+import threading
+import time
+from io import BytesIO
+from types import SimpleNamespace
+
+import pytest
+
+os.environ["ENGINE"] = "stub"
+os.environ["ADMIN_TOKEN"] = "test-admin"
+os.environ["ALLOWED_MODEL_IDS"] = "stub/checkpoint-v2,stub/other,stub/missing"
+
+from fastapi.testclient import TestClient  # noqa: E402
+from PIL import Image  # noqa: E402
+
+import app as app_module  # noqa: E402
+from engines import StubEngine  # noqa: E402
+from sweep import sweep_grid  # noqa: E402
+
+SMALL = {"width": 64, "height": 48, "num_inference_steps": 4}
+ADMIN = {"X-Admin-Token": "test-admin"}
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(app_module.app) as client:
+        yield client
+
+
+@pytest.fixture
+def stub_latency():
+    engine = app_module.registry.default_engine
+    saved = engine.latency, engine.step_latency
+    yield engine
+    engine.latency, engine.step_latency = saved
+
+
+def decode(data):
+    return Image.open(BytesIO(base64.b64decode(data["image_base64"])))
+
+
+def test_health_and_model_info(client):
+    health = client.get("/health").json()
+    assert health["model_loaded"] is True
+    assert health["engine"] == "stub"
+    assert health["gpu_info"]["gpu_count"] == 0
+
+    info = client.get("/model-info").json()
+    assert info["engine"] == "stub"
+    assert "seed" in info["supported_parameters"]
+    # The stub never loads quantized weights, whatever QUANTIZATION says
+    assert info["precision"]["weights"] == "bfloat16"
+    assert info["precision"]["quantized_components"] == []
+
+
+def test_generate_is_deterministic_per_seed(client):
+    first = client.post("/generate", json={"prompt": "a cat", "seed": 7, **SMALL})
+    second = client.post("/generate", json={"prompt": "a cat", "seed": 7, **SMALL})
+    other = client.post("/generate", json={"prompt": "a cat", "seed": 8, **SMALL})
+    assert first.status_code == second.status_code == other.status_code == 200
+
+    image = decode(first.json())
+    assert image.format == "PNG" and image.size == (64, 48)
+    assert first.json()["image_base64"] == second.json()["image_base64"]
+    assert first.json()["image_base64"] != other.json()["image_base64"]
+    assert first.json()["seed_used"] == 7
+
+
+def test_random_seed_is_reported(client):
+    data = client.post("/generate", json={"prompt": "a dog", **SMALL}).json()
+    assert 0 <= data["seed_used"] <= 2147483647
+    replay = client.post("/generate", json={"prompt": "a dog", **SMALL, "seed": data["seed_used"]})
+    assert replay.json()["image_base64"] == data["image_base64"]
+
+
+def test_request_id_and_traces(client):
+    response = client.post("/generate", json={"prompt": "a boat", "seed": 1, **SMALL},
+                           headers={"X-Request-ID": "test-trace-1"})
+    data = response.json()
+    request_id = response.headers["X-Request-ID"]
+    assert request_id == data["request_id"] != "test-trace-1"
+    assert response.headers["X-Client-Request-ID"] == "test-trace-1"
+    assert {"queue", "pipeline", "png_encode", "base64_encode"} <= set(data["timings"])
+    assert "pipeline;dur=" in response.headers["Server-Timing"]
+
+    latest = client.get("/traces", headers=ADMIN).json()[0]
+    assert latest["request_id"] == request_id and latest["client_request_id"] == "test-trace-1"
+    events = client.get(f"/traces/{request_id}").json()["traceEvents"]
+    assert {e["name"] for e in events} >= {"POST /generate", "pipeline", "denoise"}
+    # The client's own ID is not a key
+    assert client.get("/traces/test-trace-1").status_code == 404
+
+
+def test_reused_client_request_id_does_not_overwrite_traces(client):
+    ids = [client.post("/generate", json={"prompt": "x", **SMALL},
+                       headers={"X-Request-ID": "same"}).headers["X-Request-ID"] for _ in range(2)]
+    assert ids[0] != ids[1]
+    assert all(client.get(f"/traces/{i}").status_code == 200 for i in ids)
+
+
+def test_validation_error(client):
+    assert client.post("/generate", json={"seed": 1}).status_code == 422
+
+
+def test_engine_failure_returns_500(client, monkeypatch):
+    def fail(request, seed, trace=None):
+        raise RuntimeError("CUDA out of memory")
+
+    monkeypatch.setattr(app_module.registry.default_engine, "generate", fail)
+    response = client.post("/generate", json={"prompt": "x", **SMALL})
+    assert response.status_code == 500
+    assert "out of memory" in response.json()["detail"]
+
+
+def test_full_queue_returns_429_with_retry_after(client, monkeypatch):
+    config = app_module.scheduler.classes["batch"].config
+    monkeypatch.setattr(config, "max_queue_depth", 0)
+    response = client.post("/generate", json={"prompt": "x", "priority": "batch", **SMALL})
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+
+    metrics = client.get("/metrics").json()
+    assert metrics["scheduler"]["batch"]["rejected_queue_full"] >= 1
+
+
+def test_requests_share_the_gpu_slot(client, stub_latency):
+    stub_latency.latency = 0.2
+    statuses = []
+
+    def post():
+        statuses.append(client.post("/generate", json={"prompt": "x", **SMALL}).status_code)
+
+    threads = [threading.Thread(target=post) for _ in range(3)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    assert statuses == [200, 200, 200]
+    # GPU_CONCURRENCY=1: the three simulated generations run one after another
+    assert elapsed >= 0.6
+
+
+def test_pipeline_calls_stay_serialized_above_gpu_concurrency_1(client, stub_latency, monkeypatch):
+    monkeypatch.setattr(app_module.scheduler, "concurrency", 3)
+    engine = stub_latency
+    engine.latency = 0.05
+    generate = engine.generate
+    active, overlap = [], []
+
+    def tracked(*args, **kwargs):
+        active.append(1)
+        overlap.append(len(active))
+        try:
+            return generate(*args, **kwargs)
+        finally:
+            active.pop()
+
+    monkeypatch.setattr(engine, "generate", tracked)
+    threads = [threading.Thread(target=client.post, args=("/generate",),
+                                kwargs={"json": {"prompt": "x", **SMALL}}) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(overlap) == 4 and max(overlap) == 1
+
+
+def test_serving_overhead(client, stub_latency, record_property):
+    """Client-observed latency minus engine time, at the default 1328x1328"""
+    stub_latency.latency = 0.05
+    payload = {"prompt": "overhead", "seed": 3, "num_inference_steps": 1}
+    client.post("/generate", json=payload)  # warm-up
+
+    overheads, encodes = [], []
+    for _ in range(5):
+        start = time.perf_counter()
+        data = client.post("/generate", json=payload).json()
+        total_ms = (time.perf_counter() - start) * 1000
+        overheads.append(total_ms - data["timings"]["denoise"])
+        encodes.append(data["timings"]["png_encode"] + data["timings"]["base64_encode"])
+
+    overhead = statistics.median(overheads)
+    record_property("serving_overhead_ms", round(overhead, 1))
+    record_property("encode_ms", round(statistics.median(encodes), 1))
+    assert overhead < 2000
+
+
+def test_sweep_matches_generate_and_builds_contact_sheet(client):
+    payload = {"prompt": "a lighthouse", "width": 64, "height": 48,
+               "cfg_scales": [2.0, 4.0], "steps": [4, 8], "seeds": [5, 6], "sheet_cell_size": 32}
+    data = client.post("/sweep", json=payload).json()
+
+    assert data["columns"] == 4
+    assert [(c["cfg_scale"], c["steps"], c["seed"]) for c in data["cells"]][:4] == [
+        (2.0, 4, 5), (2.0, 4, 6), (2.0, 8, 5), (2.0, 8, 6)]
+    sheet = Image.open(BytesIO(base64.b64decode(data["contact_sheet_base64"])))
+    assert sheet.width > 4 * 32 and sheet.height > 2 * 24
+
+    single = client.post("/generate", json={"prompt": "a lighthouse", "seed": 6, **SMALL}).json()
+    assert data["cells"][1]["image_base64"] == single["image_base64"]
+    assert "batch" in data["timings"] and "contact_sheet" in data["timings"]
+
+
+def test_sweep_limits(client):
+    assert client.post("/sweep", json={"prompt": "x", "seeds": []}).status_code == 400
+    too_many = {"prompt": "x", "cfg_scales": list(range(1, 11)), "steps": [4, 8, 16]}
+    assert client.post("/sweep", json=too_many).status_code == 400
+
+
+def test_sweep_shares_one_request_queue_slot_and_prompt_encoding(client, stub_latency, monkeypatch):
+    stub_latency.latency = 0.02
+    gpu_calls = []
+    run_on_gpu = app_module.run_on_gpu
+
+    async def counting_run_on_gpu(*args, **kwargs):
+        gpu_calls.append(args[2].__name__)
+        return await run_on_gpu(*args, **kwargs)
+
+    monkeypatch.setattr(app_module, "run_on_gpu", counting_run_on_gpu)
+    encodes = stub_latency.prompt_encodes
+    grid = {"cfg_scales": [2.0, 4.0, 6.0], "seeds": [1, 2, 3], "steps": [4]}
+
+    start = time.perf_counter()
+    data = client.post("/sweep", json={"prompt": "x", "width": 64, "height": 48,
+                                       "include_images": False, **grid}).json()
+    sweep_time = time.perf_counter() - start
+    assert len(data["cells"]) == 9 and data["cells"][0]["image_base64"] is None
+
+    # One HTTP request, one queue slot and one prompt encoding for nine images
+    assert gpu_calls == ["run_sweep"]
+    assert stub_latency.prompt_encodes - encodes == 1
+    # Denoising is not shared: each image still costs a full image
+    assert sweep_time >= 9 * stub_latency.latency
+
+
+def test_stub_batch_discount():
+    cells = sweep_grid([4.0], [4], [1, 2, 3])
+    request = SimpleNamespace(prompt="x", negative_prompt=" ", width=8, height=8)
+    for discount, minimum, maximum in [(1.0, 0.3, 0.5), (0.0, 0.1, 0.25)]:
+        engine = StubEngine(latency=0.1, batch_discount=discount)
+        start = time.perf_counter()
+        assert len(engine.generate_batch(request, cells)) == 3
+        assert minimum <= time.perf_counter() - start < maximum
+
+
+def test_unknown_model_returns_404(client):
+    response = client.post("/generate", json={"prompt": "x", "model": "nope", **SMALL})
+    assert response.status_code == 404
+
+
+def test_lora_adapters_route_and_evict(client):
+    registry = app_module.registry
+    for name in ("ink", "pixel", "film"):
+        assert client.post("/models/adapters", json={"name": name, "source": f"loras/{name}"},
+                           headers=ADMIN).status_code == 200
+    engine = registry.default_engine
+    engine.adapters.max_active = 2
+
+    base = client.post("/generate", json={"prompt": "x", "seed": 1, **SMALL}).json()
+    ink = client.post("/generate", json={"prompt": "x", "seed": 1, "model": "ink", **SMALL}).json()
+    assert ink["model"].endswith("+ink")
+    assert ink["image_base64"] != base["image_base64"]
+    assert "lora_load" in ink["timings"]
+
+    # Cached adapter: no load on the second request, same output
+    again = client.post("/generate", json={"prompt": "x", "seed": 1, "model": "ink", **SMALL}).json()
+    assert again["image_base64"] == ink["image_base64"] and "lora_load" not in again["timings"]
+    # Base model output is unaffected by the loaded adapter
+    assert client.post("/generate", json={"prompt": "x", "seed": 1, **SMALL}).json()["image_base64"] == base["image_base64"]
+
+    for name in ("pixel", "film"):
+        client.post("/generate", json={"prompt": "x", "model": name, **SMALL})
+    summary = client.get("/models").json()["models"][registry.default]["adapters"]
+    assert summary["active"] == ["pixel", "film"] and summary["evictions"] == 1
+
+    assert client.delete("/models/adapters/film", headers=ADMIN).status_code == 200
+    assert engine.adapters.active.keys() == {"pixel"}
+    assert client.post("/generate", json={"prompt": "x", "model": "film", **SMALL}).status_code == 404
+
+
+def test_hot_swap_drains_in_flight_requests(client, stub_latency):
+    registry = app_module.registry
+    old_engine = registry.default_engine
+    old_model = old_engine.model_name
+    stub_latency.latency = 0.3
+    results = {}
+
+    def slow_request():
+        results["slow"] = client.post("/generate", json={"prompt": "x", "seed": 2, **SMALL}).json()
+
+    thread = threading.Thread(target=slow_request)
+    thread.start()
+    time.sleep(0.1)
+    response = client.post("/models/load", json={"model_id": "stub/checkpoint-v2", "wait": True},
+                           headers=ADMIN)
+    thread.join()
+
+    assert response.status_code == 200
+    # The request admitted before the swap finished on the old engine, which
+    # was unloaded only afterwards
+    assert results["slow"]["model"] == old_model
+    assert not old_engine.loaded
+    new = client.post("/generate", json={"prompt": "x", "seed": 2, **SMALL}).json()
+    assert new["model"] == "stub/checkpoint-v2"
+    assert new["image_base64"] != results["slow"]["image_base64"]
+    assert client.get("/health").json()["model_name"] == "stub/checkpoint-v2"
+
+
+def test_side_by_side_models(client):
+    response = client.post("/models/load", json={"model_id": "stub/other", "name": "other", "wait": True},
+                           headers=ADMIN)
+    assert response.status_code == 200
+    data = client.post("/generate", json={"prompt": "x", "model": "other", **SMALL}).json()
+    assert data["model"] == "stub/other"
+    assert client.delete(f"/models/{app_module.registry.default}", headers=ADMIN).status_code == 400
+    assert client.delete("/models/other", headers=ADMIN).status_code == 200
+    assert "other" not in client.get("/models").json()["models"]
+
+
+def test_failed_background_load_is_reported(client, monkeypatch, caplog):
+    def broken(model_id):
+        raise RuntimeError(f"no weights for {model_id}")
+
+    monkeypatch.setattr(app_module.registry, "factory", broken)
+    response = client.post("/models/load", json={"model_id": "stub/missing", "name": "missing"},
+                           headers=ADMIN)
+    assert response.status_code == 202
+
+    def logged():
+        return any(r.message == "Background model load failed" and r.exc_info for r in caplog.records)
+
+    deadline = time.monotonic() + 5
+    while not logged() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert logged()
+    loading = client.get("/models").json()["loading"]
+    assert loading["missing"] == "failed: no weights for stub/missing"
+
+
+def test_admin_token(client, monkeypatch):
+    payload = {"name": "ink2", "source": "loras/ink"}
+    assert client.get("/traces").status_code == 403
+    assert client.post("/models/adapters", json=payload).status_code == 403
+    assert client.post("/models/adapters", json=payload, headers={"X-Admin-Token": "wrong"}).status_code == 403
+    assert client.post("/models/adapters", json=payload, headers=ADMIN).status_code == 200
+
+    # Without a configured token the endpoints are off, whatever the header says
+    monkeypatch.setattr(app_module, "ADMIN_TOKEN", None)
+    assert client.post("/models/adapters", json=payload, headers=ADMIN).status_code == 403
+    assert client.get("/traces", headers=ADMIN).status_code == 403
+
+
+def test_only_allowed_checkpoints_load(client):
+    response = client.post("/models/load", json={"model_id": "someone/remote-code", "name": "x", "wait": True},
+                           headers=ADMIN)
+    assert response.status_code == 403
+    assert "x" not in client.get("/models").json()["loading"]
+
+
+def test_generate_png_body(client):
+    response = client.post("/generate", json={"prompt": "a cat", "seed": 7, **SMALL},
+                           headers={"Accept": "image/png"})
+    assert response.headers["Content-Type"] == "image/png"
+    assert response.headers["X-Seed-Used"] == "7"
+    assert "pipeline;dur=" in response.headers["Server-Timing"]
+
+    as_json = client.post("/generate", json={"prompt": "a cat", "seed": 7, **SMALL}).json()
+    assert response.content == base64.b64decode(as_json["image_base64"])
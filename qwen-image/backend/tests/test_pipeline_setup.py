@@ -0,0 +1,129 @@
+"""Startup configuration in pipeline_setup.py, checked against fake pipelines on CPU"""
+
+from types import SimpleNamespace
+
+import pytest
+
+from pipeline_setup import MemoryConfig, PrecisionConfig, apply_memory_modes
+
+MEMORY_ENV = ("VAE_TILING", "VAE_SLICING", "ATTENTION_SLICING", "CPU_OFFLOAD",
+              "QUANTIZATION", "QUANTIZE_COMPONENTS")
+
+
+class FakePipeline:
+    """Records which memory options were enabled, in order"""
+
+    def __init__(self, unsupported=()):
+        self.calls = []
+        self.unsupported = set(unsupported)
+        self.vae = SimpleNamespace(enable_tiling=self._record("vae.enable_tiling"),
+                                   enable_slicing=self._record("vae.enable_slicing"))
+        self.enable_attention_slicing = self._record("enable_attention_slicing")
+        self.enable_model_cpu_offload = self._record("enable_model_cpu_offload")
+        self.enable_sequential_cpu_offload = self._record("enable_sequential_cpu_offload")
+
+    def _record(self, name):
+        def call():
+            if name in self.unsupported:
+                raise NotImplementedError(name)
+            self.calls.append(name)
+        return call
+
+
+@pytest.fixture
+def env(monkeypatch):
+    for name in MEMORY_ENV:
+        monkeypatch.delenv(name, raising=False)
+    return monkeypatch
+
+
+def test_memory_config_defaults(env):
+    assert MemoryConfig.from_env() == MemoryConfig()
+
+
+def test_memory_config_from_env(env):
+    env.setenv("VAE_TILING", "true")
+    env.setenv("VAE_SLICING", "1")
+    env.setenv("ATTENTION_SLICING", "off")
+    env.setenv("CPU_OFFLOAD", " Model ")
+    assert MemoryConfig.from_env() == MemoryConfig(
+        vae_tiling=True, vae_slicing=True, attention_slicing=False, cpu_offload="model")
+
+
+def test_memory_config_rejects_unknown_offload(env):
+    env.setenv("CPU_OFFLOAD", "disk")
+    with pytest.raises(ValueError, match="CPU_OFFLOAD"):
+        MemoryConfig.from_env()
+
+
+@pytest.mark.parametrize("offload, offload_call", [
+    ("model", "enable_model_cpu_offload"),
+    ("sequential", "enable_sequential_cpu_offload"),
+])
+def test_offload_is_enabled_after_vae_and_attention_options(offload, offload_call):
+    pipeline = FakePipeline()
+    config = MemoryConfig(vae_tiling=True, vae_slicing=True, attention_slicing=True, cpu_offload=offload)
+    applied = apply_memory_modes(pipeline, config)
+
+    # Offloading installs hooks on the modules as they are at that point, so
+    # it has to come last
+    assert pipeline.calls == ["vae.enable_tiling", "vae.enable_slicing",
+                              "enable_attention_slicing", offload_call]
+    assert applied == {"vae_tiling": True, "vae_slicing": True,
+                       "attention_slicing": True, "cpu_offload": True}
+
+
+def test_no_options_touch_nothing():
+    pipeline = FakePipeline()
+    assert apply_memory_modes(pipeline, MemoryConfig()) == {}
+    assert pipeline.calls == []
+
+
+def test_unsupported_option_is_reported_not_raised():
+    pipeline = FakePipeline(unsupported={"enable_attention_slicing"})
+    applied = apply_memory_modes(pipeline, MemoryConfig(attention_slicing=True, vae_tiling=True))
+
+    assert applied["vae_tiling"] is True
+    assert applied["attention_slicing"].startswith("unsupported:")
+    assert pipeline.calls == ["vae.enable_tiling"]
+
+
+def test_precision_config_defaults(env):
+    config = PrecisionConfig.from_env()
+    assert config == PrecisionConfig()
+    assert config.quant_mapping_spec() == {}
+    assert config.quantization_config() is None
+    assert config.to_dict()["quantized_components"] == []
+
+
+def test_precision_config_from_env(env):
+    env.setenv("QUANTIZATION", " FP8 ")
+    env.setenv("QUANTIZE_COMPONENTS", "transformer, ")
+    assert PrecisionConfig.from_env() == PrecisionConfig(quantization="fp8", components=("transformer",))
+
+
+def test_precision_config_rejects_unknown_quantization(env):
+    env.setenv("QUANTIZATION", "int4")
+    with pytest.raises(ValueError, match="QUANTIZATION"):
+        PrecisionConfig.from_env()
+
+
+@pytest.mark.parametrize("quantization, quant_type", [
+    ("int8", "Int8WeightOnlyConfig"),
+    ("fp8", "Float8WeightOnlyConfig"),
+])
+def test_text_encoder_is_quantized_as_a_transformers_model(quantization, quant_type):
+    assert PrecisionConfig(quantization).quant_mapping_spec() == {
+        "transformer": ("diffusers", quant_type),
+        "text_encoder": ("transformers", quant_type),
+    }
+
+
+def test_quantization_config_builds_per_library_configs():
+    pytest.importorskip("torchao")
+    diffusers = pytest.importorskip("diffusers")
+    transformers = pytest.importorskip("transformers")
+
+    mapping = PrecisionConfig("int8").quantization_config().quant_mapping
+    assert isinstance(mapping["transformer"], diffusers.TorchAoConfig)
+    assert isinstance(mapping["text_encoder"], transformers.TorchAoConfig)
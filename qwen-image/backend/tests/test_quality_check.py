@@ -0,0 +1,27 @@
+"""Report handling in quality_check.py, without servers"""
+
+import json
+
+import pytest
+from PIL import Image
+
+import quality_check
+
+
+def test_identical_images_serialize_as_valid_json():
+    image = Image.new("RGB", (4, 4), (10, 20, 30))
+    metrics = quality_check.compare(image, image)
+    assert metrics["psnr_db"] == float("inf")
+
+    report = {"mean_psnr_db": metrics["psnr_db"], "results": [metrics]}
+    text = json.dumps(quality_check.json_safe(report), allow_nan=False)
+    assert json.loads(text)["results"][0]["psnr_db"] is None
+
+
+def test_empty_prompts_file_is_rejected(tmp_path):
+    prompts = tmp_path / "prompts.txt"
+    prompts.write_text("\n  \n", encoding="utf-8")
+    with pytest.raises(SystemExit) as error:
+        quality_check.main(["--baseline-url", "http://127.0.0.1:9", "--candidate-url", "http://127.0.0.1:9",
+                            "--prompts-file", str(prompts)])
+    assert error.value.code == 2
@@ -0,0 +1,114 @@
+import asyncio
+from collections import Counter
+
+import pytest
+
+from scheduler import FairScheduler, PriorityClass, QueueFull, QueueTimeout
+
+
+def _scheduler(concurrency=1, interactive_wait=5.0, batch_wait=5.0, batch_depth=1000):
+    return FairScheduler([
+        PriorityClass("interactive", 0, interactive_wait, 32),
+        PriorityClass("batch", 1, batch_wait, batch_depth),
+    ], concurrency=concurrency)
+
+
+async def _job(scheduler, priority, client, order, work=0.01):
+    """Simulated client request against a stub pipeline taking `work` seconds"""
+    async with scheduler.slot(priority, client):
+        order.append((priority, client))
+        await asyncio.sleep(work)
+
+
+def test_interactive_jumps_ahead_of_batch_backlog():
+    async def main():
+        scheduler, order = _scheduler(), []
+        batch = [asyncio.create_task(_job(scheduler, "batch", "bulk", order)) for _ in range(20)]
+        await asyncio.sleep(0.025)
+        await _job(scheduler, "interactive", "user", order)
+        # Only the batch jobs already on the GPU ran before the interactive one
+        position = order.index(("interactive", "user"))
+        await asyncio.gather(*batch)
+        return position
+
+    assert asyncio.run(main()) <= 4
+
+
+def test_clients_share_gpu_fairly_within_class():
+    async def main():
+        scheduler, order = _scheduler(), []
+        tasks = [asyncio.create_task(_job(scheduler, "batch", "bulk", order)) for _ in range(30)]
+        await asyncio.sleep(0)
+        tasks += [asyncio.create_task(_job(scheduler, "batch", f"small-{i}", order)) for i in range(3)]
+        await asyncio.gather(*tasks)
+        return order
+
+    order = asyncio.run(main())
+    # The three small clients are served within the first few slots,
+    # not after the 30-request backlog
+    first = Counter(client for _, client in order[:8])
+    assert all(first[f"small-{i}"] == 1 for i in range(3))
+
+
+def test_fairness_accounts_for_gpu_time():
+    async def main():
+        scheduler, order = _scheduler(), []
+        tasks = [asyncio.create_task(_job(scheduler, "batch", "heavy", order, work=0.04)) for _ in range(5)]
+        tasks += [asyncio.create_task(_job(scheduler, "batch", "light", order, work=0.01)) for _ in range(12)]
+        await asyncio.gather(*tasks)
+        return order
+
+    order = asyncio.run(main())
+    # "light" requests cost a quarter of "heavy" ones, so it gets more slots early on
+    first = Counter(client for _, client in order[:10])
+    assert first["light"] > first["heavy"]
+
+
+def test_max_queue_wait_rejects():
+    async def main():
+        scheduler, order = _scheduler(batch_wait=0.05), []
+        blocker = asyncio.create_task(_job(scheduler, "interactive", "user", order, work=0.2))
+        await asyncio.sleep(0)
+        with pytest.raises(QueueTimeout):
+            await _job(scheduler, "batch", "bulk", order)
+        await blocker
+        metrics = scheduler.metrics()
+        assert metrics["batch"]["rejected_queue_timeout"] == 1
+        assert metrics["batch"]["queue_depth"] == 0
+        assert scheduler.running == 0
+
+    asyncio.run(main())
+
+
+def test_queue_depth_limit_and_metrics():
+    async def main():
+        scheduler, order = _scheduler(batch_depth=2), []
+        tasks = [asyncio.create_task(_job(scheduler, "batch", "bulk", order, work=0.05)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        with pytest.raises(QueueFull) as exc:
+            await _job(scheduler, "batch", "bulk", order)
+        assert exc.value.retry_after > 0
+        assert scheduler.metrics()["batch"]["queue_depth"] == 2
+        await asyncio.gather(*tasks)
+        metrics = scheduler.metrics()["batch"]
+        assert metrics["completed"] == 3
+        assert metrics["wait_s"]["max"] > 0
+
+    asyncio.run(main())
+
+
+def test_concurrency_slots():
+    async def main():
+        scheduler, order = _scheduler(concurrency=2), []
+        peak = 0
+
+        async def job():
+            nonlocal peak
+            async with scheduler.slot("batch", "c"):
+                peak = max(peak, scheduler.running)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(*(job() for _ in range(6)))
+        return peak
+
+    assert asyncio.run(main()) == 2
@@ -0,0 +1,24 @@
+from PIL import Image
+
+from sweep import SweepCell, batches, contact_sheet, sweep_grid
+
+
+def test_grid_order_and_batches():
+    cells = sweep_grid([2, 4], [10, 20], [1, 2, 3])
+    assert len(cells) == 12
+    assert cells[0] == SweepCell(2.0, 10, 1) and cells[3] == SweepCell(2.0, 20, 1)
+
+    groups = list(batches(cells, max_batch=2))
+    # Four (cfg, steps) pairs, three seeds each, split into batches of at most two
+    assert len(groups) == 8
+    assert groups[0] == (2.0, 10, [0, 1]) and groups[1] == (2.0, 10, [2])
+    assert sorted(i for _, _, idx in groups for i in idx) == list(range(12))
+
+
+def test_contact_sheet_layout():
+    cells = sweep_grid([1, 2], [5], [7, 8])
+    images = [Image.new("RGB", (200, 100), color) for color in ("red", "green", "blue", "white")]
+    sheet = contact_sheet(images, cells, columns=2, cell_size=50, padding=4)
+    assert sheet.size == (2 * (50 + 4) + 4, 2 * (25 + 18 + 4) + 4)
+    assert sheet.getpixel((4 + 10, 4 + 10)) == (255, 0, 0)
+    assert sheet.getpixel((4 + 54 + 10, 4 + 47 + 10)) == (255, 255, 255)
@@ -0,0 +1,47 @@
+"""Trace bookkeeping without the HTTP layer"""
+
+import time
+
+import tracing
+from tracing import TraceStore, finish_trace, span, start_trace
+
+
+def test_spans_timings_and_server_timing():
+    trace = start_trace("POST /generate", "client-1")
+    assert tracing.current_trace() is trace
+    with span("pipeline"):
+        time.sleep(0.01)
+    with span("pipeline"):
+        pass
+    with span("png_encode", trace, size=3):
+        pass
+
+    timings = trace.timings()
+    assert set(timings) == {"pipeline", "png_encode"} and timings["pipeline"] >= 10
+    header = trace.server_timing_header()
+    assert header.startswith("pipeline;dur=") and "total;dur=" in header
+
+    events = trace.to_chrome_trace()["traceEvents"]
+    assert events[0]["args"]["client_request_id"] == "client-1"
+    assert [e["name"] for e in events[1:]] == ["pipeline", "pipeline", "png_encode"]
+    assert events[3]["args"] == {"size": 3}
+
+
+def test_request_ids_are_server_generated():
+    first, second = start_trace("GET /", "same"), start_trace("GET /", "same")
+    assert first.request_id != second.request_id
+    assert first.client_request_id == "same"
+    assert start_trace("GET /", "x" * 1000).client_request_id == "x" * tracing.MAX_CLIENT_REQUEST_ID_LENGTH
+    assert start_trace("GET /").client_request_id is None
+
+
+def test_store_is_a_bounded_ring(monkeypatch):
+    store = TraceStore(max_traces=3)
+    monkeypatch.setattr(tracing, "trace_store", store)
+    traces = [start_trace(f"req {i}") for i in range(5)]
+    for trace in traces:
+        finish_trace(trace, 200)
+
+    assert [t.name for t in store.recent()] == ["req 4", "req 3", "req 2"]
+    assert store.get(traces[0].request_id) is None
+    assert store.get(traces[4].request_id).status == 200
@@ -0,0 +1,119 @@
+import os
+import signal
+import threading
+import time
+from io import BytesIO
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+
+from engines import EncodedImage, EngineUnavailable, StubEngine
+from sweep import sweep_grid
+from worker_engine import SharedRing, WorkerCrashed, WorkerEngine
+
+REQUEST = SimpleNamespace(prompt="x", negative_prompt=" ", width=64, height=48,
+                          num_inference_steps=4, true_cfg_scale=4.0)
+
+
+def expected(seed):
+    stub = StubEngine(model_id="stub/worker")
+    return stub.generate(REQUEST, seed)
+
+
+def start_worker(monkeypatch, output="png", latency="0"):
+    monkeypatch.setenv("STUB_LATENCY", latency)
+    engine = WorkerEngine("stub/worker", engine_name="stub", output=output, slot_mb=1, start_timeout=60)
+    engine.load()
+    return engine
+
+
+def generate(engine, seed=1):
+    with engine.use_adapter(None):
+        return engine.generate(REQUEST, seed)
+
+
+def test_png_output_is_read_from_the_ring(monkeypatch):
+    engine = start_worker(monkeypatch)
+    try:
+        result = generate(engine, seed=3)
+        assert isinstance(result, EncodedImage) and isinstance(result.data, memoryview)
+        image = Image.open(BytesIO(bytes(result.data)))
+        assert image.convert("RGB").tobytes() == expected(3).tobytes()
+        result.release()
+        assert sorted(engine.ring._free) == [0, 1]
+        assert engine.device_info()["worker"]["alive"]
+    finally:
+        engine.unload()
+
+
+def test_raw_output_and_batches(monkeypatch):
+    engine = start_worker(monkeypatch, output="raw")
+    try:
+        image = generate(engine, seed=5)
+        assert image.tobytes() == expected(5).tobytes()
+
+        cells = sweep_grid([2.0, 4.0], [4], [5, 6])
+        with engine.use_adapter(None):
+            images = engine.generate_batch(REQUEST, cells)
+        assert [i.tobytes() for i in images[:2]] == [expected(5).tobytes(), expected(6).tobytes()]
+        assert sorted(engine.ring._free) == [0, 1]
+    finally:
+        engine.unload()
+
+
+def test_crashed_worker_is_restarted(monkeypatch):
+    engine = start_worker(monkeypatch, latency="0.5")
+    try:
+        pid = engine.process.pid
+        errors = []
+
+        def in_flight():
+            try:
+                generate(engine)
+            except WorkerCrashed as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=in_flight)
+        thread.start()
+        time.sleep(0.2)
+        os.kill(pid, signal.SIGKILL)
+        thread.join()
+        assert len(errors) == 1 and errors[0].retry_after > 0
+
+        # The next request waits for the restarted worker
+        result = generate(engine, seed=2)
+        result.release()
+        assert engine.restarts == 1 and engine.process.pid != pid
+        assert sorted(engine.ring._free) == [0, 1]
+    finally:
+        engine.unload()
+
+
+def test_worker_cannot_host_another_worker(monkeypatch):
+    monkeypatch.setenv("WORKER_ENGINE", "worker")
+    with pytest.raises(ValueError, match="WORKER_ENGINE"):
+        WorkerEngine("stub/worker")
+
+
+def test_startup_error_is_not_taken_as_ready(monkeypatch):
+    # The child fails while building its engine and reports it over the pipe
+    monkeypatch.setenv("STUB_LATENCY", "not-a-number")
+    engine = WorkerEngine("stub/worker", engine_name="stub", slot_mb=1, start_timeout=60)
+    with pytest.raises(WorkerCrashed, match="Worker failed to load: ValueError"):
+        engine.load()
+    assert not engine.loaded
+    assert not engine.process.is_alive()
+
+
+def test_ring_hands_out_slots_in_order():
+    ring = SharedRing(slots=3, slot_size=16)
+    try:
+        assert [ring.acquire(), ring.acquire()] == [0, 1]
+        ring.release(0)
+        assert ring.acquire() == 2
+        assert ring.acquire() == 0
+        with pytest.raises(EngineUnavailable):
+            ring.acquire(timeout=0.05)
+    finally:
+        ring.close()
@@ -0,0 +1,178 @@
+"""
+Per-request tracing for the Qwen-Image backend.
+
+Every request gets a server-generated request ID, and stages record spans on
+the current trace:
+
+    with span("pipeline"):
+        result = pipeline(...)
+
+When the request finishes the middleware adds `X-Request-ID` and
+`Server-Timing` headers, emits one structured JSON log line and keeps the trace
+in a ring buffer that `/traces/{request_id}` exports as Chrome trace JSON
+(load it in chrome://tracing or https://ui.perfetto.dev).
+
+A client's own `X-Request-ID` is only recorded as `client_request_id` (and
+echoed back in `X-Client-Request-ID`) for correlation; traces are always
+keyed by the server ID, so one client cannot overwrite or look up another's
+trace by reusing an ID.
+"""
+
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger("qwen_image.trace")
+
+REQUEST_ID_HEADER = "X-Request-ID"
+CLIENT_REQUEST_ID_HEADER = "X-Client-Request-ID"
+# Client IDs are only logged; bound what a client can put in the logs
+MAX_CLIENT_REQUEST_ID_LENGTH = 128
+
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar("current_trace", default=None)
+
+
+@dataclass
+class Span:
+    name: str
+    start: float
+    end: float = 0.0
+    attrs: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end - self.start) * 1000
+
+
+@dataclass
+class Trace:
+    request_id: str
+    name: str
+    start: float = field(default_factory=time.perf_counter)
+    wall_start: float = field(default_factory=time.time)
+    end: float = 0.0
+    status: Optional[int] = None
+    spans: List[Span] = field(default_factory=list)
+    client_request_id: Optional[str] = None
+
+    def add_span(self, name: str, start: float, end: float, **attrs) -> Span:
+        span = Span(name, start, end, attrs)
+        self.spans.append(span)
+        return span
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end or time.perf_counter()) - self.start) * 1000
+
+    def timings(self) -> Dict[str, float]:
+        """Span durations in milliseconds, summed per span name"""
+        timings: Dict[str, float] = {}
+        for s in self.spans:
+            timings[s.name] = round(timings.get(s.name, 0.0) + s.duration_ms, 3)
+        return timings
+
+    def server_timing_header(self) -> str:
+        entries = [f"{name};dur={dur:.1f}" for name, dur in self.timings().items()]
+        entries.append(f"total;dur={self.duration_ms:.1f}")
+        return ", ".join(entries)
+
+    def to_log_record(self) -> Dict[str, Any]:
+        return {
+            "event": "request",
+            "request_id": self.request_id,
+            "client_request_id": self.client_request_id,
+            "name": self.name,
+            "status": self.status,
+            "duration_ms": round(self.duration_ms, 3),
+            "timings_ms": self.timings(),
+        }
+
+    def to_chrome_trace(self, pid: str = "qwen-image-backend") -> Dict[str, Any]:
+        """Chrome trace event format; timestamps are wall-clock microseconds"""
+        def ts(t: float) -> float:
+            return (self.wall_start + (t - self.start)) * 1e6
+
+        events = [{
+            "name": self.name, "ph": "X", "pid": pid, "tid": "request",
+            "ts": ts(self.start), "dur": self.duration_ms * 1000,
+            "args": {"request_id": self.request_id, "client_request_id": self.client_request_id,
+                     "status": self.status},
+        }]
+        for s in self.spans:
+            events.append({
+                "name": s.name, "ph": "X", "pid": pid, "tid": "stages",
+                "ts": ts(s.start), "dur": s.duration_ms * 1000, "args": s.attrs,
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+class TraceStore:
+    """Ring buffer of the most recent finished traces"""
+
+    def __init__(self, max_traces: int = 256):
+        self.max_traces = max_traces
+        self._traces: "OrderedDict[str, Trace]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, trace: Trace) -> None:
+        with self._lock:
+            self._traces[trace.request_id] = trace
+            self._traces.move_to_end(trace.request_id)
+            while len(self._traces) > self.max_traces:
+                self._traces.popitem(last=False)
+
+    def get(self, request_id: str) -> Optional[Trace]:
+        with self._lock:
+            return self._traces.get(request_id)
+
+    def recent(self, limit: int = 50) -> List[Trace]:
+        with self._lock:
+            return list(self._traces.values())[-limit:][::-1]
+
+
+trace_store = TraceStore()
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+
+def start_trace(name: str, client_request_id: Optional[str] = None) -> Trace:
+    """Start a trace under a new server ID; the client's ID is kept as a tag"""
+    trace = Trace(request_id=new_request_id(), name=name,
+                  client_request_id=(client_request_id or "")[:MAX_CLIENT_REQUEST_ID_LENGTH] or None)
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def finish_trace(trace: Trace, status: Optional[int]) -> None:
+    trace.end = time.perf_counter()
+    trace.status = status
+    trace_store.add(trace)
+    logger.info(json.dumps(trace.to_log_record()))
+
+
+@contextmanager
+def span(name: str, trace: Optional[Trace] = None, **attrs):
+    """
+    Time a block on the given (or current) trace. Pass `trace` explicitly when
+    the block runs in a worker thread that did not inherit the context.
+    """
+    trace = trace or current_trace()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if trace is not None:
+            trace.add_span(name, start, time.perf_counter(), **attrs)
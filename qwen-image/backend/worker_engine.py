@@ -0,0 +1,470 @@
+"""
+Worker-process engine: inference runs in a child process so a CUDA crash or
+OOM kill does not take the API server down.
+
+Images come back through a shared-memory ring instead of being pickled:
+
+- `WORKER_OUTPUT=png` (default): the worker PNG-encodes straight into a ring
+  slot and the API process base64-encodes from that memory, so encoding also
+  leaves the API process.
+- `WORKER_OUTPUT=raw`: the worker writes raw RGB and the API process builds
+  the image from the slot (one copy). Sweeps always use raw, since the contact
+  sheet needs the pixels.
+
+The pipe between the processes only carries small control messages. A
+supervisor thread restarts a worker that dies while idle; the request a
+worker dies under fails with 503 and Retry-After, and the next request
+restarts it if the supervisor has not yet.
+
+| Variable               | Default     | Description                              |
+|------------------------|-------------|------------------------------------------|
+| `WORKER_ENGINE`        | `diffusers` | Engine the worker runs (`diffusers`/`stub`) |
+| `WORKER_OUTPUT`        | `png`       | `png` or `raw`                           |
+| `WORKER_RING_SLOTS`    | `2`         | Ring slots; a new image can be written while the last is still being sent |
+| `WORKER_SLOT_MB`       | `32`        | Size of each slot                        |
+| `WORKER_START_TIMEOUT` | `1800`      | Seconds to wait for the worker to load   |
+"""
+
+import logging
+import multiprocessing as mp
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict
+from multiprocessing import shared_memory
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Sequence
+
+from PIL import Image
+
+from engines import EncodedImage, Engine, EngineUnavailable, create_engine
+from model_registry import AdapterSpec
+from sweep import SweepCell
+
+logger = logging.getLogger(__name__)
+
+WORKER_OUTPUTS = ("png", "raw")
+# Engines the worker can host; never itself, or it would spawn workers forever
+WORKER_ENGINES = ("diffusers", "stub")
+
+
+class WorkerCrashed(EngineUnavailable):
+    pass
+
+
+class SharedRing:
+    """Fixed-size slots in one shared-memory block, handed out round-robin"""
+
+    def __init__(self, slots: int, slot_size: int, name: Optional[str] = None):
+        self.slots = slots
+        self.slot_size = slot_size
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=slots * slot_size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self._free = list(range(slots))
+        self._next = 0
+        self._cond = threading.Condition()
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def view(self, slot: int, length: Optional[int] = None) -> memoryview:
+        offset = slot * self.slot_size
+        return self.shm.buf[offset:offset + (self.slot_size if length is None else length)]
+
+    def acquire(self, timeout: Optional[float] = None) -> int:
+        """Next free slot in ring order; blocks while every slot is leased"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._free, timeout):
+                raise EngineUnavailable("No free shared-memory slot", retry_after=1)
+            slot = min(self._free, key=lambda s: (s - self._next) % self.slots)
+            self._free.remove(slot)
+            self._next = (slot + 1) % self.slots
+            return slot
+
+    def release(self, slot: int) -> None:
+        with self._cond:
+            self._free.append(slot)
+            self._cond.notify()
+
+    def close(self) -> None:
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class _SlotWriter:
+    """File-like object writing into one ring slot, for Image.save"""
+
+    def __init__(self, view: memoryview):
+        self.view = view
+        self.pos = 0
+
+    def write(self, data) -> int:
+        n = len(data)
+        if self.pos + n > len(self.view):
+            raise ValueError(f"Encoded image exceeds the {len(self.view)} byte slot; raise WORKER_SLOT_MB")
+        self.view[self.pos:self.pos + n] = data
+        self.pos += n
+        return n
+
+    def tell(self) -> int:
+        return self.pos
+
+    def flush(self) -> None:
+        pass
+
+
+def _write_image(ring: SharedRing, slot: int, image: Image.Image, output: str) -> Dict[str, Any]:
+    view = ring.view(slot)
+    try:
+        if output == "png":
+            writer = _SlotWriter(view)
+            image.save(writer, format="PNG")
+            return {"format": "png", "length": writer.pos}
+        image = image.convert("RGB")
+        data = image.tobytes()
+        if len(data) > len(view):
+            raise ValueError(f"{image.size} image exceeds the {len(view)} byte slot; raise WORKER_SLOT_MB")
+        view[:len(data)] = data
+        return {"format": "raw", "length": len(data), "size": image.size}
+    finally:
+        view.release()
+
+
+def worker_main(conn, ring_name: str, slots: int, slot_size: int, engine_name: str, model_id: str):
+    """Child process: load the engine, then serve jobs from the pipe until it closes"""
+    logging.basicConfig(level=logging.INFO)
+    ring = SharedRing(slots, slot_size, name=ring_name)
+    try:
+        engine = create_engine(engine_name, model_id=model_id)
+        engine.load()
+    except Exception as e:
+        logger.exception(f"Worker failed to load {model_id}")
+        conn.send(("error", f"{type(e).__name__}: {e}"))
+        ring.close()
+        return
+    conn.send(("ready", {
+        "device_info": engine.device_info(),
+        "memory_stats": engine.memory_stats(),
+        "memory_modes": getattr(engine, "memory_modes", {}),
+        "precision": engine.precision_info(),
+    }))
+
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        op = job["op"]
+        trace = SimpleNamespace(spans=[])
+        trace.add_span = lambda name, start, end, **attrs: trace.spans.append((name, start, end, attrs))
+        try:
+            adapter = AdapterSpec(**job["adapter"]) if job.get("adapter") else None
+            if op == "generate":
+                request = SimpleNamespace(**job["request"])
+                with engine.use_adapter(adapter, job["lora_scale"], trace):
+                    image = engine.generate(request, job["seed"], trace)
+                start = time.perf_counter()
+                meta = _write_image(ring, job["slot"], image, job["output"])
+                trace.add_span(f"{meta['format']}_write", start, time.perf_counter(), bytes=meta["length"])
+            elif op == "batch":
+                request = SimpleNamespace(**job["request"])
+                cells = [SweepCell(**c) for c in job["cells"]]
+                with engine.use_adapter(adapter, job["lora_scale"], trace):
+                    images = engine.generate_batch(request, cells, trace)
+                # One image at a time through the slot; the parent acks each
+                for image in images:
+                    conn.send(("image", _write_image(ring, job["slot"], image, "raw")))
+                    conn.recv()
+                meta = {"count": len(images)}
+            elif op == "unload_adapter":
+                engine.unload_adapter(job["name"])
+                meta = {}
+            else:
+                raise ValueError(f"Unknown op {op!r}")
+            conn.send(("done", {
+                "meta": meta,
+                "spans": trace.spans,
+                "adapters": engine.adapter_summary(),
+                "memory_stats": engine.memory_stats(),
+            }))
+        except Exception as e:
+            logger.exception(f"Worker job {op} failed")
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+    ring.close()
+
+
+class WorkerEngine(Engine):
+    """Runs another engine in a supervised child process"""
+
+    name = "worker"
+
+    def __init__(self, model_id: str, engine_name: Optional[str] = None, output: Optional[str] = None,
+                 slots: Optional[int] = None, slot_mb: Optional[int] = None,
+                 start_timeout: Optional[float] = None):
+        super().__init__()
+        self.model_name = model_id
+        self.engine_name = (engine_name or os.getenv("WORKER_ENGINE", "diffusers")).strip().lower()
+        if self.engine_name not in WORKER_ENGINES:
+            raise ValueError(f"WORKER_ENGINE must be one of {', '.join(WORKER_ENGINES)}, got {self.engine_name!r}")
+        self.output = (output or os.getenv("WORKER_OUTPUT", "png")).strip().lower()
+        if self.output not in WORKER_OUTPUTS:
+            raise ValueError(f"WORKER_OUTPUT must be one of {', '.join(WORKER_OUTPUTS)}, got {self.output!r}")
+        self.slots = slots or int(os.getenv("WORKER_RING_SLOTS", "2"))
+        self.slot_size = (slot_mb or int(os.getenv("WORKER_SLOT_MB", "32"))) * 1024 * 1024
+        self.start_timeout = start_timeout or float(os.getenv("WORKER_START_TIMEOUT", "1800"))
+
+        self.ring: Optional[SharedRing] = None
+        self.process = None
+        self.conn = None
+        self.restarts = 0
+        self._failures = 0
+        self._next_restart = 0.0
+        self.memory_modes: Dict[str, Any] = {}
+        self._info: Dict[str, Any] = {}
+        self._adapters: Dict[str, Any] = {}
+        self._job_adapter = (None, 1.0)
+        self._ready = threading.Event()
+        self._stopping = threading.Event()
+        self._supervisor: Optional[threading.Thread] = None
+
+    # -- process lifecycle -------------------------------------------------
+
+    def _spawn(self) -> None:
+        if self.conn is not None:
+            self.conn.close()
+        # CUDA cannot be re-initialised in a forked child
+        ctx = mp.get_context("spawn")
+        parent_conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=worker_main,
+            args=(child_conn, self.ring.name, self.slots, self.slot_size, self.engine_name, self.model_name),
+            name=f"qwen-image-worker-{self.model_name}",
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+
+    def _wait_ready(self) -> None:
+        deadline = time.monotonic() + self.start_timeout
+        while not self.conn.poll(0.5):
+            if not self.process.is_alive():
+                raise WorkerCrashed(f"Worker exited with code {self.process.exitcode} while loading",
+                                    retry_after=30)
+            if time.monotonic() > deadline:
+                raise WorkerCrashed("Worker did not finish loading in time", retry_after=30)
+        try:
+            kind, info = self.conn.recv()
+        except (EOFError, OSError):
+            raise WorkerCrashed("Worker connection closed while loading", retry_after=30)
+        if kind != "ready":
+            raise WorkerCrashed(f"Worker failed to load: {info}", retry_after=30)
+        self._info = info
+        self.memory_modes = info.get("memory_modes", {})
+        self._ready.set()
+        logger.info(f"Worker for {self.model_name} ready (pid {self.process.pid})")
+
+    def _ensure_worker(self) -> None:
+        """Restart the worker if it died; called with the engine lock held"""
+        if self.process.is_alive() and self._ready.is_set():
+            return
+        if self._stopping.is_set():
+            raise EngineUnavailable("Engine is unloading", retry_after=30)
+        backoff = self._next_restart - time.monotonic()
+        if backoff > 0:
+            raise EngineUnavailable("Worker restart failed, retrying shortly", retry_after=backoff)
+
+        self._ready.clear()
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.restarts += 1
+        logger.error(f"Worker for {self.model_name} exited with code {self.process.exitcode}; "
+                     f"restarting (restart #{self.restarts})")
+        try:
+            self._spawn()
+            self._wait_ready()
+            self._failures = 0
+        except EngineUnavailable:
+            self._failures += 1
+            self._next_restart = time.monotonic() + min(60, 2 ** self._failures)
+            raise
+
+    def _supervise(self) -> None:
+        """Restart an idle worker as soon as it dies; busy ones are restarted
+        by the next job"""
+        while not self._stopping.is_set():
+            self.process.join(timeout=1.0)
+            if self._stopping.is_set() or self.process.is_alive():
+                continue
+            try:
+                with self._lock:
+                    if not self._stopping.is_set():
+                        self._ensure_worker()
+            except EngineUnavailable as e:
+                logger.error(f"Worker restart failed: {e}")
+                self._stopping.wait(1.0)
+
+    @property
+    def loaded(self) -> bool:
+        return self._ready.is_set()
+
+    def load(self) -> None:
+        self.ring = SharedRing(self.slots, self.slot_size)
+        try:
+            self._spawn()
+            self._wait_ready()
+        except Exception:
+            self.unload()
+            raise
+        self._supervisor = threading.Thread(target=self._supervise, daemon=True,
+                                            name=f"supervisor-{self.model_name}")
+        self._supervisor.start()
+
+    def unload(self) -> None:
+        self._stopping.set()
+        self._ready.clear()
+        if self.conn is not None:
+            self.conn.close()
+        if self.process is not None:
+            self.process.join(timeout=30)
+            if self.process.is_alive():
+                self.process.kill()
+        if self._supervisor is not None:
+            self._supervisor.join(timeout=5)
+        if self.ring is not None:
+            self.ring.close()
+
+    # -- jobs --------------------------------------------------------------
+
+    def _recv(self):
+        """Next message from the worker; raises WorkerCrashed if it died instead"""
+        while not self.conn.poll(0.5):
+            if not self.process.is_alive():
+                raise WorkerCrashed(f"Worker exited with code {self.process.exitcode}", retry_after=30)
+        try:
+            return self.conn.recv()
+        except (EOFError, OSError):
+            raise WorkerCrashed("Worker connection closed", retry_after=30)
+
+    def _run(self, job: Dict[str, Any], trace, on_image=None) -> Dict[str, Any]:
+        """Send one job and wait for its result; called with the engine lock held"""
+        self._ensure_worker()
+        spec, scale = self._job_adapter
+        job.update(adapter=asdict(spec) if spec else None, lora_scale=scale)
+        try:
+            self.conn.send(job)
+            while True:
+                kind, payload = self._recv()
+                if kind == "image":
+                    on_image(payload)
+                    self.conn.send("ack")
+                elif kind == "error":
+                    raise RuntimeError(payload)
+                else:
+                    break
+        except (WorkerCrashed, OSError) as e:
+            # The process may not be reaped yet; make the next job restart it
+            self._ready.clear()
+            if isinstance(e, WorkerCrashed):
+                raise
+            raise WorkerCrashed("Worker connection closed", retry_after=30)
+        self._adapters = payload["adapters"]
+        self._info["memory_stats"] = payload["memory_stats"]
+        if trace is not None:
+            for name, start, end, attrs in payload["spans"]:
+                # perf_counter is the system-wide monotonic clock, so worker
+                # timestamps line up with this process's spans
+                trace.add_span(name, start, end, worker=True, **attrs)
+        return payload["meta"]
+
+    @contextmanager
+    def use_adapter(self, spec: Optional[AdapterSpec], scale: float = 1.0, trace=None):
+        # The worker keeps the adapter LRU; record what the next job should use
+        with self._lock:
+            self._job_adapter = (spec, scale)
+            try:
+                yield
+            finally:
+                self._job_adapter = (None, 1.0)
+
+    def _read_raw(self, slot: int, meta: Dict[str, Any]) -> Image.Image:
+        view = self.ring.view(slot, meta["length"])
+        try:
+            # RGB cannot be mapped, so this is the one copy out of the ring
+            return Image.frombuffer("RGB", tuple(meta["size"]), view, "raw", "RGB", 0, 1)
+        finally:
+            view.release()
+
+    def generate(self, request, seed: int, trace=None):
+        slot = self.ring.acquire(timeout=60)
+        leased = False
+        try:
+            meta = self._run({
+                "op": "generate", "request": self._request_fields(request), "seed": seed,
+                "slot": slot, "output": self.output,
+            }, trace)
+            if meta["format"] == "raw":
+                return self._read_raw(slot, meta)
+
+            # PNG bytes stay in the slot until the caller has sent them
+            view = self.ring.view(slot, meta["length"])
+
+            def release():
+                view.release()
+                self.ring.release(slot)
+
+            leased = True
+            return EncodedImage(data=view, release=release)
+        finally:
+            if not leased:
+                self.ring.release(slot)
+
+    def generate_batch(self, request, cells: Sequence[SweepCell], trace=None) -> List[Image.Image]:
+        slot = self.ring.acquire(timeout=60)
+        images: List[Image.Image] = []
+        try:
+            self._run({
+                "op": "batch", "request": self._request_fields(request),
+                "cells": [asdict(c) for c in cells], "slot": slot,
+            }, trace, on_image=lambda meta: images.append(self._read_raw(slot, meta)))
+        finally:
+            self.ring.release(slot)
+        return images
+
+    @staticmethod
+    def _request_fields(request) -> Dict[str, Any]:
+        fields = ("prompt", "negative_prompt", "width", "height", "num_inference_steps", "true_cfg_scale")
+        return {f: getattr(request, f) for f in fields if hasattr(request, f)}
+
+    def unload_adapter(self, name: str) -> None:
+        with self._lock:
+            self._run({"op": "unload_adapter", "name": name}, None)
+
+    def adapter_summary(self) -> Dict[str, Any]:
+        return self._adapters
+
+    def precision_info(self) -> Dict[str, Any]:
+        return self._info.get("precision", {})
+
+    def device_info(self) -> Dict[str, Any]:
+        return {
+            **self._info.get("device_info", {}),
+            "worker": {
+                "engine": self.engine_name,
+                "pid": self.process.pid if self.process else None,
+                "alive": bool(self.process and self.process.is_alive()),
+                "ready": self._ready.is_set(),
+                "restarts": self.restarts,
+                "output": self.output,
+            },
+        }
+
+    def memory_stats(self) -> List[Dict[str, Any]]:
+        return self._info.get("memory_stats", [])
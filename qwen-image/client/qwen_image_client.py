@@ -0,0 +1,392 @@
+"""
+Client for the Qwen-Image backend (`/generate`, `/sweep`, `/health`,
+`/model-info`, `/traces`).
+
+- Connection pooling through one `requests.Session` per client
+- Retries with jittered exponential backoff on connection errors, on 429/503
+  and, for GETs only, on 502/504; a `Retry-After` from the server sets the
+  minimum wait and holds back every other request from the same client until
+  it has passed
+- At most `max_concurrency` requests in flight, optionally at most
+  `rate_limit` requests per second
+- `/generate` asks for `Accept: image/png`, so the image arrives as PNG bytes
+  without base64; backends that only speak JSON are handled transparently
+
+    client = QwenImageClient("http://localhost:8000")
+    result = client.generate("A lighthouse at dusk", seed=42, width=1024, height=1024)
+    result.image.save("out.png")        # PIL image
+    pixels = result.to_numpy()          # HxWx3 uint8
+
+    async with AsyncQwenImageClient("http://localhost:8000") as client:
+        results = await asyncio.gather(*(client.generate(p) for p in prompts))
+"""
+
+import asyncio
+import base64
+import logging
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from io import BytesIO
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_API_URL = os.getenv("API_URL", "http://localhost:8000")
+
+# (connect, read) seconds; a 1328x1328 image at 50 steps takes 30-60s on one GPU
+DEFAULT_TIMEOUT = (5.0, 300.0)
+
+
+class APIError(Exception):
+    """Non-2xx response that was not (or no longer) worth retrying"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: Optional[float] = None):
+        super().__init__(f"{status_code}: {detail}")
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+@dataclass
+class RetryPolicy:
+    max_attempts: int = 4
+    backoff: float = 0.5  # base delay, doubled per attempt
+    max_backoff: float = 30.0
+    retry_statuses: Tuple[int, ...] = (429, 502, 503, 504)
+    # The backend answers 429/503 before doing any work; a 502/504 from a proxy
+    # may hide a job that is still running, so a POST retry would duplicate it
+    post_retry_statuses: Tuple[int, ...] = (429, 503)
+
+    def __post_init__(self):
+        if self.max_attempts < 1:
+            raise ValueError(f"max_attempts must be at least 1, got {self.max_attempts}")
+
+    def retries(self, method: str, status_code: int) -> bool:
+        statuses = self.post_retry_statuses if method.upper() == "POST" else self.retry_statuses
+        return status_code in statuses
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Seconds to wait before attempt `attempt + 1` (attempts count from 0)"""
+        if retry_after is not None:
+            # The server knows when capacity frees up; jitter spreads clients out
+            return min(retry_after, self.max_backoff) + random.uniform(0, self.backoff)
+        # Full jitter
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+@dataclass
+class GenerationResult:
+    png: bytes
+    seed_used: int
+    model: str = ""
+    request_id: str = ""
+    timings: Dict[str, float] = field(default_factory=dict)  # server stage durations in ms
+    _image: Any = field(default=None, repr=False)
+
+    @property
+    def image(self):
+        """Decoded PIL image (cached)"""
+        if self._image is None:
+            from PIL import Image
+
+            self._image = Image.open(BytesIO(self.png))
+            self._image.load()
+        return self._image
+
+    def to_numpy(self):
+        import numpy as np
+
+        return np.asarray(self.image.convert("RGB"))
+
+    @property
+    def image_base64(self) -> str:
+        return base64.b64encode(self.png).decode()
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After in seconds; HTTP dates are not used by the backend"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+def parse_server_timing(header: str) -> Dict[str, float]:
+    """`pipeline;dur=41210.4, png_encode;dur=612.3` -> {"pipeline": 41210.4, ...}"""
+    timings = {}
+    for entry in header.split(","):
+        name, _, params = entry.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "dur" and name:
+                try:
+                    timings[name] = float(value)
+                except ValueError:
+                    pass
+    return timings
+
+
+def _error_detail(response: requests.Response) -> str:
+    try:
+        return str(response.json().get("detail", response.text))
+    except ValueError:
+        return response.text
+
+
+def _generation_payload(prompt: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    return {"prompt": prompt, **{k: v for k, v in params.items() if v is not None}}
+
+
+def _generation_result(response: requests.Response) -> GenerationResult:
+    headers = response.headers
+    if headers.get("Content-Type", "").startswith("image/png"):
+        return GenerationResult(
+            png=response.content,
+            seed_used=int(headers.get("X-Seed-Used", -1)),
+            model=headers.get("X-Model", ""),
+            request_id=headers.get("X-Request-ID", ""),
+            timings=parse_server_timing(headers.get("Server-Timing", "")),
+        )
+    data = response.json()
+    return GenerationResult(
+        png=base64.b64decode(data["image_base64"]),
+        seed_used=data["seed_used"],
+        model=data.get("model", ""),
+        request_id=data.get("request_id", headers.get("X-Request-ID", "")),
+        timings=data.get("timings", {}),
+    )
+
+
+class _Throttle:
+    """Shared back-off deadline plus an optional minimum spacing between requests"""
+
+    def __init__(self, rate_limit: Optional[float] = None):
+        self.interval = 1.0 / rate_limit if rate_limit else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+        self._blocked_until = 0.0
+
+    def reserve(self) -> float:
+        """Claim the next send slot; returns how long to wait before using it"""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot, self._blocked_until)
+            self._next_slot = slot + self.interval
+            return slot - now
+
+    def block(self, seconds: float) -> None:
+        """Hold every request from this client back for `seconds`"""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+
+class QwenImageClient:
+    """Thread-safe synchronous client"""
+
+    def __init__(self, base_url: str = DEFAULT_API_URL, timeout=DEFAULT_TIMEOUT,
+                 max_concurrency: int = 4, rate_limit: Optional[float] = None,
+                 retry: Optional[RetryPolicy] = None, binary: bool = True,
+                 client_id: Optional[str] = None, api_key: Optional[str] = None):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.retry = retry or RetryPolicy()
+        self.binary = binary
+        self.throttle = _Throttle(rate_limit)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # Fair-queuing identity on the backend
+        if client_id:
+            self.session.headers["X-Client-ID"] = client_id
+        if api_key:
+            self.session.headers["X-API-Key"] = api_key
+
+    def close(self) -> None:
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # -- transport ---------------------------------------------------------
+
+    def _send(self, method: str, path: str, timeout=None, **kwargs) -> requests.Response:
+        """One attempt; the caller holds a concurrency slot"""
+        return self.session.request(method, f"{self.base_url}{path}",
+                                    timeout=timeout or self.timeout, **kwargs)
+
+    def _check(self, response: requests.Response, attempt: int) -> Optional[float]:
+        """None if `response` is final, else the delay before retrying it"""
+        if (not self.retry.retries(response.request.method, response.status_code)
+                or attempt + 1 >= self.retry.max_attempts):
+            return None
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        if retry_after is not None:
+            self.throttle.block(retry_after)
+        delay = self.retry.delay(attempt, retry_after)
+        logger.info(f"{response.request.method} {response.url} returned {response.status_code}, "
+                    f"retrying in {delay:.1f}s")
+        return delay
+
+    def _retry_connection_error(self, error: Exception, attempt: int) -> float:
+        """Delay before retrying after `error`, or re-raise it.
+
+        Read timeouts are not retried: the server may still be generating, and
+        a retry would queue a duplicate job behind it.
+        """
+        # ConnectTimeout is a ConnectionError, ReadTimeout is not
+        if not isinstance(error, requests.exceptions.ConnectionError) or attempt + 1 >= self.retry.max_attempts:
+            raise error
+        delay = self.retry.delay(attempt)
+        logger.info(f"{type(error).__name__} ({error}), retrying in {delay:.1f}s")
+        return delay
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        """Send with throttling, a concurrency slot and retries; raises APIError on failure"""
+        for attempt in range(self.retry.max_attempts):
+            time.sleep(self.throttle.reserve())
+            try:
+                with self._slots:
+                    response = self._send(method, path, **kwargs)
+            except requests.exceptions.RequestException as e:
+                time.sleep(self._retry_connection_error(e, attempt))
+                continue
+            delay = self._check(response, attempt)
+            if delay is None:
+                break
+            time.sleep(delay)
+        if not response.ok:
+            raise APIError(response.status_code, _error_detail(response),
+                           parse_retry_after(response.headers.get("Retry-After")))
+        return response
+
+    # -- endpoints ---------------------------------------------------------
+
+    def _generate_headers(self, request_id: Optional[str], priority: Optional[str],
+                          client_id: Optional[str] = None) -> Dict[str, str]:
+        headers = {"Accept": "image/png, application/json;q=0.5" if self.binary else "application/json"}
+        if client_id:
+            # Per-call fair-queuing identity, e.g. one per UI session on a shared client
+            headers["X-Client-ID"] = client_id
+        if request_id:
+            headers["X-Request-ID"] = request_id
+        if priority:
+            headers["X-Priority"] = priority
+        return headers
+
+    def _sweep_headers(self, request_id: Optional[str], priority: Optional[str],
+                       client_id: Optional[str] = None) -> Dict[str, str]:
+        # A sweep answers with JSON only
+        return {**self._generate_headers(request_id, priority, client_id), "Accept": "application/json"}
+
+    def generate(self, prompt: str, request_id: Optional[str] = None, priority: Optional[str] = None,
+                 timeout=None, client_id: Optional[str] = None, **params) -> GenerationResult:
+        """POST /generate; `params` are GenerationRequest fields (seed, width, ...)"""
+        response = self.request("POST", "/generate", json=_generation_payload(prompt, params),
+                                headers=self._generate_headers(request_id, priority, client_id),
+                                timeout=timeout)
+        return _generation_result(response)
+
+    def sweep(self, prompt: str, request_id: Optional[str] = None, priority: Optional[str] = None,
+              timeout=None, client_id: Optional[str] = None, **params) -> Dict[str, Any]:
+        """POST /sweep; returns the JSON response"""
+        return self.request("POST", "/sweep", json=_generation_payload(prompt, params),
+                            headers=self._sweep_headers(request_id, priority, client_id),
+                            timeout=timeout).json()
+
+    def health(self, timeout=10.0) -> Dict[str, Any]:
+        return self.request("GET", "/health", timeout=timeout).json()
+
+    def model_info(self, timeout=10.0) -> Dict[str, Any]:
+        return self.request("GET", "/model-info", timeout=timeout).json()
+
+    def trace(self, request_id: str, timeout=5.0) -> Dict[str, Any]:
+        """Chrome trace for a finished request"""
+        return self.request("GET", f"/traces/{request_id}", timeout=timeout).json()
+
+
+class AsyncQwenImageClient:
+    """asyncio client sharing the sync client's pooled session.
+
+    Each attempt runs on a worker thread; waiting (throttle, backoff,
+    concurrency) happens on the event loop, so a thousand queued coroutines
+    hold no threads and no connections.
+    """
+
+    def __init__(self, base_url: str = DEFAULT_API_URL, **kwargs):
+        self.sync = QwenImageClient(base_url, **kwargs)
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    @property
+    def slots(self) -> asyncio.Semaphore:
+        # Created lazily so it binds to the running loop
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.sync.max_concurrency)
+        return self._slots
+
+    async def close(self) -> None:
+        self.sync.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        sync = self.sync
+        for attempt in range(sync.retry.max_attempts):
+            await asyncio.sleep(sync.throttle.reserve())
+            try:
+                async with self.slots:
+                    response = await asyncio.to_thread(sync._send, method, path, **kwargs)
+            except requests.exceptions.RequestException as e:
+                await asyncio.sleep(sync._retry_connection_error(e, attempt))
+                continue
+            delay = sync._check(response, attempt)
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
+        if not response.ok:
+            raise APIError(response.status_code, _error_detail(response),
+                           parse_retry_after(response.headers.get("Retry-After")))
+        return response
+
+    async def generate(self, prompt: str, request_id: Optional[str] = None,
+                       priority: Optional[str] = None, timeout=None, client_id: Optional[str] = None,
+                       **params) -> GenerationResult:
+        response = await self.request("POST", "/generate", json=_generation_payload(prompt, params),
+                                      headers=self.sync._generate_headers(request_id, priority, client_id),
+                                      timeout=timeout)
+        return _generation_result(response)
+
+    async def sweep(self, prompt: str, request_id: Optional[str] = None,
+                    priority: Optional[str] = None, timeout=None, client_id: Optional[str] = None,
+                    **params) -> Dict[str, Any]:
+        response = await self.request("POST", "/sweep", json=_generation_payload(prompt, params),
+                                      headers=self.sync._sweep_headers(request_id, priority, client_id),
+                                      timeout=timeout)
+        return response.json()
+
+    async def health(self, timeout=10.0) -> Dict[str, Any]:
+        return (await self.request("GET", "/health", timeout=timeout)).json()
+
+    async def model_info(self, timeout=10.0) -> Dict[str, Any]:
+        return (await self.request("GET", "/model-info", timeout=timeout)).json()
+
+    async def trace(self, request_id: str, timeout=5.0) -> Dict[str, Any]:
+        return (await self.request("GET", f"/traces/{request_id}", timeout=timeout)).json()
@@ -0,0 +1,250 @@
+import asyncio
+import base64
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qwen_image_client import (  # noqa: E402
+    APIError,
+    AsyncQwenImageClient,
+    QwenImageClient,
+    RetryPolicy,
+    parse_server_timing,
+)
+
+FAST_RETRY = RetryPolicy(max_attempts=3, backoff=0.01)
+
+
+def png_for(seed):
+    buffer = BytesIO()
+    Image.new("RGB", (8, 6), (seed % 256, 0, 0)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class FakeBackend:
+    """Local HTTP server speaking the /generate, /health and /model-info API"""
+
+    def __init__(self, latency=0.0, png=True):
+        self.latency, self.png = latency, png
+        self.failures = []  # (status, retry_after) replies for the next requests
+        self.get_failures = []  # the same for GETs
+        self.gets = 0
+        self.requests = 0
+        self.last_headers = {}
+        self.in_flight = self.max_in_flight = 0
+        self.lock = threading.Lock()
+        backend = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status, body, content_type="application/json", headers=None):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                with backend.lock:
+                    backend.gets += 1
+                    failure = backend.get_failures.pop(0) if backend.get_failures else None
+                if failure:
+                    self._reply(failure[0], json.dumps({"detail": "bad gateway"}).encode())
+                elif self.path == "/health":
+                    self._reply(200, json.dumps({"status": "healthy", "model_loaded": True}).encode())
+                elif self.path == "/model-info":
+                    self._reply(200, json.dumps({"engine": "fake"}).encode())
+                else:
+                    self._reply(404, b'{"detail": "Not Found"}')
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with backend.lock:
+                    backend.requests += 1
+                    backend.last_headers = dict(self.headers)
+                    failure = backend.failures.pop(0) if backend.failures else None
+                    backend.in_flight += 1
+                    backend.max_in_flight = max(backend.max_in_flight, backend.in_flight)
+                try:
+                    time.sleep(backend.latency)
+                finally:
+                    with backend.lock:
+                        backend.in_flight -= 1
+                if failure:
+                    status, retry_after = failure
+                    headers = {"Retry-After": retry_after} if retry_after else {}
+                    self._reply(status, json.dumps({"detail": "busy"}).encode(), headers=headers)
+                    return
+                seed = payload.get("seed", 1)
+                timing = {"X-Request-ID": self.headers.get("X-Request-ID", "generated"),
+                          "Server-Timing": "pipeline;dur=12.5, png_encode;dur=1.5"}
+                if backend.png and "image/png" in self.headers.get("Accept", ""):
+                    self._reply(200, png_for(seed), "image/png",
+                                {"X-Seed-Used": str(seed), "X-Model": "fake", **timing})
+                else:
+                    body = {"image_base64": base64.b64encode(png_for(seed)).decode(),
+                            "seed_used": seed, "model": "fake", "timings": {"pipeline": 12.5}}
+                    self._reply(200, json.dumps(body).encode(), headers=timing)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def backend():
+    backend = FakeBackend()
+    yield backend
+    backend.close()
+
+
+def test_binary_and_json_responses_decode_the_same(backend):
+    with QwenImageClient(backend.url, retry=FAST_RETRY) as client:
+        binary = client.generate("a cat", seed=9, request_id="req-1", client_id="session-1")
+        assert backend.last_headers["X-Client-ID"] == "session-1"
+        as_json = QwenImageClient(backend.url, binary=False).generate("a cat", seed=9)
+
+    assert binary.png == as_json.png
+    assert binary.seed_used == as_json.seed_used == 9
+    assert binary.request_id == "req-1"
+    assert binary.timings == {"pipeline": 12.5, "png_encode": 1.5}
+    assert binary.image.size == (8, 6)
+    assert binary.to_numpy().shape == (6, 8, 3)
+    assert binary.to_numpy()[0, 0, 0] == 9
+
+
+def test_health_and_model_info(backend):
+    client = QwenImageClient(backend.url)
+    assert client.health()["model_loaded"] is True
+    assert client.model_info()["engine"] == "fake"
+    with pytest.raises(APIError) as error:
+        client.trace("missing")
+    assert error.value.status_code == 404
+
+
+def test_retries_honour_retry_after(backend):
+    backend.failures = [(503, "0.3"), (429, "0.3")]
+    client = QwenImageClient(backend.url, retry=FAST_RETRY)
+
+    start = time.perf_counter()
+    result = client.generate("x", seed=3)
+    assert time.perf_counter() - start >= 0.6
+    assert result.seed_used == 3 and backend.requests == 3
+
+
+def test_gives_up_after_max_attempts_and_on_500(backend):
+    client = QwenImageClient(backend.url, retry=FAST_RETRY)
+    backend.failures = [(429, "0")] * 3
+    with pytest.raises(APIError) as error:
+        client.generate("x")
+    assert error.value.status_code == 429 and backend.requests == 3
+
+    backend.failures = [(500, None)]
+    with pytest.raises(APIError):
+        client.generate("x")
+    assert backend.requests == 4  # not retried
+
+
+def test_gateway_errors_are_retried_for_gets_only(backend):
+    client = QwenImageClient(backend.url, retry=FAST_RETRY)
+    backend.failures = [(504, None)]
+    with pytest.raises(APIError) as error:
+        client.generate("x")
+    # The backend may still be generating behind the gateway
+    assert error.value.status_code == 504 and backend.requests == 1
+
+    backend.failures = [(502, None)]
+    with pytest.raises(APIError):
+        client.sweep("x", cfg_scales=[2.0, 4.0])
+    assert backend.requests == 2
+
+    backend.get_failures = [(504, None), (502, None)]
+    assert client.health()["status"] == "healthy"
+    assert backend.gets == 3
+
+
+def test_connection_errors_are_retried():
+    client = QwenImageClient("http://127.0.0.1:9", retry=FAST_RETRY)
+    with pytest.raises(Exception) as error:
+        client.health()
+    assert "Connection" in type(error.value).__name__
+
+
+def test_concurrency_limit(backend):
+    backend.latency = 0.1
+    client = QwenImageClient(backend.url, max_concurrency=2)
+    threads = [threading.Thread(target=client.generate, args=("x",)) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert backend.requests == 6 and backend.max_in_flight == 2
+
+
+def test_rate_limit(backend):
+    client = QwenImageClient(backend.url, rate_limit=10)
+    start = time.perf_counter()
+    for _ in range(4):
+        client.health()
+    # First request goes immediately, the next three 0.1s apart
+    assert time.perf_counter() - start >= 0.3
+
+
+def test_retry_policy_needs_one_attempt():
+    with pytest.raises(ValueError, match="max_attempts"):
+        RetryPolicy(max_attempts=0)
+
+
+def test_async_client(backend):
+    backend.latency = 0.05
+    backend.failures = [(503, "0.1")]
+
+    async def run():
+        async with AsyncQwenImageClient(backend.url, max_concurrency=3, retry=FAST_RETRY) as client:
+            health = await client.health()
+            results = await asyncio.gather(*(client.generate("x", seed=s) for s in range(8)))
+        return health, results
+
+    health, results = asyncio.run(run())
+    assert health["status"] == "healthy"
+    assert [r.seed_used for r in results] == list(range(8))
+    assert backend.requests == 9 and backend.max_in_flight <= 3
+
+
+def test_async_sweep_and_trace(backend):
+    async def run():
+        async with AsyncQwenImageClient(backend.url, retry=FAST_RETRY) as client:
+            sweep = await client.sweep("x", seed=4, client_id="session-2")
+            with pytest.raises(APIError) as error:
+                await client.trace("missing")
+        return sweep, error.value
+
+    sweep, error = asyncio.run(run())
+    assert sweep["seed_used"] == 4
+    assert backend.last_headers["Accept"] == "application/json"
+    assert backend.last_headers["X-Client-ID"] == "session-2"
+    assert error.status_code == 404
+
+
+def test_parse_server_timing():
+    assert parse_server_timing("queue;dur=0.4, pipeline;dur=41210.4;desc=x, bad") == {
+        "queue": 0.4, "pipeline": 41210.4}
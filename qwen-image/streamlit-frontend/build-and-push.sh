@@ -16,8 +16,8 @@ echo "Building and pushing ${IMAGE_NAME} to ${ECR_REPO}:${TAG}"
 # Login to ECR
 aws ecr get-login-password --region ${REGION} | docker login --username AWS --password-stdin ${ACCOUNT_ID}.dkr.ecr.${REGION}.amazonaws.com
 
-# Build image
-docker build -t ${IMAGE_NAME}:${TAG} .
+# Build image from qwen-image/ so the client package is in the context
+docker build -f Dockerfile -t ${IMAGE_NAME}:${TAG} ..
 
 # Tag for ECR
 docker tag ${IMAGE_NAME}:${TAG} ${ECR_REPO}:${TAG}
@@ -1,10 +1,16 @@
 import streamlit as st
 import requests
 import base64
-from PIL import Image
 from io import BytesIO
 import time
 import os
+import json
+import uuid
+
+from qwen_image_client import APIError, QwenImageClient
+
+# Start of this Streamlit script run, used to time the rerun before a request
+script_start = time.time()
 
 # Page config
 st.set_page_config(page_title="Image Generator", page_icon="🎨", layout="wide")
@@ -18,6 +24,10 @@ if "current_prompt" not in st.session_state:
     st.session_state.current_prompt = "A beautiful landscape with mountains and lakes"
 if "generating" not in st.session_state:
     st.session_state.generating = False
+if "client_id" not in st.session_state:
+    # Fair-queuing identity on the backend: one per browser session rather
+    # than every user sharing this server's IP
+    st.session_state.client_id = uuid.uuid4().hex
 
 # Title and description
 st.title("🎨 Image Generator")
@@ -25,6 +35,26 @@ st.markdown(
     "Generate high-quality images with complex text rendering using Qwen-Image model"
 )
 
+def build_chrome_trace(request_id, client_spans, server_trace=None):
+    """Merge client spans [(name, start, end)] in wall-clock seconds with the
+    backend's Chrome trace for the same request"""
+    events = [
+        {
+            "name": name,
+            "ph": "X",
+            "pid": "streamlit-frontend",
+            "tid": "client",
+            "ts": start * 1e6,
+            "dur": (end - start) * 1e6,
+            "args": {"request_id": request_id},
+        }
+        for name, start, end in client_spans
+    ]
+    if server_trace:
+        events.extend(server_trace.get("traceEvents", []))
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
 # Sidebar for parameters
 st.sidebar.header("Generation Parameters")
 
@@ -32,6 +62,15 @@ st.sidebar.header("Generation Parameters")
 default_api_url = os.getenv("API_URL", "http://localhost:8000")
 api_url = st.sidebar.text_input("API Endpoint", value=default_api_url)
 
+
+@st.cache_resource
+def get_client(url):
+    """One pooled client per endpoint, shared across reruns and sessions"""
+    return QwenImageClient(url, timeout=(5, 180))
+
+
+client = get_client(api_url)
+
 # Generation parameters
 prompt = st.text_area(
     "Prompt",
@@ -222,52 +261,85 @@ if st.button("🚀 Generate Image", type="primary"):
             status_text = st.empty()
 
             try:
+                request_id = uuid.uuid4().hex
                 start_time = time.time()
 
-                # Make API request
-                response = requests.post(
-                    f"{api_url}/generate", json=payload, timeout=180
+                # Make API request (PNG body, retried on 429/503)
+                result = client.generate(
+                    request_id=request_id,
+                    priority="interactive",
+                    client_id=st.session_state.client_id,
+                    **payload,
                 )
 
                 elapsed_time = time.time() - start_time
 
-                if response.status_code == 200:
-                    progress_bar.progress(100)
-                    status_text.success(f"✅ Generated in {elapsed_time:.1f} seconds!")
-
-                    # Decode and store image in session state
-                    data = response.json()
-                    img_data = base64.b64decode(data["image_base64"])
-                    img = Image.open(BytesIO(img_data))
-
-                    # Get the actual seed used (important for random seeds)
-                    actual_seed = data.get("seed_used", seed)
-
-                    # Store image and generation info in session state
-                    st.session_state.generated_image = img
-                    st.session_state.generation_info = {
-                        "prompt": enhanced_prompt,
-                        "original_prompt": prompt,
-                        "negative_prompt": negative_prompt,
-                        "elapsed_time": elapsed_time,
-                        "timestamp": int(time.time()),
-                        "parameters": {
-                            "steps": num_steps,
-                            "cfg_scale": cfg_scale,
-                            "resolution": f"{width}x{height}",
-                            "seed": actual_seed,
-                            "aspect_ratio": selected_ratio,
-                            "language_enhancement": language,
-                            "custom_enhancement": custom_positive,
-                        },
-                    }
-                    st.session_state.generating = False
+                progress_bar.progress(100)
+                status_text.success(f"✅ Generated in {elapsed_time:.1f} seconds!")
 
-                else:
-                    st.error(
-                        f"Generation failed: {response.status_code} - {response.text}"
-                    )
+                # Decode and store image in session state
+                decode_start = time.time()
+                img = result.image
+                decode_end = time.time()
 
+                # Client and server stage timings for this request
+                server_timings = result.timings
+                server_total_ms = sum(
+                    server_timings.get(stage, 0.0)
+                    for stage in ("pipeline", "png_encode", "base64_encode")
+                )
+                client_timings = {
+                    "streamlit_rerun": (start_time - script_start) * 1000,
+                    "http_request": elapsed_time * 1000,
+                    "network_and_queue": max(
+                        0.0, elapsed_time * 1000 - server_total_ms
+                    ),
+                    "client_decode": (decode_end - decode_start) * 1000,
+                }
+                try:
+                    server_trace = client.trace(result.request_id)
+                except Exception:
+                    server_trace = None
+                trace = build_chrome_trace(
+                    result.request_id,
+                    [
+                        ("streamlit_rerun", script_start, start_time),
+                        ("http_request", start_time, start_time + elapsed_time),
+                        ("client_decode", decode_start, decode_end),
+                    ],
+                    server_trace,
+                )
+
+                # Get the actual seed used (important for random seeds)
+                actual_seed = result.seed_used
+
+                # Store image and generation info in session state
+                st.session_state.generated_image = img
+                st.session_state.generation_info = {
+                    "prompt": enhanced_prompt,
+                    "original_prompt": prompt,
+                    "negative_prompt": negative_prompt,
+                    "elapsed_time": elapsed_time,
+                    "timestamp": int(time.time()),
+                    "request_id": result.request_id,
+                    "client_timings": client_timings,
+                    "server_timings": server_timings,
+                    "trace": trace,
+                    "parameters": {
+                        "steps": num_steps,
+                        "cfg_scale": cfg_scale,
+                        "resolution": f"{width}x{height}",
+                        "seed": actual_seed,
+                        "aspect_ratio": selected_ratio,
+                        "language_enhancement": language,
+                        "custom_enhancement": custom_positive,
+                    },
+                }
+                st.session_state.generating = False
+
+            except APIError as e:
+                st.error(f"Generation failed: {e.status_code} - {e.detail}")
+                st.session_state.generating = False
             except requests.exceptions.Timeout:
                 st.error(
                     "⏰ Request timed out. The model might be loading or overloaded."
@@ -341,6 +413,26 @@ if st.session_state.generated_image is not None and not st.session_state.generat
                 f"**Seed:** {st.session_state.generation_info['parameters']['seed']}"
             )
 
+    # Timing breakdown for this request
+    with st.expander("⏱️ Timing Breakdown"):
+        st.caption(f"Request ID: `{st.session_state.generation_info['request_id']}`")
+        timing_col1, timing_col2 = st.columns(2)
+        with timing_col1:
+            st.write("**Client**")
+            for stage, ms in st.session_state.generation_info["client_timings"].items():
+                st.write(f"{stage}: {ms:.0f} ms")
+        with timing_col2:
+            st.write("**Server**")
+            for stage, ms in st.session_state.generation_info["server_timings"].items():
+                st.write(f"{stage}: {ms:.0f} ms")
+        st.download_button(
+            label="📥 Download Chrome Trace",
+            data=json.dumps(st.session_state.generation_info["trace"]),
+            file_name=f"trace_{st.session_state.generation_info['request_id']}.json",
+            mime="application/json",
+            help="Open in chrome://tracing or https://ui.perfetto.dev",
+        )
+
     # Download button
     img_buffer = BytesIO()
     st.session_state.generated_image.save(img_buffer, format="PNG")
@@ -357,25 +449,121 @@ if st.session_state.generated_image is not None and not st.session_state.generat
         st.session_state.generation_info = None
         st.rerun()
 
+
+def parse_values(text, cast):
+    """Comma-separated numbers from a text input"""
+    return [cast(v.strip()) for v in text.split(",") if v.strip()]
+
+
+# Parameter sweep: one prompt over a grid of cfg scales, steps and seeds
+st.markdown("---")
+with st.expander("🔬 Parameter Sweep"):
+    st.caption(
+        "Runs the prompt above over every combination in one request. Cells share "
+        "the prompt embeddings and each seed's initial noise, so only cfg and steps "
+        "change across the grid. Each cell still takes about as long as one image."
+    )
+    sweep_col1, sweep_col2, sweep_col3 = st.columns(3)
+    with sweep_col1:
+        sweep_cfg_text = st.text_input("CFG Scales", value="2.5, 4.0, 6.0")
+    with sweep_col2:
+        sweep_steps_text = st.text_input("Inference Steps", value="20, 30, 50")
+    with sweep_col3:
+        sweep_seeds_text = st.text_input("Seeds", value="42")
+    sweep_include_images = st.checkbox("Return full-size images", value=True)
+
+    if st.button("🧪 Run Sweep"):
+        try:
+            sweep_payload = {
+                "prompt": prompt + positive_magic if positive_magic else prompt,
+                "negative_prompt": negative_prompt if negative_prompt.strip() else " ",
+                "width": width,
+                "height": height,
+                "cfg_scales": parse_values(sweep_cfg_text, float),
+                "steps": parse_values(sweep_steps_text, int),
+                "seeds": parse_values(sweep_seeds_text, int),
+                "include_images": sweep_include_images,
+            }
+        except ValueError:
+            st.error("CFG scales, steps and seeds must be comma-separated numbers")
+            sweep_payload = None
+
+        if sweep_payload and not prompt.strip():
+            st.error("Please enter a prompt!")
+        elif sweep_payload:
+            cell_count = (
+                len(sweep_payload["cfg_scales"])
+                * len(sweep_payload["steps"])
+                * len(sweep_payload["seeds"])
+            )
+            with st.spinner(f"Sweeping {cell_count} combinations..."):
+                try:
+                    sweep_start = time.time()
+                    sweep_data = client.sweep(
+                        request_id=uuid.uuid4().hex,
+                        priority="interactive",
+                        client_id=st.session_state.client_id,
+                        timeout=(5, 180 * cell_count),
+                        **sweep_payload,
+                    )
+                    st.session_state.sweep_result = {
+                        "data": sweep_data,
+                        "elapsed_time": time.time() - sweep_start,
+                        "timestamp": int(time.time()),
+                    }
+                except APIError as e:
+                    st.error(f"Sweep failed: {e.status_code} - {e.detail}")
+                except requests.exceptions.Timeout:
+                    st.error("⏰ Sweep timed out. Try fewer combinations.")
+                except requests.exceptions.ConnectionError:
+                    st.error(f"❌ Cannot connect to API at {api_url}.")
+
+    sweep_result = st.session_state.get("sweep_result")
+    if sweep_result:
+        sweep_data = sweep_result["data"]
+        st.success(
+            f"✅ {len(sweep_data['cells'])} images in {sweep_result['elapsed_time']:.1f}s"
+        )
+        sheet_bytes = base64.b64decode(sweep_data["contact_sheet_base64"])
+        grid_view = st.radio("View", ["Grid", "Contact sheet"], horizontal=True)
+
+        if grid_view == "Contact sheet" or not sweep_data["cells"][0].get("image_base64"):
+            st.image(sheet_bytes, caption="Rows: CFG scale · Columns: steps × seed")
+        else:
+            columns = sweep_data["columns"]
+            for row_start in range(0, len(sweep_data["cells"]), columns):
+                row = st.columns(columns)
+                for col, cell in zip(row, sweep_data["cells"][row_start:row_start + columns]):
+                    with col:
+                        st.image(
+                            base64.b64decode(cell["image_base64"]),
+                            caption=f"cfg {cell['cfg_scale']:g} · {cell['steps']} steps · seed {cell['seed']}",
+                        )
+
+        st.download_button(
+            label="📥 Download Contact Sheet",
+            data=sheet_bytes,
+            file_name=f"qwen_sweep_{sweep_result['timestamp']}.png",
+            mime="image/png",
+        )
+
 # Health check section
 st.sidebar.markdown("---")
 st.sidebar.subheader("Service Status")
 
 if st.sidebar.button("Check Health"):
     try:
-        health_response = requests.get(f"{api_url}/health", timeout=10)
-        if health_response.status_code == 200:
-            health_data = health_response.json()
-            st.sidebar.success("✅ Service is healthy")
-
-            if "gpu_info" in health_data:
-                gpu_info = health_data["gpu_info"]
-                st.sidebar.write(f"GPUs: {gpu_info.get('gpu_count', 'N/A')}")
-                if "gpu_memory" in gpu_info:
-                    for i, mem in enumerate(gpu_info["gpu_memory"]):
-                        st.sidebar.write(f"GPU {i}: {mem}")
-        else:
-            st.sidebar.error("❌ Service unhealthy")
+        health_data = client.health()
+        st.sidebar.success("✅ Service is healthy")
+
+        if "gpu_info" in health_data:
+            gpu_info = health_data["gpu_info"]
+            st.sidebar.write(f"GPUs: {gpu_info.get('gpu_count', 'N/A')}")
+            if "gpu_memory" in gpu_info:
+                for i, mem in enumerate(gpu_info["gpu_memory"]):
+                    st.sidebar.write(f"GPU {i}: {mem}")
+    except APIError:
+        st.sidebar.error("❌ Service unhealthy")
     except:
         st.sidebar.error("❌ Cannot reach service")
 
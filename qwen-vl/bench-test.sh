@@ -1,10 +1,15 @@
-vllm bench serve \
-  --host qwen-vl \
-  --port 80 \
-  --backend openai-chat \
-  --endpoint /v1/chat/completions \
-  --endpoint-type openai-chat \
-  --model Qwen/Qwen2.5-VL-7B-Instruct \
-  --dataset-name hf \
-  --dataset-path lmarena-ai/VisionArena-Chat \
-  --num-prompts 128
+#!/bin/bash
+
+# Benchmark the qwen-vl service with the local serving benchmark
+# (synthetic dataset, no Hugging Face Hub access required).
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+
+python "$SCRIPT_DIR/../benchmarks/serve_bench.py" run \
+  --service vl \
+  --base-url http://qwen-vl:80 \
+  --dataset synthetic \
+  --num-requests 128 \
+  --mode closed \
+  --concurrency 16 \
+  --output-json bench-vl.json \
+  --output-csv bench-vl.csv
@@ -0,0 +1,265 @@
+"""
+Conversation context management for the Qwen2.5-VL chat tabs.
+
+Keeps the prompt sent to vLLM under a token budget while preserving a stable
+prefix so that vLLM's automatic prefix caching keeps hitting:
+
+- the system prompt and the first `pin_turns` turns are never dropped
+- older turns are removed in blocks (down to `low_watermark` of the budget)
+  instead of one per request, so the cut point only moves occasionally
+- dropped turns can optionally be replaced by a summary
+- message content is never rewritten, so image parts stay byte-identical
+"""
+
+import base64
+import io
+import logging
+import math
+import os
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Qwen2.5-VL merges 2x2 patches of 14px, i.e. one token per 28x28 pixels
+IMAGE_PATCH_SIZE = 28
+MIN_IMAGE_TOKENS = 4
+MAX_IMAGE_TOKENS = 16384
+# <|im_start|>role\n ... <|im_end|>\n
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+class TokenCounter:
+    """
+    Counts prompt tokens with the local Qwen tokenizer if it is available
+    (transformers installed and the tokenizer in the local HF cache), and
+    falls back to a fast character-based estimate otherwise.
+    """
+
+    def __init__(self, tokenizer_name: Optional[str] = None, default_image_tokens: int = 1024):
+        self.default_image_tokens = default_image_tokens
+        self._image_tokens_cache: Dict[int, int] = {}
+        self.tokenizer = None
+
+        tokenizer_name = tokenizer_name or os.getenv("QWEN_TOKENIZER")
+        if tokenizer_name:
+            try:
+                from transformers import AutoTokenizer
+                self.tokenizer = AutoTokenizer.from_pretrained(
+                    tokenizer_name, local_files_only=True
+                )
+            except Exception as e:
+                logger.warning(f"Tokenizer {tokenizer_name} unavailable, using estimator: {e}")
+
+    @property
+    def method(self) -> str:
+        return "tokenizer" if self.tokenizer is not None else "estimate"
+
+    def count_text(self, text: str) -> int:
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text, add_special_tokens=False))
+        # ~4 characters per token for Latin text, ~1 per CJK character
+        ascii_chars = sum(1 for c in text if ord(c) < 128)
+        return math.ceil(ascii_chars / 4) + (len(text) - ascii_chars)
+
+    def count_image(self, url: str) -> int:
+        """Estimate vision tokens from the image size encoded in a data URL"""
+        key = hash(url)
+        if key not in self._image_tokens_cache:
+            self._image_tokens_cache[key] = self._image_tokens(url)
+        return self._image_tokens_cache[key]
+
+    def _image_tokens(self, url: str) -> int:
+        if not url.startswith("data:image/"):
+            return self.default_image_tokens
+        try:
+            from PIL import Image
+            data = base64.b64decode(url.split(",", 1)[1])
+            # Image.open only parses the header here
+            width, height = Image.open(io.BytesIO(data)).size
+        except Exception:
+            return self.default_image_tokens
+        tokens = math.ceil(width / IMAGE_PATCH_SIZE) * math.ceil(height / IMAGE_PATCH_SIZE)
+        return max(MIN_IMAGE_TOKENS, min(tokens, MAX_IMAGE_TOKENS))
+
+    def count_message(self, message: Dict[str, Any]) -> int:
+        content = message["content"]
+        if isinstance(content, str):
+            return MESSAGE_OVERHEAD_TOKENS + self.count_text(content)
+
+        tokens = MESSAGE_OVERHEAD_TOKENS
+        for part in content:
+            if part.get("type") == "text":
+                tokens += self.count_text(part["text"])
+            elif part.get("type") == "image_url":
+                tokens += self.count_image(part["image_url"]["url"])
+            elif part.get("type") == "video_url":
+                tokens += self.default_image_tokens * 4
+        return tokens
+
+    def count_messages(self, messages: List[Dict[str, Any]]) -> int:
+        return sum(self.count_message(m) for m in messages)
+
+
+@dataclass
+class ContextStats:
+    """What was sent for one turn"""
+    prompt_tokens: int
+    budget: int
+    total_turns: int
+    kept_turns: int
+    dropped_turns: int
+    summarized: bool
+    method: str
+
+
+@dataclass
+class ChatContext:
+    """
+    Builds the message list for each request from the full chat history.
+
+    `history` is the UI's list of {"role", "content"} messages (user/assistant
+    alternating, the last one being the pending user message). The instance is
+    meant to live in `st.session_state` so the cut point persists across turns.
+    """
+    counter: TokenCounter
+    max_prompt_tokens: int = 8192
+    system_prompt: Optional[str] = None
+    pin_turns: int = 1
+    low_watermark: float = 0.6
+    summarizer: Optional[Callable[[List[Dict[str, Any]]], str]] = None
+    # room left for the summary when choosing which turns to drop
+    summary_reserve_tokens: int = 300
+
+    # index (into the history) of the first non-pinned message still sent
+    cut: int = field(default=0, init=False)
+    summary: Optional[str] = field(default=None, init=False)
+    last_stats: Optional[ContextStats] = field(default=None, init=False)
+
+    def reset(self) -> None:
+        self.cut = 0
+        self.summary = None
+        self.last_stats = None
+
+    def _prefix(self, history: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        messages = []
+        if self.system_prompt:
+            messages.append({"role": "system", "content": self.system_prompt})
+        messages.extend({"role": m["role"], "content": m["content"]}
+                        for m in history[:self.pin_turns * 2])
+        if self.summary:
+            messages.append({"role": "user",
+                             "content": f"Summary of our earlier conversation:\n{self.summary}"})
+            messages.append({"role": "assistant", "content": "Understood."})
+        return messages
+
+    def _assemble(self, history: List[Dict[str, Any]], cut: Optional[int] = None) -> List[Dict[str, Any]]:
+        start = max(self.cut if cut is None else cut, self.pin_turns * 2)
+        # Content (and any image data URLs) is passed through as-is; extra UI
+        # keys such as per-turn stats are stripped
+        return self._prefix(history) + [
+            {"role": m["role"], "content": m["content"]} for m in history[start:]
+        ]
+
+    def build(self, history: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Return the messages to send and record the stats in `last_stats`"""
+        pinned = self.pin_turns * 2
+        if self.cut > max(len(history), pinned):
+            # History was cleared or edited
+            self.reset()
+        self.cut = max(self.cut, pinned)
+
+        messages = self._assemble(history)
+        tokens = self.counter.count_messages(messages)
+        summarized = False
+
+        if tokens > self.max_prompt_tokens:
+            # Drop whole turns (user + assistant) until under the low watermark,
+            # always keeping the pending user message
+            target = int(self.max_prompt_tokens * self.low_watermark)
+            if self.summarizer is not None:
+                target -= self.summary_reserve_tokens
+            new_cut = self.cut
+            while new_cut + 2 < len(history):
+                new_cut += 2
+                if self.counter.count_messages(self._assemble(history, new_cut)) <= target:
+                    break
+
+            if new_cut > self.cut:
+                if self.summarizer is not None:
+                    dropped = history[self.cut:new_cut]
+                    if self.summary:
+                        dropped = [{"role": "user", "content": self.summary}] + dropped
+                    try:
+                        self.summary = self.summarizer(dropped)
+                        summarized = True
+                    except Exception as e:
+                        logger.warning(f"Summarization failed, dropping turns instead: {e}")
+                self.cut = new_cut
+                messages = self._assemble(history)
+                tokens = self.counter.count_messages(messages)
+
+            # A summary longer than the reserve can still push the prompt over
+            # the budget: drop further turns, and the summary itself as a last resort
+            while tokens > self.max_prompt_tokens and self.cut + 2 < len(history):
+                self.cut += 2
+                messages = self._assemble(history)
+                tokens = self.counter.count_messages(messages)
+            if tokens > self.max_prompt_tokens and self.summary:
+                logger.warning("Summary does not fit the prompt budget, dropping it")
+                self.summary = None
+                summarized = False
+                messages = self._assemble(history)
+                tokens = self.counter.count_messages(messages)
+
+        kept_messages = min(pinned, len(history)) + max(0, len(history) - self.cut)
+        total_turns = (len(history) + 1) // 2
+        kept_turns = (kept_messages + 1) // 2
+        self.last_stats = ContextStats(
+            prompt_tokens=tokens,
+            budget=self.max_prompt_tokens,
+            total_turns=total_turns,
+            kept_turns=kept_turns,
+            dropped_turns=total_turns - kept_turns,
+            summarized=summarized,
+            method=self.counter.method,
+        )
+        return messages
+
+
+def image_chat_turn(history: List[Dict[str, Any]], prompt: str,
+                    encode_images: Callable[[], List[str]]) -> Dict[str, Any]:
+    """
+    Next user message for a conversation about fixed images. The images are
+    encoded (via `encode_images`, returning data URLs) into the first turn
+    only; later turns are text-only and the first turn is resent unchanged, so
+    the image tokens stay in the cached prefix.
+    """
+    if history:
+        content: Any = prompt
+    else:
+        content = [{"type": "image_url", "image_url": {"url": url}} for url in encode_images()]
+        content.append({"type": "text", "text": prompt})
+    return {"role": "user", "content": content, "display": prompt}
+
+
+def summarize_with(call: Callable[[List[Dict[str, Any]]], str]) -> Callable[[List[Dict[str, Any]]], str]:
+    """
+    Wrap a chat-completion call into a summarizer for ChatContext. `call` must
+    raise on failure; its return value is stored as the summary verbatim.
+    """
+
+    def summarizer(messages: List[Dict[str, Any]]) -> str:
+        transcript = []
+        for m in messages:
+            content = m["content"]
+            if not isinstance(content, str):
+                content = " ".join(p["text"] for p in content if p.get("type") == "text")
+            transcript.append(f"{m['role']}: {content}")
+        return call([{
+            "role": "user",
+            "content": "Summarize the key facts, decisions and open questions of this "
+                       "conversation in a few sentences:\n\n" + "\n".join(transcript),
+        }])
+
+    return summarizer
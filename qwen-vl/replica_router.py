@@ -0,0 +1,228 @@
+"""
+Client-side load balancing across several vLLM replicas.
+
+Each replica's `/health` and Prometheus `/metrics` endpoints are polled in the
+background; requests go to the healthy replica with the lowest load score and
+fail over to the next one on connection errors, connect timeouts and 5xx
+responses.
+
+    router = ReplicaRouter(["http://qwen-vl-0:8000", "http://qwen-vl-1:8000"])
+    router.start()
+    response = router.post("/v1/chat/completions", json=payload, timeout=60)
+"""
+
+import logging
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# Gauges exported by vLLM; the KV cache gauge was renamed in vLLM v1
+METRIC_WAITING = "vllm:num_requests_waiting"
+METRIC_RUNNING = "vllm:num_requests_running"
+METRICS_KV_CACHE = ("vllm:kv_cache_usage_perc", "vllm:gpu_cache_usage_perc")
+
+_METRIC_LINE = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{[^}]*\})?\s+(\S+)")
+
+
+class NoHealthyReplicaError(requests.exceptions.ConnectionError):
+    """Every replica failed (or none is configured)"""
+
+
+def parse_prometheus_metrics(text: str) -> Dict[str, float]:
+    """Sum each metric over its label sets"""
+    values: Dict[str, float] = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        match = _METRIC_LINE.match(line)
+        if not match:
+            continue
+        try:
+            value = float(match.group(3))
+        except ValueError:
+            continue
+        values[match.group(1)] = values.get(match.group(1), 0.0) + value
+    return values
+
+
+@dataclass
+class ReplicaState:
+    url: str
+    healthy: bool = True
+    waiting: float = 0.0
+    running: float = 0.0
+    kv_cache_usage: float = 0.0
+    inflight: int = 0
+    consecutive_failures: int = 0
+    last_poll: float = 0.0
+    last_error: str = ""
+
+    def load_score(self, kv_weight: float = 4.0) -> float:
+        """
+        Lower is better. Our own in-flight requests count as queued because the
+        server metrics only see them after the next poll.
+        """
+        return 2.0 * (self.waiting + self.inflight) + self.running + kv_weight * self.kv_cache_usage
+
+
+class ReplicaRouter:
+    """Routes requests to the least-loaded healthy replica"""
+
+    def __init__(self, endpoints: Iterable[str], poll_interval: float = 2.0,
+                 poll_timeout: float = 1.0, max_attempts: Optional[int] = None,
+                 kv_weight: float = 4.0):
+        self.replicas: List[ReplicaState] = []
+        self.poll_interval = poll_interval
+        self.poll_timeout = poll_timeout
+        self._max_attempts = max_attempts
+        self.kv_weight = kv_weight
+        self.session = requests.Session()
+        self._poll_session = requests.Session()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.set_endpoints(endpoints)
+
+    @property
+    def max_attempts(self) -> int:
+        return self._max_attempts or len(self.replicas)
+
+    def set_endpoints(self, endpoints: Iterable[str]) -> None:
+        """Replace the replica list; replicas that stay keep their state"""
+        urls = list(dict.fromkeys(e.strip().rstrip("/") for e in endpoints if e.strip()))
+        with self._lock:
+            current = {r.url: r for r in self.replicas}
+            self.replicas = [current.get(url) or ReplicaState(url=url) for url in urls]
+
+    # -- polling -----------------------------------------------------------
+
+    def poll_replica(self, replica: ReplicaState) -> None:
+        try:
+            health = self._poll_session.get(f"{replica.url}/health", timeout=self.poll_timeout)
+            healthy = health.status_code == 200
+            metrics = {}
+            if healthy:
+                response = self._poll_session.get(f"{replica.url}/metrics", timeout=self.poll_timeout)
+                if response.status_code == 200:
+                    metrics = parse_prometheus_metrics(response.text)
+        except requests.exceptions.RequestException as e:
+            healthy, metrics = False, {}
+            replica.last_error = str(e)
+
+        with self._lock:
+            replica.healthy = healthy
+            replica.last_poll = time.time()
+            if healthy:
+                replica.consecutive_failures = 0
+                replica.last_error = ""
+                replica.waiting = metrics.get(METRIC_WAITING, 0.0)
+                replica.running = metrics.get(METRIC_RUNNING, 0.0)
+                replica.kv_cache_usage = next(
+                    (metrics[m] for m in METRICS_KV_CACHE if m in metrics), 0.0
+                )
+
+    def poll_once(self) -> None:
+        with self._lock:
+            replicas = list(self.replicas)
+        for replica in replicas:
+            self.poll_replica(replica)
+
+    def _poll_loop(self) -> None:
+        while not self._stop.is_set():
+            self.poll_once()
+            self._stop.wait(self.poll_interval)
+
+    def start(self) -> "ReplicaRouter":
+        """Start background polling (idempotent)"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._poll_loop, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.poll_timeout * 2 + self.poll_interval)
+
+    # -- routing -----------------------------------------------------------
+
+    def choose(self, exclude: Iterable[str] = ()) -> ReplicaState:
+        """Pick the least-loaded healthy replica not in `exclude`"""
+        exclude = set(exclude)
+        with self._lock:
+            candidates = [r for r in self.replicas if r.url not in exclude]
+            if not candidates:
+                raise NoHealthyReplicaError("No replicas left to try")
+            healthy = [r for r in candidates if r.healthy]
+            # With nothing healthy, still try the others rather than fail outright
+            pool = healthy or candidates
+            best = min(r.load_score(self.kv_weight) for r in pool)
+            return random.choice([r for r in pool if r.load_score(self.kv_weight) == best])
+
+    def _mark_failure(self, replica: ReplicaState, error: str) -> None:
+        with self._lock:
+            replica.healthy = False
+            replica.consecutive_failures += 1
+            replica.last_error = error
+        logger.warning(f"Replica {replica.url} failed: {error}")
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        """
+        POST to the best replica, failing over on connection errors (including
+        connect timeouts) and 5xx. Read timeouts are raised instead: the
+        replica may still be generating, and re-running the request elsewhere
+        would double the load on an already overloaded fleet.
+        """
+        tried: List[str] = []
+        last_error = "no replicas configured"
+        for _ in range(self.max_attempts):
+            try:
+                replica = self.choose(exclude=tried)
+            except NoHealthyReplicaError:
+                break
+            tried.append(replica.url)
+
+            with self._lock:
+                replica.inflight += 1
+            try:
+                response = self.session.post(f"{replica.url}{path}", **kwargs)
+            except requests.exceptions.ConnectionError as e:  # includes ConnectTimeout
+                last_error = str(e)
+                self._mark_failure(replica, last_error)
+                continue
+            finally:
+                with self._lock:
+                    replica.inflight -= 1
+
+            if response.status_code >= 500:
+                last_error = f"HTTP {response.status_code}"
+                self._mark_failure(replica, last_error)
+                continue
+            return response
+
+        raise NoHealthyReplicaError(f"All replicas failed ({', '.join(tried)}): {last_error}")
+
+    def snapshot(self) -> List[Dict]:
+        """Current replica states, for display"""
+        with self._lock:
+            return [
+                {
+                    "url": r.url,
+                    "healthy": r.healthy,
+                    "waiting": r.waiting,
+                    "running": r.running,
+                    "kv_cache_usage": r.kv_cache_usage,
+                    "inflight": r.inflight,
+                    "score": r.load_score(self.kv_weight),
+                    "last_error": r.last_error,
+                }
+                for r in self.replicas
+            ]
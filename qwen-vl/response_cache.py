@@ -0,0 +1,247 @@
+"""
+Response cache for Qwen2.5-VL requests.
+
+Keys combine a perceptual hash (dHash) of every image in the conversation, the
+normalized text of each message and the sampling parameters, so resized or
+re-encoded copies of the same photo still hit. Lookups first try the exact key
+and then fall back to entries with the same text and parameters whose image
+hashes are within `max_distance` bits.
+
+Two tiers: an in-memory LRU with TTL, and an optional SQLite file on disk.
+Only deterministic requests (temperature 0) are cached unless the caller
+opts in explicitly.
+"""
+
+import base64
+import hashlib
+import io
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+HASH_SIZE = 8  # 8x8 = 64-bit dHash
+
+
+def dhash(image_bytes: bytes, hash_size: int = HASH_SIZE) -> int:
+    """Difference hash: robust to resizing, re-encoding and small colour shifts"""
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(image_bytes)).convert("L")
+    image = image.resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+    pixels = image.tobytes()
+    bits = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return bits
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().casefold()
+
+
+@dataclass
+class CacheKey:
+    exact: str
+    text_key: str
+    image_hashes: Tuple[int, ...]
+
+
+@dataclass
+class CacheEntry:
+    value: Dict[str, Any]
+    text_key: str
+    image_hashes: Tuple[int, ...]
+    created: float
+
+
+class ResponseCache:
+    """Two-tier (memory LRU + optional SQLite) cache of chat completions"""
+
+    def __init__(self, max_entries: int = 512, ttl: float = 24 * 3600,
+                 disk_path: Optional[str] = None, max_distance: int = 4):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self._memory: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._image_hashes: "OrderedDict[str, int]" = OrderedDict()
+        self.stats = {"hits": 0, "near_hits": 0, "disk_hits": 0, "misses": 0,
+                      "bypassed": 0, "evictions": 0, "stores": 0}
+
+        self._db = None
+        if disk_path:
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, text_key TEXT, image_hashes TEXT, "
+                "value TEXT, created REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS idx_text_key ON responses (text_key)")
+            self._db.commit()
+
+    # -- keys --------------------------------------------------------------
+
+    def _image_hash(self, url: str) -> int:
+        digest = hashlib.sha1(url.encode()).hexdigest()
+        with self._lock:
+            if digest in self._image_hashes:
+                self._image_hashes.move_to_end(digest)
+                return self._image_hashes[digest]
+        if url.startswith("data:"):
+            value = dhash(base64.b64decode(url.split(",", 1)[1]))
+        else:
+            # Remote URLs are not fetched; hash the URL itself
+            value = int(digest[:16], 16)
+        with self._lock:
+            self._image_hashes[digest] = value
+            if len(self._image_hashes) > self.max_entries * 4:
+                self._image_hashes.popitem(last=False)
+        return value
+
+    def make_key(self, messages: List[Dict[str, Any]], params: Dict[str, Any]) -> CacheKey:
+        """Replace image parts by their perceptual hashes and normalize the text"""
+        image_hashes = []
+        normalized = []
+        for message in messages:
+            content = message["content"]
+            if isinstance(content, str):
+                normalized.append([message["role"], normalize_text(content)])
+                continue
+            parts = []
+            for part in content:
+                if part.get("type") == "text":
+                    parts.append(normalize_text(part["text"]))
+                elif part.get("type") == "image_url":
+                    image_hashes.append(self._image_hash(part["image_url"]["url"]))
+                    parts.append("<image>")
+                else:
+                    # Video and other parts are matched exactly
+                    blob = json.dumps(part, sort_keys=True).encode()
+                    parts.append(hashlib.sha1(blob).hexdigest())
+            normalized.append([message["role"], parts])
+
+        text_key = hashlib.sha256(
+            json.dumps([normalized, params], sort_keys=True).encode()
+        ).hexdigest()
+        exact = hashlib.sha256(
+            (text_key + ":" + ",".join(f"{h:016x}" for h in image_hashes)).encode()
+        ).hexdigest()
+        return CacheKey(exact=exact, text_key=text_key, image_hashes=tuple(image_hashes))
+
+    def _near(self, key: CacheKey, hashes: Tuple[int, ...]) -> bool:
+        return len(hashes) == len(key.image_hashes) and all(
+            hamming(a, b) <= self.max_distance for a, b in zip(hashes, key.image_hashes)
+        )
+
+    # -- lookup / store ----------------------------------------------------
+
+    def get(self, key: CacheKey) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key.exact)
+            if entry is not None and now - entry.created > self.ttl:
+                del self._memory[key.exact]
+                entry = None
+            if entry is not None:
+                self._memory.move_to_end(key.exact)
+                self.stats["hits"] += 1
+                return entry.value
+
+            if key.image_hashes and self.max_distance > 0:
+                for exact, candidate in reversed(self._memory.items()):
+                    if (candidate.text_key == key.text_key
+                            and now - candidate.created <= self.ttl
+                            and self._near(key, candidate.image_hashes)):
+                        self._memory.move_to_end(exact)
+                        self.stats["hits"] += 1
+                        self.stats["near_hits"] += 1
+                        return candidate.value
+
+        value = self._disk_get(key, now)
+        with self._lock:
+            if value is None:
+                self.stats["misses"] += 1
+            else:
+                self.stats["hits"] += 1
+                self.stats["disk_hits"] += 1
+        if value is not None:
+            self._memory_put(key, value, now)
+        return value
+
+    def _disk_get(self, key: CacheKey, now: float) -> Optional[Dict[str, Any]]:
+        if self._db is None:
+            return None
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT key, image_hashes, value FROM responses WHERE text_key = ? AND created >= ?",
+                (key.text_key, now - self.ttl),
+            ).fetchall()
+        for exact, hashes, value in rows:
+            if exact == key.exact:
+                return json.loads(value)
+        for exact, hashes, value in rows:
+            candidate = tuple(int(h, 16) for h in hashes.split(",") if h)
+            if key.image_hashes and self._near(key, candidate):
+                return json.loads(value)
+        return None
+
+    def _memory_put(self, key: CacheKey, value: Dict[str, Any], created: float) -> None:
+        with self._lock:
+            self._memory[key.exact] = CacheEntry(value, key.text_key, key.image_hashes, created)
+            self._memory.move_to_end(key.exact)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def put(self, key: CacheKey, value: Dict[str, Any]) -> None:
+        now = time.time()
+        self._memory_put(key, value, now)
+        with self._lock:
+            self.stats["stores"] += 1
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                    (key.exact, key.text_key, ",".join(f"{h:016x}" for h in key.image_hashes),
+                     json.dumps(value), now),
+                )
+                self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+                self._db.commit()
+
+    def record_bypass(self) -> None:
+        with self._lock:
+            self.stats["bypassed"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "entries": len(self._memory),
+                "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+            }
+
+
+def is_cacheable(params: Dict[str, Any], opt_in: bool = False) -> bool:
+    """Greedy decoding is deterministic; sampled responses only when opted in"""
+    return opt_in or params.get("temperature", 1.0) == 0
@@ -6,7 +6,18 @@ from PIL import Image
 import io
 import tempfile
 import os
-from typing import List, Dict, Any
+import time
+import uuid
+import logging
+from typing import List, Dict, Any, Sequence, Union
+
+from chat_context import ChatContext, TokenCounter, image_chat_turn, summarize_with
+from replica_router import ReplicaRouter
+from response_cache import ResponseCache, is_cacheable
+from video_frames import VideoSample, sample_video
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 # Configure Streamlit page
 st.set_page_config(
@@ -92,59 +103,197 @@ st.markdown("Test your deployed Qwen2.5-VL model with images, videos, and text c
 st.sidebar.header("⚙️ Configuration")
 
 # Model endpoint configuration
-model_endpoint = st.sidebar.text_input(
-    "Model Endpoint", 
+model_endpoint_input = st.sidebar.text_area(
+    "Model Endpoints", 
     value="http://localhost:8000",
-    help="URL of your vLLM server"
+    height=68,
+    help="URL of your vLLM server; list several replicas (one per line) to load balance across them"
 )
+model_endpoints = [
+    e.strip() for e in model_endpoint_input.replace(",", "\n").splitlines() if e.strip()
+]
 
 # Model parameters
 max_tokens = st.sidebar.slider("Max Tokens", 50, 2048, 512)
 temperature = st.sidebar.slider("Temperature", 0.0, 2.0, 0.7, 0.1)
 top_p = st.sidebar.slider("Top P", 0.0, 1.0, 0.8, 0.1)
 
+# Response cache (always used at temperature 0)
+cache_opt_in = st.sidebar.checkbox(
+    "Cache sampled responses", value=False,
+    help="Responses at temperature 0 are always cached; enable to also reuse responses for temperature > 0"
+)
+
+# Context management for multi-turn chat
+context_budget = st.sidebar.slider(
+    "Context Budget (tokens)", 1024, 32768, 8192, 1024,
+    help="Maximum prompt tokens sent per chat turn; older turns are dropped beyond this"
+)
+summarize_dropped = st.sidebar.checkbox(
+    "Summarize dropped turns", value=False,
+    help="Replace dropped turns with a model-generated summary (one extra request when the budget is hit)"
+)
+
 # Helper functions
+@st.cache_data(max_entries=64, show_spinner=False)
+def encode_image_bytes(image_bytes: bytes) -> str:
+    """Encode raw image file bytes as a JPEG data URL (cached per file content)"""
+    image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+    buffered = io.BytesIO()
+    image.save(buffered, format="JPEG")
+    img_str = base64.b64encode(buffered.getvalue()).decode()
+    return f"data:image/jpeg;base64,{img_str}"
+
 def encode_image_to_base64(image_file) -> str:
     """Convert uploaded image to base64 string"""
     if image_file is not None:
-        image = Image.open(image_file)
-        buffered = io.BytesIO()
-        image.save(buffered, format="JPEG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
-        return f"data:image/jpeg;base64,{img_str}"
+        return encode_image_bytes(image_file.getvalue())
     return None
 
-def call_vllm_api(messages: List[Dict], model_endpoint: str, **kwargs) -> str:
-    """Call the vLLM OpenAI-compatible API"""
+@st.cache_resource
+def get_token_counter() -> TokenCounter:
+    """Shared token counter (loads the local tokenizer once if configured)"""
+    return TokenCounter()
+
+def get_chat_context(key: str) -> ChatContext:
+    """Per-session context manager for a chat history, updated with sidebar settings"""
+    if key not in st.session_state:
+        st.session_state[key] = ChatContext(counter=get_token_counter())
+    context = st.session_state[key]
+    context.max_prompt_tokens = context_budget
+    if summarize_dropped:
+        context.summarizer = summarize_with(
+            # Raise on failure so an error message is never stored as the summary
+            lambda messages: call_vllm_api(
+                messages, model_endpoints, raise_errors=True,
+                max_tokens=256, temperature=0.0, top_p=1.0
+            )
+        )
+    else:
+        context.summarizer = None
+    return context
+
+def format_context_stats(stats, usage: Dict) -> str:
+    """One-line caption describing the prompt sent for a turn"""
+    tokens = usage.get("prompt_tokens")
+    text = f"Prompt: {tokens} tokens" if tokens else f"Prompt: ~{stats.prompt_tokens} tokens"
+    if usage.get("cached"):
+        text = "Cached response · " + text
+    text += f" (budget {stats.budget}) · {stats.kept_turns}/{stats.total_turns} turns in context"
+    if stats.dropped_turns:
+        text += f" · {stats.dropped_turns} dropped"
+    if stats.summarized:
+        text += " · summarized"
+    return text
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def preprocess_video(video_bytes: bytes, fps: float, max_frames: int, max_pixels: int) -> VideoSample:
+    """Sample and resize video frames locally (cached per file and settings)"""
+    return sample_video(io.BytesIO(video_bytes), fps=fps, max_frames=max_frames, max_pixels=max_pixels)
+
+@st.cache_resource
+def _replica_router(endpoints: tuple) -> ReplicaRouter:
+    return ReplicaRouter(endpoints).start()
+
+def get_replica_router(endpoints: tuple) -> ReplicaRouter:
+    """Router polling replica health and load in the background.
+
+    One router (and one polling thread) per distinct endpoint list, shared by
+    the sessions using that list; a session editing its sidebar gets another
+    router instead of changing the replicas under everyone else's requests.
+    """
+    return _replica_router(tuple(dict.fromkeys(e.strip().rstrip("/") for e in endpoints if e.strip())))
+
+@st.cache_resource
+def get_response_cache() -> ResponseCache:
+    """Process-wide response cache; set VLM_CACHE_PATH to add a SQLite disk tier"""
+    return ResponseCache(disk_path=os.getenv("VLM_CACHE_PATH"))
+
+def call_vllm_api(messages: List[Dict], model_endpoint: Union[str, Sequence[str]],
+                  return_usage: bool = False, raise_errors: bool = False, **kwargs):
+    """Call the vLLM OpenAI-compatible API
+
+    `model_endpoint` is one URL or a list of replica URLs; requests go to the
+    least-loaded healthy replica and fail over to the others on errors.
+    Returns the response text, or (text, usage) when return_usage is set.
+    Errors are returned as text for display unless raise_errors is set.
+    """
+    usage = {}
+    request_id = uuid.uuid4().hex
+    start_time = time.time()
+    replica = None
     try:
-        url = f"{model_endpoint}/v1/chat/completions"
+        endpoints = [model_endpoint] if isinstance(model_endpoint, str) else list(model_endpoint)
+        router = get_replica_router(tuple(endpoints))
         
-        payload = {
-            "model": "Qwen/Qwen2.5-VL-7B-Instruct",
-            "messages": messages,
+        sampling = {
             "max_tokens": kwargs.get("max_tokens", 512),
             "temperature": kwargs.get("temperature", 0.7),
             "top_p": kwargs.get("top_p", 0.8),
-            "stream": False
         }
         
-        headers = {
-            "Content-Type": "application/json"
-        }
-        
-        response = requests.post(url, json=payload, headers=headers, timeout=60)
-        response.raise_for_status()
+        cache = get_response_cache()
+        cache_key = None
+        cached = None
+        if is_cacheable(sampling, opt_in=kwargs.get("cache_opt_in", cache_opt_in)):
+            cache_key = cache.make_key(messages, sampling)
+            cached = cache.get(cache_key)
+        else:
+            cache.record_bypass()
         
-        result = response.json()
-        return result["choices"][0]["message"]["content"]
+        if cached is not None:
+            content = cached["content"]
+            usage = dict(cached.get("usage") or {}, cached=True)
+        else:
+            payload = {
+                "model": "Qwen/Qwen2.5-VL-7B-Instruct",
+                "messages": messages,
+                **sampling,
+                "stream": False
+            }
+            
+            # vLLM adopts X-Request-ID as its request id, so server logs can be
+            # matched with the client log line below
+            headers = {
+                "Content-Type": "application/json",
+                "X-Request-ID": request_id
+            }
+            
+            response = router.post("/v1/chat/completions", json=payload, headers=headers, timeout=60)
+            replica = response.url
+            response.raise_for_status()
+            
+            result = response.json()
+            content = result["choices"][0]["message"]["content"]
+            usage = result.get("usage") or {}
+            if cache_key is not None:
+                cache.put(cache_key, {"content": content, "usage": usage})
         
     except requests.exceptions.RequestException as e:
-        return f"Error calling API: {str(e)}"
+        if raise_errors:
+            raise
+        content = f"Error calling API: {str(e)}"
     except Exception as e:
-        return f"Unexpected error: {str(e)}"
+        if raise_errors:
+            raise
+        content = f"Unexpected error: {str(e)}"
+    
+    logger.info(json.dumps({
+        "event": "vllm_request",
+        "request_id": request_id,
+        "replica": replica,
+        "cached": bool(usage.get("cached")),
+        "duration_ms": round((time.time() - start_time) * 1000, 3),
+        "prompt_tokens": usage.get("prompt_tokens"),
+        "completion_tokens": usage.get("completion_tokens"),
+    }))
+    usage = dict(usage, request_id=request_id)
+    return (content, usage) if return_usage else content
 
 # Main interface tabs
-tab1, tab2, tab3 = st.tabs(["📷 Single Image", "🖼️ Multiple Images", "💬 Text Chat"])
+tab1, tab2, tab3, tab4, tab5 = st.tabs(
+    ["📷 Single Image", "🖼️ Multiple Images", "🎬 Video", "🗨️ Image Chat", "💬 Text Chat"]
+)
 
 # Tab 1: Single Image Analysis
 with tab1:
@@ -198,7 +347,7 @@ with tab1:
                     
                     response = call_vllm_api(
                         messages, 
-                        model_endpoint,
+                        model_endpoints,
                         max_tokens=max_tokens,
                         temperature=temperature,
                         top_p=top_p
@@ -291,7 +440,7 @@ with tab2:
                     
                     response = call_vllm_api(
                         messages, 
-                        model_endpoint,
+                        model_endpoints,
                         max_tokens=max_tokens,
                         temperature=temperature,
                         top_p=top_p
@@ -322,18 +471,212 @@ with tab2:
         else:
             st.info("🔍 Upload images and click 'Analyze Images' to see the AI response here.")
 
-# Tab 3: Text Chat
+# Tab 3: Video Analysis
 with tab3:
+    st.header("Video Analysis")
+    
+    col1, col2 = st.columns([1, 1])
+    
+    with col1:
+        st.subheader("Upload Video")
+        uploaded_video = st.file_uploader(
+            "Choose a video...",
+            type=['mp4', 'mov', 'avi', 'webm', 'mkv'],
+            key="video_file"
+        )
+        
+        if uploaded_video:
+            st.video(uploaded_video)
+        
+        st.subheader("Frame Sampling")
+        sample_cols = st.columns(3)
+        with sample_cols[0]:
+            video_fps = st.number_input("Frames per second", 0.1, 4.0, 1.0, 0.1)
+        with sample_cols[1]:
+            video_max_frames = st.number_input("Max frames", 2, 64, 16, 1)
+        with sample_cols[2]:
+            pixel_budgets = {"224×224": 224 * 224, "448×448": 448 * 448, "672×672": 672 * 672}
+            video_pixels = pixel_budgets[st.selectbox("Pixels per frame", list(pixel_budgets), index=1)]
+        
+        st.subheader("Your Question")
+        video_question = st.text_area(
+            "What would you like to know about this video?",
+            value="Describe what happens in this video.",
+            height=100,
+            key="video_question"
+        )
+        
+        if st.button("🚀 Analyze Video", key="analyze_video"):
+            if uploaded_video and video_question:
+                try:
+                    with st.spinner("Sampling frames..."):
+                        video_sample = preprocess_video(
+                            uploaded_video.getvalue(), video_fps, int(video_max_frames), video_pixels
+                        )
+                except Exception as e:
+                    st.error(f"❌ Cannot process video: {str(e)}")
+                    video_sample = None
+                
+                if video_sample is not None and video_sample.frames_jpeg:
+                    st.session_state.video_sample = video_sample
+                    with st.spinner("Analyzing video..."):
+                        messages = [
+                            {
+                                "role": "user",
+                                "content": [
+                                    video_sample.to_content_part(),
+                                    {
+                                        "type": "text",
+                                        "text": video_question
+                                    }
+                                ]
+                            }
+                        ]
+                        
+                        start_time = time.time()
+                        response = call_vllm_api(
+                            messages,
+                            model_endpoints,
+                            max_tokens=max_tokens,
+                            temperature=temperature,
+                            top_p=top_p
+                        )
+                        st.session_state.video_request_time = time.time() - start_time
+                        st.session_state.video_response = response
+                elif video_sample is not None:
+                    st.warning("No frames could be decoded from this video.")
+            else:
+                st.warning("Please upload a video and enter a question.")
+    
+    with col2:
+        st.subheader("Model Response")
+        if hasattr(st.session_state, 'video_response'):
+            video_sample = st.session_state.video_sample
+            metric_cols = st.columns(4)
+            metric_cols[0].metric("Frames", len(video_sample.frames_jpeg))
+            metric_cols[1].metric("Payload", f"{video_sample.payload_bytes / 1024:.0f} KB")
+            metric_cols[2].metric("Preprocessing", f"{video_sample.preprocess_time:.2f}s")
+            metric_cols[3].metric("Request", f"{st.session_state.video_request_time:.1f}s")
+            st.caption(
+                f"{video_sample.width}×{video_sample.height} frames sampled at "
+                f"{video_sample.sample_fps:.2f} fps from {video_sample.decoded_frames} decoded frames"
+            )
+            st.image(
+                video_sample.frames_jpeg[:8],
+                width=96
+            )
+            st.text_area(
+                label="AI Response",
+                value=st.session_state.video_response,
+                height=300,
+                disabled=False,
+                label_visibility="collapsed",
+                key="video_response_display"
+            )
+        else:
+            st.info("🔍 Upload a video and click 'Analyze Video' to see the AI response here.")
+
+# Tab 4: Multi-turn Image Chat
+with tab4:
+    st.header("Image Chat")
+    st.markdown(
+        "Ask follow-up questions about the same images. The encoded images are "
+        "kept in the conversation unchanged, so vLLM can reuse their prefix cache."
+    )
+    
+    if "image_chat_messages" not in st.session_state:
+        st.session_state.image_chat_messages = []
+        st.session_state.image_chat_key = None
+    
+    chat_images = st.file_uploader(
+        "Choose up to 2 images...",
+        type=['png', 'jpg', 'jpeg'],
+        accept_multiple_files=True,
+        key="image_chat_images"
+    )
+    chat_images = (chat_images or [])[:2]
+    
+    # A different image set starts a new conversation
+    image_key = tuple(f.file_id for f in chat_images)
+    if image_key != st.session_state.image_chat_key:
+        st.session_state.image_chat_key = image_key
+        st.session_state.image_chat_messages = []
+        get_chat_context("image_chat_context").reset()
+    
+    image_chat_context = get_chat_context("image_chat_context")
+    
+    if chat_images:
+        cols = st.columns(len(chat_images))
+        for idx, img_file in enumerate(chat_images):
+            with cols[idx]:
+                st.image(Image.open(img_file), caption=f"Image {idx+1}", width="stretch")
+    
+    for message in st.session_state.image_chat_messages:
+        with st.chat_message(message["role"]):
+            st.markdown(message["display"])
+            if message.get("context_info"):
+                st.caption(message["context_info"])
+    
+    if image_prompt := st.chat_input("Ask about the images...", disabled=not chat_images):
+        st.session_state.image_chat_messages.append(image_chat_turn(
+            st.session_state.image_chat_messages,
+            image_prompt,
+            lambda: [encode_image_to_base64(f) for f in chat_images],
+        ))
+        
+        with st.chat_message("user"):
+            st.markdown(image_prompt)
+        
+        with st.chat_message("assistant"):
+            with st.spinner("Thinking..."):
+                api_messages = image_chat_context.build(st.session_state.image_chat_messages)
+                
+                start_time = time.time()
+                response, usage = call_vllm_api(
+                    api_messages,
+                    model_endpoints,
+                    return_usage=True,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    top_p=top_p
+                )
+                elapsed_time = time.time() - start_time
+                context_info = (
+                    f"{format_context_stats(image_chat_context.last_stats, usage)}"
+                    f" · {elapsed_time:.1f}s"
+                )
+                
+                st.markdown(response)
+                st.caption(context_info)
+                
+                st.session_state.image_chat_messages.append({
+                    "role": "assistant",
+                    "content": response,
+                    "display": response,
+                    "context_info": context_info
+                })
+    
+    if st.button("🗑️ Clear Conversation", key="clear_image_chat"):
+        st.session_state.image_chat_messages = []
+        image_chat_context.reset()
+        st.rerun()
+
+# Tab 5: Text Chat
+with tab5:
     st.header("Text-Only Chat")
     
     # Initialize chat history
     if "chat_messages" not in st.session_state:
         st.session_state.chat_messages = []
     
+    chat_context = get_chat_context("chat_context")
+    
     # Display chat messages
     for message in st.session_state.chat_messages:
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
+            if message.get("context_info"):
+                st.caption(message["context_info"])
     
     # Chat input
     if prompt := st.chat_input("Type your message here..."):
@@ -347,28 +690,31 @@ with tab3:
         # Generate assistant response
         with st.chat_message("assistant"):
             with st.spinner("Thinking..."):
-                # Prepare messages for API call
-                api_messages = [
-                    {"role": msg["role"], "content": msg["content"]} 
-                    for msg in st.session_state.chat_messages
-                ]
+                # Prepare messages for API call, bounded by the context budget
+                api_messages = chat_context.build(st.session_state.chat_messages)
                 
-                response = call_vllm_api(
+                response, usage = call_vllm_api(
                     api_messages,
-                    model_endpoint,
+                    model_endpoints,
+                    return_usage=True,
                     max_tokens=max_tokens,
                     temperature=temperature,
                     top_p=top_p
                 )
+                context_info = format_context_stats(chat_context.last_stats, usage)
                 
                 st.markdown(response)
+                st.caption(context_info)
                 
                 # Add assistant response to chat history
-                st.session_state.chat_messages.append({"role": "assistant", "content": response})
+                st.session_state.chat_messages.append(
+                    {"role": "assistant", "content": response, "context_info": context_info}
+                )
     
     # Clear chat button
     if st.button("🗑️ Clear Chat"):
         st.session_state.chat_messages = []
+        chat_context.reset()
         st.rerun()
 
 # Footer with model information
@@ -382,15 +728,32 @@ st.sidebar.markdown("""
 - Agent capabilities
 """)
 
+# Response cache stats
+cache_stats = get_response_cache().summary()
+st.sidebar.markdown("---")
+st.sidebar.markdown("### 🗄️ Response Cache")
+st.sidebar.caption(
+    f"{cache_stats['entries']} entries · hit rate {cache_stats['hit_rate']:.0%} "
+    f"({cache_stats['hits']} hits, {cache_stats['near_hits']} near-duplicate, "
+    f"{cache_stats['misses']} misses)"
+)
+if st.sidebar.button("🧹 Clear Cache"):
+    get_response_cache().clear()
+    st.rerun()
+
 # Health check
 st.sidebar.markdown("---")
 if st.sidebar.button("🔍 Check Model Health"):
-    try:
-        health_url = f"{model_endpoint}/health"
-        response = requests.get(health_url, timeout=5)
-        if response.status_code == 200:
-            st.sidebar.success("✅ Model is healthy!")
-        else:
-            st.sidebar.error(f"❌ Health check failed: {response.status_code}")
-    except Exception as e:
-        st.sidebar.error(f"❌ Cannot reach model: {str(e)}")
\ No newline at end of file
+    if not model_endpoints:
+        st.sidebar.error("❌ No model endpoint configured")
+    else:
+        router = get_replica_router(tuple(model_endpoints))
+        router.poll_once()
+        for replica in router.snapshot():
+            if replica["healthy"]:
+                st.sidebar.success(
+                    f"✅ {replica['url']}: waiting {replica['waiting']:.0f}, "
+                    f"running {replica['running']:.0f}, KV cache {replica['kv_cache_usage']:.0%}"
+                )
+            else:
+                st.sidebar.error(f"❌ {replica['url']}: {replica['last_error'] or 'unhealthy'}")
\ No newline at end of file
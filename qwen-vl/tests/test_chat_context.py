@@ -0,0 +1,117 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chat_context import ChatContext, TokenCounter, image_chat_turn  # noqa: E402
+
+
+def _chat(ctx, turns, text="x" * 200):
+    history, sent = [], []
+    for i in range(turns):
+        history.append({"role": "user", "content": f"question {i} {text}"})
+        sent.append(ctx.build(history))
+        history.append({"role": "assistant", "content": f"answer {i} {text}"})
+    return history, sent
+
+
+def test_stays_under_budget_and_keeps_first_turn():
+    ctx = ChatContext(TokenCounter(), max_prompt_tokens=400, system_prompt="Be brief.")
+    _, sent = _chat(ctx, 20)
+
+    for messages in sent:
+        assert ctx.counter.count_messages(messages) <= 400
+        assert messages[0] == {"role": "system", "content": "Be brief."}
+        assert messages[1]["content"].startswith("question 0")
+    assert sent[-1][-1]["content"].startswith("question 19")
+    assert ctx.last_stats.dropped_turns > 0
+
+
+def test_cut_moves_in_blocks():
+    ctx = ChatContext(TokenCounter(), max_prompt_tokens=1000, low_watermark=0.5)
+    _, sent = _chat(ctx, 30)
+
+    # Consecutive requests share their prefix unless a block was dropped
+    prefix_changes = sum(
+        1 for prev, cur in zip(sent, sent[1:]) if cur[:len(prev) - 1] != prev[:-1]
+    )
+    assert 0 < prefix_changes < len(sent) // 3
+
+
+def test_summarizer_replaces_dropped_turns():
+    calls = []
+
+    def summarizer(messages):
+        calls.append(messages)
+        return "earlier summary"
+
+    ctx = ChatContext(TokenCounter(), max_prompt_tokens=400, summarizer=summarizer)
+    _, sent = _chat(ctx, 10)
+
+    assert calls
+    assert any("earlier summary" in m["content"] for m in sent[-1] if isinstance(m["content"], str))
+
+
+@pytest.mark.parametrize("summary_words", [60, 150, 300])
+def test_summary_counts_towards_budget(summary_words):
+    ctx = ChatContext(TokenCounter(), max_prompt_tokens=400,
+                      summarizer=lambda m: "fact " * summary_words)
+    history = []
+    for i in range(12):
+        history.append({"role": "user", "content": f"question {i} " + "x" * 200})
+        ctx.build(history)
+        assert ctx.last_stats.prompt_tokens <= ctx.last_stats.budget
+        history.append({"role": "assistant", "content": f"answer {i} " + "x" * 200})
+    assert ctx.last_stats.dropped_turns > 0
+
+
+def test_failed_summarization_is_not_stored():
+    def summarizer(messages):
+        raise ConnectionError("replica down")
+
+    ctx = ChatContext(TokenCounter(), max_prompt_tokens=400, summarizer=summarizer)
+    _, sent = _chat(ctx, 10)
+
+    assert ctx.summary is None
+    assert not any("Summary" in str(m["content"]) for m in sent[-1])
+
+
+def test_image_parts_passed_through_unchanged():
+    image_part = {"type": "image_url", "image_url": {"url": "data:image/jpeg;base64,AAAA"}}
+    history = [
+        {"role": "user", "content": [image_part, {"type": "text", "text": "What is this?"}]},
+        {"role": "assistant", "content": "A cat.", "context_info": "ui only"},
+        {"role": "user", "content": "What colour?"},
+    ]
+    messages = ChatContext(TokenCounter()).build(history)
+
+    assert messages[0]["content"][0] is image_part
+    assert "context_info" not in messages[1]
+
+
+def test_image_chat_sends_images_once_and_unchanged():
+    urls = ["data:image/png;base64,AAAA", "data:image/png;base64,BBBB"]
+    encodes = []
+
+    def encode():
+        encodes.append(1)
+        return list(urls)
+
+    ctx = ChatContext(TokenCounter(), max_prompt_tokens=100000)
+    history, sent = [], []
+    for i in range(4):
+        history.append(image_chat_turn(history, f"question {i}", encode))
+        sent.append(ctx.build(history))
+        history.append({"role": "assistant", "content": f"answer {i}"})
+
+    assert len(encodes) == 1
+    for messages in sent:
+        image_urls = [p["image_url"]["url"] for m in messages if isinstance(m["content"], list)
+                      for p in m["content"] if p["type"] == "image_url"]
+        assert image_urls == urls
+        assert messages[0] == sent[0][0]
+        assert "display" not in messages[0]
+    assert all(isinstance(m["content"], str) for m in sent[-1][1:])
+
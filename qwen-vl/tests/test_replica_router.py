@@ -0,0 +1,165 @@
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from replica_router import (  # noqa: E402
+    NoHealthyReplicaError,
+    ReplicaRouter,
+    parse_prometheus_metrics,
+)
+
+
+class FakeReplica:
+    """Local HTTP server reporting synthetic vLLM load"""
+
+    def __init__(self, waiting=0, running=0, kv=0.0, healthy=True, status=200, delay=0.0):
+        self.waiting, self.running, self.kv = waiting, running, kv
+        self.healthy, self.status, self.delay = healthy, status, delay
+        self.requests = 0
+        replica = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status, body, content_type="application/json"):
+                data = body.encode()
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path == "/health":
+                    self._reply(200 if replica.healthy else 503, "{}")
+                elif self.path == "/metrics":
+                    self._reply(200, (
+                        "# TYPE vllm:num_requests_waiting gauge\n"
+                        f'vllm:num_requests_waiting{{model_name="m"}} {replica.waiting}\n'
+                        f'vllm:num_requests_running{{model_name="m"}} {replica.running}\n'
+                        f'vllm:kv_cache_usage_perc{{model_name="m"}} {replica.kv}\n'
+                    ), "text/plain")
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                replica.requests += 1
+                time.sleep(replica.delay)
+                self._reply(replica.status, json.dumps({"choices": [{"message": {"content": "ok"}}]}))
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def replicas():
+    created = []
+
+    def make(**kwargs):
+        created.append(FakeReplica(**kwargs))
+        return created[-1]
+
+    yield make
+    for replica in created:
+        replica.close()
+
+
+def test_parse_prometheus_metrics_sums_label_sets():
+    metrics = parse_prometheus_metrics(
+        "# HELP x\nvllm:num_requests_waiting{a=\"1\"} 2\nvllm:num_requests_waiting{a=\"2\"} 3.0\n"
+    )
+    assert metrics == {"vllm:num_requests_waiting": 5.0}
+
+
+def test_routes_to_least_loaded_replica(replicas):
+    busy = replicas(waiting=8, running=16, kv=0.9)
+    idle = replicas(waiting=0, running=2, kv=0.1)
+    router = ReplicaRouter([busy.url, idle.url])
+    router.poll_once()
+
+    for _ in range(5):
+        assert router.post("/v1/chat/completions", json={}).status_code == 200
+    assert idle.requests == 5
+    assert busy.requests == 0
+
+
+def test_skips_unhealthy_replica(replicas):
+    down = replicas(healthy=False)
+    up = replicas(waiting=50)
+    router = ReplicaRouter([down.url, up.url])
+    router.poll_once()
+
+    router.post("/v1/chat/completions", json={})
+    assert up.requests == 1
+    assert down.requests == 0
+
+
+def test_fails_over_on_server_error(replicas):
+    broken = replicas(status=500)
+    loaded = replicas(waiting=10)
+    router = ReplicaRouter([broken.url, loaded.url])
+    router.poll_once()
+
+    response = router.post("/v1/chat/completions", json={})
+    assert response.status_code == 200
+    assert broken.requests == 1 and loaded.requests == 1
+    assert not router.snapshot()[0]["healthy"]
+
+
+def test_fails_over_on_connection_error(replicas):
+    alive = replicas(waiting=10)
+    router = ReplicaRouter(["http://127.0.0.1:1", alive.url], poll_timeout=0.5)
+
+    # Unpolled replicas look idle, so the dead one is tried first
+    router.replicas[1].waiting = 10
+    response = router.post("/v1/chat/completions", json={}, timeout=2)
+    assert response.status_code == 200
+    assert alive.requests == 1
+
+
+def test_raises_when_all_replicas_fail(replicas):
+    router = ReplicaRouter([replicas(status=503).url, replicas(status=502).url])
+    with pytest.raises(NoHealthyReplicaError):
+        router.post("/v1/chat/completions", json={})
+
+
+def test_read_timeout_is_not_failed_over(replicas):
+    slow = replicas(delay=0.5)
+    spare = replicas(waiting=10)
+    router = ReplicaRouter([slow.url, spare.url])
+    router.poll_once()
+
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        router.post("/v1/chat/completions", json={}, timeout=0.2)
+    assert slow.requests == 1 and spare.requests == 0
+    assert router.snapshot()[0]["inflight"] == 0
+
+
+def test_set_endpoints_keeps_state_and_recovery_clears_error(replicas):
+    flaky = replicas(healthy=False)
+    router = ReplicaRouter(["http://127.0.0.1:1", flaky.url], poll_timeout=0.5)
+    router.poll_once()
+    assert router.snapshot()[0]["last_error"]
+
+    router.set_endpoints([flaky.url + "/", replicas().url])
+    assert [r["url"] for r in router.snapshot()][0] == flaky.url
+    assert router.max_attempts == 2
+
+    flaky.healthy = True
+    router.replicas[0].last_error = "HTTP 503"
+    router.poll_once()
+    assert router.snapshot()[0]["healthy"] and router.snapshot()[0]["last_error"] == ""
+
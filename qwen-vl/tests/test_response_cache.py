@@ -0,0 +1,80 @@
+import base64
+import io
+import os
+import sys
+import time
+
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from response_cache import ResponseCache, is_cacheable  # noqa: E402
+
+PARAMS = {"max_tokens": 512, "temperature": 0.0, "top_p": 0.8}
+
+
+def _photo(size=(640, 480), fmt="JPEG", quality=90, shift=0):
+    image = Image.new("RGB", (640, 480), (30, 60, 90))
+    draw = ImageDraw.Draw(image)
+    draw.ellipse((100 + shift, 80, 400 + shift, 380), fill=(240, 200, 40))
+    draw.rectangle((420, 50, 600, 300), fill=(200, 30, 30))
+    image = image.resize(size)
+    buffered = io.BytesIO()
+    image.save(buffered, format=fmt, **({"quality": quality} if fmt == "JPEG" else {}))
+    mime = "jpeg" if fmt == "JPEG" else "png"
+    return f"data:image/{mime};base64,{base64.b64encode(buffered.getvalue()).decode()}"
+
+
+def _messages(url, text="Describe this image in detail."):
+    return [{"role": "user", "content": [
+        {"type": "image_url", "image_url": {"url": url}},
+        {"type": "text", "text": text},
+    ]}]
+
+
+def test_resized_and_reencoded_copies_hit():
+    cache = ResponseCache()
+    cache.put(cache.make_key(_messages(_photo()), PARAMS), {"content": "a sun"})
+
+    for variant in (_photo(size=(320, 240)), _photo(fmt="PNG"), _photo(quality=40)):
+        hit = cache.get(cache.make_key(_messages(variant, "  describe this image in DETAIL. "), PARAMS))
+        assert hit == {"content": "a sun"}
+    assert cache.summary()["hit_rate"] == 1.0
+
+
+def test_different_image_prompt_or_params_miss():
+    cache = ResponseCache()
+    cache.put(cache.make_key(_messages(_photo()), PARAMS), {"content": "a sun"})
+
+    assert cache.get(cache.make_key(_messages(_photo(shift=200)), PARAMS)) is None
+    assert cache.get(cache.make_key(_messages(_photo(), "What text is visible?"), PARAMS)) is None
+    assert cache.get(cache.make_key(_messages(_photo()), dict(PARAMS, max_tokens=64))) is None
+    assert cache.summary()["misses"] == 3
+
+
+def test_lru_and_ttl_eviction():
+    cache = ResponseCache(max_entries=2, ttl=0.05)
+    keys = [cache.make_key([{"role": "user", "content": f"q{i}"}], PARAMS) for i in range(3)]
+    for i, key in enumerate(keys):
+        cache.put(key, {"content": str(i)})
+
+    assert cache.get(keys[0]) is None
+    assert cache.get(keys[2]) == {"content": "2"}
+    time.sleep(0.06)
+    assert cache.get(keys[2]) is None
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    first = ResponseCache(disk_path=path)
+    first.put(first.make_key(_messages(_photo()), PARAMS), {"content": "a sun"})
+
+    second = ResponseCache(disk_path=path)
+    assert second.get(second.make_key(_messages(_photo(size=(320, 240))), PARAMS)) == {"content": "a sun"}
+    assert second.summary()["disk_hits"] == 1
+
+
+def test_is_cacheable():
+    assert is_cacheable({"temperature": 0.0})
+    assert not is_cacheable({"temperature": 0.7})
+    assert is_cacheable({"temperature": 0.7}, opt_in=True)
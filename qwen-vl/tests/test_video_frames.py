@@ -0,0 +1,60 @@
+import io
+import os
+import sys
+
+import pytest
+
+av = pytest.importorskip("av")
+import numpy as np  # noqa: E402
+from PIL import Image  # noqa: E402
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from video_frames import PATCH_SIZE, sample_video  # noqa: E402
+
+
+def synthetic_clip(seconds=4, fps=10, width=320, height=240):
+    """MPEG-4 clip whose frame brightness encodes the frame index"""
+    buffer = io.BytesIO()
+    with av.open(buffer, mode="w", format="mp4") as container:
+        stream = container.add_stream("mpeg4", rate=fps)
+        stream.width, stream.height = width, height
+        stream.pix_fmt = "yuv420p"
+        for i in range(seconds * fps):
+            pixels = np.full((height, width, 3), i * 255 // (seconds * fps), dtype=np.uint8)
+            for packet in stream.encode(av.VideoFrame.from_ndarray(pixels, format="rgb24")):
+                container.mux(packet)
+        for packet in stream.encode():
+            container.mux(packet)
+    buffer.seek(0)
+    return buffer
+
+
+def test_samples_at_requested_fps():
+    sample = sample_video(synthetic_clip(seconds=4, fps=10), fps=2.0, max_frames=16,
+                          max_pixels=128 * 128)
+
+    assert sample.source_fps == pytest.approx(10)
+    assert sample.sample_fps == pytest.approx(2.0)
+    assert len(sample.frames_jpeg) == 8
+    assert sample.decoded_frames == 40
+    assert sample.width % PATCH_SIZE == 0 and sample.width * sample.height <= 128 * 128
+    # Frames are in order, half a second apart
+    brightness = [Image.open(io.BytesIO(f)).convert("L").getpixel((0, 0)) for f in sample.frames_jpeg]
+    assert brightness == sorted(brightness)
+    assert sample.to_data_url().startswith("data:video/jpeg;base64,")
+
+
+def test_max_frames_stretches_the_interval():
+    sample = sample_video(synthetic_clip(seconds=4, fps=10), fps=5.0, max_frames=4)
+
+    assert len(sample.frames_jpeg) == 4
+    assert sample.sample_fps == pytest.approx(1.0, rel=0.1)
+    # The samples still span the clip rather than stopping after 0.8s
+    last = Image.open(io.BytesIO(sample.frames_jpeg[-1])).convert("L").getpixel((0, 0))
+    assert last > 150
+
+
+def test_rejects_undecodable_input():
+    with pytest.raises(ValueError):
+        sample_video(io.BytesIO(b"definitely not a video" * 100))
@@ -0,0 +1,119 @@
+"""
+Client-side video preprocessing for Qwen2.5-VL.
+
+Decodes an uploaded video frame by frame with PyAV, keeps only the frames
+sampled at the requested rate, resizes them to a pixel budget and packs them
+as a JPEG frame list that vLLM accepts as a video:
+
+    {"type": "video_url", "video_url": {"url": "data:video/jpeg;base64,<f1>,<f2>,..."}}
+
+Only the sampled, already-resized frames are held in memory; decoded frames
+are dropped as soon as they have been inspected.
+"""
+
+import base64
+import io
+import math
+import time
+from dataclasses import dataclass, field
+from typing import Any, BinaryIO, Dict, List, Optional, Union
+
+# Qwen2.5-VL works on 28x28 pixel patches
+PATCH_SIZE = 28
+
+
+@dataclass
+class VideoSample:
+    """Sampled frames plus what it took to produce them"""
+    frames_jpeg: List[bytes] = field(default_factory=list)
+    width: int = 0
+    height: int = 0
+    source_fps: Optional[float] = None
+    duration: Optional[float] = None
+    sample_fps: float = 0.0
+    decoded_frames: int = 0
+    preprocess_time: float = 0.0
+
+    @property
+    def payload_bytes(self) -> int:
+        """Size of the base64 frame list sent in the request"""
+        separators = max(0, len(self.frames_jpeg) - 1)
+        return sum(4 * math.ceil(len(f) / 3) for f in self.frames_jpeg) + separators
+
+    def to_data_url(self) -> str:
+        return "data:video/jpeg;base64," + ",".join(
+            base64.b64encode(f).decode() for f in self.frames_jpeg
+        )
+
+    def to_content_part(self) -> Dict[str, Any]:
+        return {"type": "video_url", "video_url": {"url": self.to_data_url()}}
+
+
+def fit_to_pixel_budget(width: int, height: int, max_pixels: int) -> tuple:
+    """Scale (width, height) down to at most max_pixels, snapped to the patch grid"""
+    scale = min(1.0, math.sqrt(max_pixels / float(width * height)))
+    new_width = max(PATCH_SIZE, int(width * scale) // PATCH_SIZE * PATCH_SIZE)
+    new_height = max(PATCH_SIZE, int(height * scale) // PATCH_SIZE * PATCH_SIZE)
+    return new_width, new_height
+
+
+def sample_video(source: Union[str, BinaryIO], fps: float = 1.0, max_frames: int = 16,
+                 max_pixels: int = 448 * 448, jpeg_quality: int = 85) -> VideoSample:
+    """
+    Sample frames from a video file or file-like object.
+
+    Frames are taken every 1/fps seconds; if that would exceed max_frames for
+    the whole video, the interval is stretched so the samples still span the
+    full duration. Raises ValueError for input that is not a decodable video.
+    """
+    try:
+        import av
+    except ImportError as e:
+        raise RuntimeError("Video support requires PyAV: pip install av") from e
+
+    start_time = time.perf_counter()
+    sample = VideoSample()
+
+    # av.error.InvalidDataError (undecodable input) is a ValueError
+    with av.open(source) as container:
+        if not container.streams.video:
+            raise ValueError("File contains no video stream")
+        stream = container.streams.video[0]
+        stream.thread_type = "AUTO"
+
+        if stream.average_rate:
+            sample.source_fps = float(stream.average_rate)
+        if stream.duration and stream.time_base:
+            sample.duration = float(stream.duration * stream.time_base)
+        elif container.duration:
+            sample.duration = container.duration / av.time_base
+
+        interval = 1.0 / fps
+        if sample.duration and sample.duration * fps > max_frames:
+            interval = sample.duration / max_frames
+        sample.sample_fps = 1.0 / interval
+
+        next_time = 0.0
+        for frame in container.decode(stream):
+            sample.decoded_frames += 1
+            if frame.time is None or frame.time + 1e-6 < next_time:
+                continue
+
+            if not sample.width:
+                sample.width, sample.height = fit_to_pixel_budget(
+                    frame.width, frame.height, max_pixels
+                )
+            image = frame.to_image(width=sample.width, height=sample.height)
+            buffered = io.BytesIO()
+            image.save(buffered, format="JPEG", quality=jpeg_quality)
+            sample.frames_jpeg.append(buffered.getvalue())
+
+            while next_time <= frame.time:
+                next_time += interval
+            if len(sample.frames_jpeg) >= max_frames:
+                break
+
+    if not sample.frames_jpeg:
+        raise ValueError("No decodable video frames")
+    sample.preprocess_time = time.perf_counter() - start_time
+    return sample